@@ -1,9 +1,21 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from documents.models import Document, DocumentPermission
-from spreadsheets.models import Spreadsheet, SpreadsheetPermission
+from django.db import transaction
+from django.db.models import Case, Count, Prefetch, Value, When
+from django.urls import reverse
+from django.utils.html import format_html_join
+from documents.models import Document, DocumentPermission, DocumentComment, DocumentVersion
+from spreadsheets.models import Spreadsheet, SpreadsheetPermission, SpreadsheetComment, SpreadsheetVersion
 from notifications.models import Notification
+from collaboration.utils import notify_permission_changed
+from functools import partial
+
+
+def _raw_delete(queryset):
+    """Issue a single DELETE for the queryset and return the row count"""
+    return queryset._raw_delete(queryset.db)
+
 
 # Unregister the default User admin
 admin.site.unregister(User)
@@ -16,48 +28,140 @@ class UserAdmin(BaseUserAdmin):
     list_filter = ('is_staff', 'is_superuser', 'is_active', 'date_joined')
     search_fields = ('username', 'first_name', 'last_name', 'email')
     ordering = ('-date_joined',)
+    # No FK columns in list_display; add them here if that changes
+    list_select_related = ()
+    list_per_page = 50
     
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
         ('Personal info', {'fields': ('first_name', 'last_name', 'email')}),
         ('Permissions', {'fields': ('is_active', 'is_staff', 'is_superuser', 'groups', 'user_permissions')}),
         ('Important dates', {'fields': ('last_login', 'date_joined')}),
+        ('Owned content', {'fields': ('owned_documents_list', 'owned_spreadsheets_list')}),
     )
     
-    readonly_fields = ('last_login', 'date_joined')
+    readonly_fields = ('last_login', 'date_joined', 'owned_documents_list', 'owned_spreadsheets_list')
+    
+    def get_queryset(self, request):
+        """Annotate owned object counts so the changelist doesn't query per row"""
+        queryset = super().get_queryset(request).annotate(
+            _doc_count=Count('owned_documents', distinct=True),
+            _sheet_count=Count('owned_spreadsheets', distinct=True),
+        )
+        # The changelist only renders list_display columns; the change form
+        # needs the full row, so only narrow the SELECT for the list page
+        match = request.resolver_match
+        if match and match.url_name == 'auth_user_changelist':
+            queryset = queryset.only(
+                'id', 'username', 'email', 'first_name', 'last_name',
+                'is_staff', 'is_active', 'date_joined',
+            )
+        else:
+            # The change form lists owned content; fetch just enough to link it
+            queryset = queryset.prefetch_related(
+                Prefetch('owned_documents', queryset=Document.objects.only('id', 'title', 'owner_id')),
+                Prefetch('owned_spreadsheets', queryset=Spreadsheet.objects.only('id', 'title', 'owner_id')),
+            )
+        return queryset
     
     def document_count(self, obj):
         """Count of documents owned by user"""
-        return obj.owned_documents.count()
+        return obj._doc_count
     document_count.short_description = 'Documents'
+    document_count.admin_order_field = '_doc_count'
     
     def spreadsheet_count(self, obj):
         """Count of spreadsheets owned by user"""
-        return obj.owned_spreadsheets.count()
+        return obj._sheet_count
     spreadsheet_count.short_description = 'Spreadsheets'
+    spreadsheet_count.admin_order_field = '_sheet_count'
     
-    actions = ['activate_users', 'deactivate_users', 'delete_user_data']
+    def owned_documents_list(self, obj):
+        """Links to the documents owned by user"""
+        return format_html_join(', ', '<a href="{}">{}</a>', (
+            (reverse('admin:documents_document_change', args=[doc.id]), doc.title)
+            for doc in obj.owned_documents.all()
+        )) or '-'
+    owned_documents_list.short_description = 'Documents'
+    
+    def owned_spreadsheets_list(self, obj):
+        """Links to the spreadsheets owned by user"""
+        return format_html_join(', ', '<a href="{}">{}</a>', (
+            (reverse('admin:spreadsheets_spreadsheet_change', args=[sheet.id]), sheet.title)
+            for sheet in obj.owned_spreadsheets.all()
+        )) or '-'
+    owned_spreadsheets_list.short_description = 'Spreadsheets'
+    
+    actions = ['activate_users', 'deactivate_users', 'toggle_active_users', 'delete_user_data']
+    
+    def _set_active(self, request, queryset, active):
+        """Set is_active on the selected users in a single UPDATE"""
+        updated = queryset.update(is_active=active)
+        state = 'activated' if active else 'deactivated'
+        self.message_user(request, f'{updated} user(s) {state} successfully.')
     
     def activate_users(self, request, queryset):
         """Activate selected users"""
-        updated = queryset.update(is_active=True)
-        self.message_user(request, f'{updated} user(s) activated successfully.')
+        self._set_active(request, queryset, True)
     activate_users.short_description = 'Activate selected users'
     
     def deactivate_users(self, request, queryset):
         """Deactivate selected users"""
-        updated = queryset.update(is_active=False)
-        self.message_user(request, f'{updated} user(s) deactivated successfully.')
+        self._set_active(request, queryset, False)
     deactivate_users.short_description = 'Deactivate selected users'
     
+    def toggle_active_users(self, request, queryset):
+        """Flip is_active on a mixed selection in one UPDATE ... CASE statement"""
+        updated = queryset.update(is_active=Case(
+            When(is_active=True, then=Value(False)),
+            default=Value(True),
+        ))
+        self.message_user(request, f'{updated} user(s) toggled successfully.')
+    toggle_active_users.short_description = 'Toggle active status of selected users'
+    
     def delete_user_data(self, request, queryset):
         """Delete all documents and spreadsheets owned by selected users"""
-        doc_count = 0
-        sheet_count = 0
-        for user in queryset:
-            doc_count += user.owned_documents.count()
-            sheet_count += user.owned_spreadsheets.count()
-            user.owned_documents.all().delete()
-            user.owned_spreadsheets.all().delete()
+        # Deletes go straight to SQL via _raw_delete, skipping Django's collector:
+        # no per-row model instances and no pre/post_delete signals. That
+        # bypasses the collaboration receivers (collaboration/signals.py), so
+        # the affected cached roles and live sockets are notified explicitly
+        # below. The database doesn't cascade, so child tables are purged
+        # explicitly before their parents.
+        user_ids = list(queryset.values_list('id', flat=True))
+        with transaction.atomic():
+            # (room, user) for every sharee and owner losing access, read
+            # before the rows go
+            revoked = [
+                (f'document_{document_id}', user_id)
+                for document_id, user_id in DocumentPermission.objects.filter(
+                    document__owner_id__in=user_ids,
+                ).values_list('document_id', 'user_id')
+            ]
+            revoked += [
+                (f'document_{document_id}', owner_id)
+                for document_id, owner_id in Document.objects.filter(
+                    owner_id__in=user_ids,
+                ).values_list('id', 'owner_id')
+            ]
+            revoked += [
+                (f'spreadsheet_{spreadsheet_id}', user_id)
+                for spreadsheet_id, user_id in SpreadsheetPermission.objects.filter(
+                    spreadsheet__owner_id__in=user_ids,
+                ).values_list('spreadsheet_id', 'user_id')
+            ]
+            revoked += [
+                (f'spreadsheet_{spreadsheet_id}', owner_id)
+                for spreadsheet_id, owner_id in Spreadsheet.objects.filter(
+                    owner_id__in=user_ids,
+                ).values_list('id', 'owner_id')
+            ]
+            for child in (DocumentPermission, DocumentComment, DocumentVersion):
+                _raw_delete(child.objects.filter(document__owner_id__in=user_ids))
+            for child in (SpreadsheetPermission, SpreadsheetComment, SpreadsheetVersion):
+                _raw_delete(child.objects.filter(spreadsheet__owner_id__in=user_ids))
+            doc_count = _raw_delete(Document.objects.filter(owner_id__in=user_ids))
+            sheet_count = _raw_delete(Spreadsheet.objects.filter(owner_id__in=user_ids))
+            for room_group_name, user_id in revoked:
+                transaction.on_commit(partial(notify_permission_changed, room_group_name, user_id))
         self.message_user(request, f'Deleted {doc_count} document(s) and {sheet_count} spreadsheet(s).')
     delete_user_data.short_description = 'Delete all data owned by selected users'
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.8 on 2026-10-15 10:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    # auth_user.email has no index by default; registration and profile
+    # updates look users up by email, so add one on the contrib table.
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE INDEX IF NOT EXISTS accounts_user_email_idx ON auth_user (email);",
+            reverse_sql="DROP INDEX IF EXISTS accounts_user_email_idx;",
+        ),
+    ]
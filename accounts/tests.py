@@ -5,17 +5,27 @@ Tests user registration, login, logout, and profile management
 
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 import json
 
 
+# Resolve the endpoint URLs once at import instead of in every test
+REGISTER_URL = reverse('accounts:register')
+LOGIN_URL = reverse('accounts:login')
+LOGOUT_URL = reverse('accounts:logout')
+PROFILE_URL = reverse('accounts:profile')
+
+
 class UserModelTests(TestCase):
     """Test User model functionality"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='testuser',
             email='test@example.com',
             password='testpass123'
@@ -35,65 +45,72 @@ class UserModelTests(TestCase):
 class UserRegistrationAPITests(TestCase):
     """Test user registration API endpoints"""
     
-    def setUp(self):
-        """Set up test client"""
-        self.client = APIClient()
-        self.register_url = '/api/accounts/register/'
+    client_class = APIClient
+    register_url = REGISTER_URL
     
-    def test_registration_success(self):
-        """Test successful user registration"""
-        data = {
-            'username': 'newuser',
-            'email': 'newuser@example.com',
-            'password': 'securepass123'
-        }
-        response = self.client.post(self.register_url, data, format='json')
+    @classmethod
+    def setUpTestData(cls):
+        """Set up test data"""
+        User.objects.create_user(
+            username='existing',
+            email='existing@example.com',
+            password='pass123'
+        )
+    
+    def test_registration(self):
+        """Test registration success, missing fields and duplicate username in one pass"""
+        cases = [
+            ('success', {
+                'username': 'newuser',
+                'email': 'newuser@example.com',
+                'password': 'securepass123'
+            }, status.HTTP_201_CREATED),
+            ('missing fields', {'username': 'newuser'}, status.HTTP_400_BAD_REQUEST),
+            ('duplicate username', {
+                'username': 'existing',
+                'email': 'new@example.com',
+                'password': 'pass123'
+            }, status.HTTP_400_BAD_REQUEST),
+        ]
+        responses = {}
+        for label, data, expected_status in cases:
+            with self.subTest(label):
+                response = self.client.post(self.register_url, data, format='json')
+                self.assertEqual(response.status_code, expected_status)
+                responses[label] = response
         
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = responses['success']
         self.assertIn('id', response.data)
         self.assertEqual(response.data['username'], 'newuser')
         self.assertEqual(response.data['email'], 'newuser@example.com')
-        
         # Verify user was created in database
         self.assertTrue(User.objects.filter(username='newuser').exists())
-    
-    def test_registration_missing_fields(self):
-        """Test registration with missing fields"""
-        data = {'username': 'newuser'}
-        response = self.client.post(self.register_url, data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-    
-    def test_registration_duplicate_username(self):
-        """Test registration with duplicate username"""
-        User.objects.create_user(
-            username='existing',
-            email='existing@example.com',
-            password='pass123'
-        )
         
-        data = {
-            'username': 'existing',
-            'email': 'new@example.com',
-            'password': 'pass123'
-        }
-        response = self.client.post(self.register_url, data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = responses['duplicate username']
         self.assertIn('error', response.data)
+        self.assertEqual(response.data['error'], 'Username already exists')
+        self.assertEqual(User.objects.filter(username='existing').count(), 1)
 
 
 class UserLoginAPITests(TestCase):
     """Test user login API endpoints"""
     
-    def setUp(self):
+    client_class = APIClient
+    login_url = LOGIN_URL
+    
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.client = APIClient()
-        self.login_url = '/api/accounts/login/'
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='testuser',
             email='test@example.com',
             password='testpass123'
         )
     
+    def setUp(self):
+        """Reset the failed-login cache between tests"""
+        cache.clear()
+    
     def test_login_success(self):
         """Test successful login"""
         data = {
@@ -117,6 +134,34 @@ class UserLoginAPITests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertIn('error', response.data)
     
+    def test_login_repeated_failure_skips_authenticate(self):
+        """Test that an identical failed attempt is rejected from the cache"""
+        from unittest import mock
+        data = {
+            'username': 'testuser',
+            'password': 'wrongpassword'
+        }
+        self.client.post(self.login_url, data, format='json')
+        
+        with mock.patch('accounts.views.authenticate') as mock_authenticate:
+            response = self.client.post(self.login_url, data, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        mock_authenticate.assert_not_called()
+    
+    def test_login_success_after_failure(self):
+        """Test that a failed attempt doesn't block the correct password"""
+        self.client.post(self.login_url, {
+            'username': 'testuser',
+            'password': 'wrongpassword'
+        }, format='json')
+        response = self.client.post(self.login_url, {
+            'username': 'testuser',
+            'password': 'testpass123'
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
     def test_login_missing_fields(self):
         """Test login with missing fields"""
         data = {'username': 'testuser'}
@@ -127,11 +172,13 @@ class UserLoginAPITests(TestCase):
 class UserLogoutAPITests(TestCase):
     """Test user logout API endpoints"""
     
-    def setUp(self):
+    client_class = APIClient
+    logout_url = LOGOUT_URL
+    
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.client = APIClient()
-        self.logout_url = '/api/accounts/logout/'
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='testuser',
             email='test@example.com',
             password='testpass123'
@@ -155,11 +202,13 @@ class UserLogoutAPITests(TestCase):
 class UserProfileAPITests(TestCase):
     """Test user profile API endpoints"""
     
-    def setUp(self):
+    client_class = APIClient
+    profile_url = PROFILE_URL
+    
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.client = APIClient()
-        self.profile_url = '/api/accounts/profile/'
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='testuser',
             email='test@example.com',
             password='testpass123'
@@ -179,3 +228,91 @@ class UserProfileAPITests(TestCase):
         response = self.client.get(self.profile_url, format='json')
         # DRF returns 403 Forbidden for unauthenticated requests with IsAuthenticated permission
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class UserAdminTests(TestCase):
+    """Test the customized User admin"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        """Set up test data"""
+        cls.admin_user = User.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            password='adminpass123'
+        )
+    
+    def setUp(self):
+        """Log the admin in"""
+        self.client.force_login(self.admin_user)
+    
+    def test_changelist_annotates_owned_counts(self):
+        """Test that document/spreadsheet counts come from the annotated queryset"""
+        from documents.models import Document
+        from spreadsheets.models import Spreadsheet
+        Document.objects.create(owner=self.admin_user, title='Doc 1')
+        Document.objects.create(owner=self.admin_user, title='Doc 2')
+        Spreadsheet.objects.create(owner=self.admin_user, title='Sheet 1')
+        
+        response = self.client.get('/admin/auth/user/')
+        self.assertEqual(response.status_code, 200)
+        
+        user = response.context['cl'].result_list[0]
+        self.assertEqual(user._doc_count, 2)
+        self.assertEqual(user._sheet_count, 1)
+        # Columns not shown on the changelist are not fetched
+        self.assertIn('password', user.get_deferred_fields())
+    
+    def test_delete_user_data_action(self):
+        """Test that the bulk delete action removes only the selected users' data"""
+        from documents.models import Document, DocumentPermission
+        from spreadsheets.models import Spreadsheet
+        other = User.objects.create_user(
+            username='other',
+            email='other@example.com',
+            password='pass123'
+        )
+        Document.objects.create(owner=self.admin_user, title='Doc 1')
+        doc = Document.objects.create(owner=other, title='Doc 2')
+        Spreadsheet.objects.create(owner=other, title='Sheet 1')
+        DocumentPermission.objects.create(document=doc, user=self.admin_user, role='viewer')
+        
+        response = self.client.post('/admin/auth/user/', {
+            'action': 'delete_user_data',
+            '_selected_action': [other.id],
+        }, follow=True)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Deleted 1 document(s) and 1 spreadsheet(s).')
+        self.assertFalse(Document.objects.filter(owner=other).exists())
+        self.assertFalse(Spreadsheet.objects.filter(owner=other).exists())
+        self.assertFalse(DocumentPermission.objects.filter(document_id=doc.id).exists())
+        self.assertTrue(Document.objects.filter(owner=self.admin_user).exists())
+    
+    def test_toggle_active_users_action(self):
+        """Test that the toggle action flips a mixed selection in one go"""
+        active = User.objects.create_user(username='active', password='pass123')
+        inactive = User.objects.create_user(username='inactive', password='pass123', is_active=False)
+        
+        self.client.post('/admin/auth/user/', {
+            'action': 'toggle_active_users',
+            '_selected_action': [active.id, inactive.id],
+        })
+        
+        active.refresh_from_db()
+        inactive.refresh_from_db()
+        self.assertFalse(active.is_active)
+        self.assertTrue(inactive.is_active)
+    
+    def test_change_form_lists_owned_content(self):
+        """Test that the change form shows owned documents and spreadsheets"""
+        from documents.models import Document
+        from spreadsheets.models import Spreadsheet
+        Document.objects.create(owner=self.admin_user, title='Owned Doc')
+        Spreadsheet.objects.create(owner=self.admin_user, title='Owned Sheet')
+        
+        response = self.client.get(f'/admin/auth/user/{self.admin_user.id}/change/')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Owned Doc')
+        self.assertContains(response, 'Owned Sheet')
@@ -4,13 +4,35 @@ from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.contrib import messages
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
+from django.utils.crypto import salted_hmac
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-import json
+
+# How long a failed username/password/IP combination is remembered so that
+# identical retries are rejected without running the password hasher again
+LOGIN_FAILURE_CACHE_TIMEOUT = 5
+
+
+def _login_failure_cache_key(request, username, password):
+    """Cache key for a failed login attempt (keyed HMAC, never the raw password)"""
+    ip = request.META.get('REMOTE_ADDR', '')
+    digest = salted_hmac('accounts.login_failure', f'{username}\0{password}\0{ip}').hexdigest()
+    return f'login_failure:{digest}'
+
+
+def _user_payload(user):
+    """Response body shared by the register, login and profile endpoints"""
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+    }
 
 
 @api_view(['POST'])
@@ -27,19 +49,18 @@ def register(request):
         if not all([username, email, password]):
             return Response({'error': 'Missing fields'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if User.objects.filter(username=username).exists():
+        # Rely on the unique constraint on username instead of checking first
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(username=username, email=email, password=password)
+        except IntegrityError:
             return Response({'error': 'Username already exists'}, status=status.HTTP_400_BAD_REQUEST)
         
-        user = User.objects.create_user(username=username, email=email, password=password)
         login(request, user)
         # Explicitly save the session to ensure cookie is set
         request.session.save()
         
-        return Response({
-            'id': user.id,
-            'username': user.username,
-            'email': user.email
-        }, status=status.HTTP_201_CREATED)
+        return Response(_user_payload(user), status=status.HTTP_201_CREATED)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -57,16 +78,17 @@ def login_view(request):
         if not username or not password:
             return Response({'error': 'Username and password are required'}, status=status.HTTP_400_BAD_REQUEST)
         
+        failure_key = _login_failure_cache_key(request, username, password)
+        if cache.get(failure_key):
+            return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+        
         user = authenticate(request, username=username, password=password)
         if user is not None:
             login(request, user)
             # Explicitly save the session to ensure cookie is set
             request.session.save()
-            return Response({
-                'id': user.id,
-                'username': user.username,
-                'email': user.email
-            })
+            return Response(_user_payload(user))
+        cache.set(failure_key, True, LOGIN_FAILURE_CACHE_TIMEOUT)
         return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -85,19 +107,9 @@ def logout_view(request):
 @permission_classes([IsAuthenticated])
 def profile_view(request):
     """Get user profile"""
-    # The @permission_classes([IsAuthenticated]) decorator already checks authentication
-    # But we'll add an extra check to ensure the user is authenticated
-    if not request.user or not request.user.is_authenticated:
-        return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
-    
-    # Ensure session is saved (this extends the session lifetime)
-    request.session.save()
-    
-    return Response({
-        'id': request.user.id,
-        'username': request.user.username,
-        'email': request.user.email
-    })
+    # IsAuthenticated rejects anonymous requests before we get here, and
+    # SESSION_SAVE_EVERY_REQUEST already extends the session lifetime
+    return Response(_user_payload(request.user))
 
 
 class UserRegistrationView:
@@ -114,33 +126,33 @@ class UserRegistrationView:
             password1 = request.POST.get('password1')
             password2 = request.POST.get('password2')
             
-            # Validation
+            # Validation - collect errors and re-render instead of redirecting
+            errors = []
             if not all([username, email, password1, password2]):
-                messages.error(request, 'All fields are required.')
-                return redirect('accounts:register')
-            
-            if password1 != password2:
-                messages.error(request, 'Passwords do not match.')
-                return redirect('accounts:register')
-            
-            if len(password1) < 8:
-                messages.error(request, 'Password must be at least 8 characters.')
-                return redirect('accounts:register')
-            
-            if User.objects.filter(username=username).exists():
-                messages.error(request, 'Username already exists.')
-                return redirect('accounts:register')
+                errors.append('All fields are required.')
+            else:
+                if password1 != password2:
+                    errors.append('Passwords do not match.')
+                
+                if len(password1) < 8:
+                    errors.append('Password must be at least 8 characters.')
+                
+                if not errors and User.objects.filter(email=email).exists():
+                    errors.append('Email already registered.')
             
-            if User.objects.filter(email=email).exists():
-                messages.error(request, 'Email already registered.')
-                return redirect('accounts:register')
+            if errors:
+                return render(request, 'accounts/register.html', {'errors': errors}, status=400)
             
-            # Create user
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password1
-            )
+            # Create user (the unique constraint on username catches duplicates)
+            try:
+                with transaction.atomic():
+                    user = User.objects.create_user(
+                        username=username,
+                        email=email,
+                        password=password1
+                    )
+            except IntegrityError:
+                return render(request, 'accounts/register.html', {'errors': ['Username already exists.']}, status=400)
             
             messages.success(request, 'Registration successful! Please log in.')
             return redirect('accounts:login')
@@ -204,7 +216,7 @@ def profile_view_old(request):
         user.first_name = first_name
         user.last_name = last_name
         user.email = email
-        user.save()
+        user.save(update_fields=['first_name', 'last_name', 'email'])
         
         messages.success(request, 'Profile updated successfully.')
         return redirect('accounts:profile')
@@ -224,21 +236,23 @@ def change_password_view(request):
         new_password1 = request.POST.get('new_password1')
         new_password2 = request.POST.get('new_password2')
         
-        # Validate old password
-        if not request.user.check_password(old_password):
-            messages.error(request, 'Old password is incorrect.')
-            return redirect('accounts:change-password')
-        
+        # Validation - collect errors and re-render instead of redirecting
+        errors = []
         if new_password1 != new_password2:
-            messages.error(request, 'New passwords do not match.')
-            return redirect('accounts:change-password')
+            errors.append('New passwords do not match.')
+        
+        if len(new_password1 or '') < 8:
+            errors.append('Password must be at least 8 characters.')
+        
+        # Only pay for the password hash once the cheap checks pass
+        if not errors and not request.user.check_password(old_password):
+            errors.append('Old password is incorrect.')
         
-        if len(new_password1) < 8:
-            messages.error(request, 'Password must be at least 8 characters.')
-            return redirect('accounts:change-password')
+        if errors:
+            return render(request, 'accounts/change_password.html', {'errors': errors}, status=400)
         
         request.user.set_password(new_password1)
-        request.user.save()
+        request.user.save(update_fields=['password'])
         
         # Re-authenticate the user
         login(request, request.user)
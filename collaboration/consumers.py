@@ -1,17 +1,357 @@
-import json
+import asyncio
+import functools
+import typing
+import msgpack
+import msgspec
+import orjson
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
-from documents.models import Document
-from spreadsheets.models import Spreadsheet
+from django.core.cache import cache
+from django.db import NotSupportedError, transaction
+from django.db.models import F
+from django.utils import timezone
+from documents.models import Document, DocumentPermission
+from spreadsheets.models import Spreadsheet, SpreadsheetPermission
+from spreadsheets.utils import apply_cell_changes, cell_changes_patch, is_valid_cell_change
+from .messages import CellUpdate, ContentPatch, ContentUpdate, SelectionUpdate, TitleUpdate
+from .presence import PRESENCE_HEARTBEAT_SECONDS, get_presence
+from .utils import ROLE_CACHE_TIMEOUT, role_cache_key
 
+__all__ = ['CollaborationConsumer', 'DocumentConsumer', 'SpreadsheetConsumer']
 
-class DocumentConsumer(AsyncWebsocketConsumer):
+
+# Clients that offer this WebSocket subprotocol get binary MessagePack frames;
+# everyone else keeps JSON text frames
+MSGPACK_SUBPROTOCOL = 'msgpack'
+
+# Roles allowed to persist changes over the socket
+EDIT_ROLES = ('owner', 'editor')
+
+# Window in which edits received over the socket are coalesced into one write
+SAVE_DEBOUNCE_SECONDS = 0.5
+
+# Per-connection memory of the last value sent for each cell, used to drop
+# repeated cell updates
+LAST_CELL_VALUES_MAX = 1024
+_MISSING = object()
+
+# Window in which a connection's outgoing edits are merged into one group_send
+BROADCAST_DELAY_SECONDS = 0.025
+
+# Broadcasts whose list field (value) accumulates within the window; every
+# other type carries full state, so only the latest payload of that type is sent
+APPENDING_BROADCASTS = {'cell_change': 'changes', 'content_patch': 'ops'}
+
+# Broadcasts whose payload field (value) recipients read as well as forward;
+# it travels in the group event next to the frames, so no frame is decoded
+RECIPIENT_FIELDS = {'content_update': 'content', 'content_patch': 'ops'}
+
+# Upper bound on broadcast events coalesced into a single 'batch' frame
+BATCH_MAX_EVENTS = 128
+
+# Incoming frames larger than this many bytes (UTF-8, for text frames) are
+# dropped before they are decoded
+MAX_FRAME_SIZE = 1024 * 1024
+
+# First byte of a MessagePack map (fixmap, map16 or map32)
+_MSGPACK_MAP_PREFIX = (0xde, 0xdf)
+
+
+def _apply_content_patch(content, start, delete, length, insert):
+    """
+    Apply a ContentPatch splice to content, or return None if it doesn't fit.
+    Offsets are UTF-16 code units; ASCII HTML (the common case) is spliced directly.
+    """
+    if content is None or start < 0 or delete < 0 or start + delete > length:
+        return None
+    if content.isascii():
+        if len(content) != length:
+            return None
+        return content[:start] + insert + content[start + delete:]
+    units = content.encode('utf-16-le')
+    if len(units) != 2 * length:
+        return None
+    try:
+        return (units[:2 * start] + insert.encode('utf-16-le') + units[2 * (start + delete):]).decode('utf-16-le')
+    except UnicodeError:
+        return None
+
+
+def _dumps(payload):
+    """Serialize an outgoing WebSocket payload to a JSON text frame"""
+    return orjson.dumps(payload).decode()
+
+
+def _encode_frames(payload):
+    """
+    Encode a broadcast payload once in both wire formats.
+    The frames travel through the channel layer so each recipient only
+    picks the one it negotiated instead of re-serializing the payload.
+    """
+    return {
+        'json': _dumps(payload),
+        'msgpack': msgpack.packb(payload),
+    }
+
+
+def _recipient_fields(event_type, payload):
+    """The RECIPIENT_FIELDS entry of a broadcast payload, as group event fields"""
+    key = RECIPIENT_FIELDS.get(event_type)
+    return {key: payload[key]} if key else {}
+
+
+@functools.lru_cache(maxsize=1024)
+def _presence_frames(event_type, username):
+    """Frames for user_joined/user_left, which only vary by username"""
+    return _encode_frames({'type': event_type, 'username': username})
+
+
+def _batch_frames(frames, use_msgpack):
+    """Splice pre-encoded frames into one 'batch' frame without decoding them"""
+    if use_msgpack:
+        packer = msgpack.Packer()
+        return b''.join([
+            packer.pack_map_header(2),
+            packer.pack('type'),
+            packer.pack('batch'),
+            packer.pack('events'),
+            packer.pack_array_header(len(frames)),
+            *(frame['msgpack'] for frame in frames),
+        ])
+    return '{"type":"batch","events":[' + ','.join(frame['json'] for frame in frames) + ']}'
+
+
+class CollaborationConsumer(AsyncWebsocketConsumer):
+    """
+    Shared wire-format handling for the collaboration consumers.
+    Negotiates MessagePack vs JSON at connect and encodes/decodes frames.
+    """
+    
+    use_msgpack = False
+    
+    # Message structs (see messages.py) this consumer accepts from clients
+    message_types = ()
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.message_types:
+            message_union = typing.Union[cls.message_types]
+            cls._json_decoder = msgspec.json.Decoder(message_union)
+            cls._msgpack_decoder = msgspec.msgpack.Decoder(message_union)
+    
+    async def accept(self, subprotocol=None):
+        self.use_msgpack = MSGPACK_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        if self.use_msgpack:
+            subprotocol = MSGPACK_SUBPROTOCOL
+        await super().accept(subprotocol)
+        self._out_queue = asyncio.Queue()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        self._pending_broadcasts = {}
+        self._broadcast_task = None
+    
+    async def stop_batching(self):
+        """Stop the outgoing batch flusher and send any buffered edits (called on disconnect)"""
+        flusher = getattr(self, '_flusher', None)
+        if flusher:
+            flusher.cancel()
+            self._flusher = None
+        if getattr(self, '_broadcast_task', None):
+            self._broadcast_task.cancel()
+            await self.flush_broadcasts()
+    
+    def queue_broadcast(self, event_type, payload):
+        """Buffer a broadcast for BROADCAST_DELAY_SECONDS so bursts go out as one group_send"""
+        pending = self._pending_broadcasts.get(event_type)
+        if pending is not None and event_type in APPENDING_BROADCASTS:
+            key = APPENDING_BROADCASTS[event_type]
+            pending[key].extend(payload[key])
+        else:
+            self._pending_broadcasts[event_type] = payload
+        if self._broadcast_task is None:
+            self._broadcast_task = asyncio.create_task(self._broadcast_after_delay())
+    
+    async def _broadcast_after_delay(self):
+        """Wait for the broadcast window, then send what accumulated"""
+        await asyncio.sleep(BROADCAST_DELAY_SECONDS)
+        await self.flush_broadcasts()
+    
+    async def flush_broadcasts(self):
+        """Send the broadcasts buffered since the last flush"""
+        pending, self._pending_broadcasts = self._pending_broadcasts, {}
+        self._broadcast_task = None
+        if len(pending) == 1:
+            [(event_type, payload)] = pending.items()
+            await self.broadcast(event_type, payload)
+        elif pending:
+            await self.broadcast_frames('broadcast_batch', [
+                (event_type, _encode_frames(payload), _recipient_fields(event_type, payload))
+                for event_type, payload in pending.items()
+            ])
+    
+    async def broadcast_batch(self, event):
+        """Hand each broadcast of a flushed burst to its own handler"""
+        for event_type, frames, fields in event['frames']:
+            await getattr(self, event_type)({**event, **fields, 'type': event_type, 'frames': frames})
+    
+    async def broadcast(self, event_type, payload):
+        """Encode a payload once and send it to everyone else in the room"""
+        await self.broadcast_frames(event_type, _encode_frames(payload), **_recipient_fields(event_type, payload))
+    
+    async def broadcast_presence(self, event_type):
+        """Announce user_joined/user_left for this user with cached frames"""
+        await self.broadcast_frames(event_type, _presence_frames(event_type, self.user.username))
+    
+    async def broadcast_frames(self, event_type, frames, **fields):
+        """Send frames from _encode_frames (and any RECIPIENT_FIELDS) to everyone else in the room"""
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                **fields,
+                'type': event_type,
+                'frames': frames,
+                'user_id': self.user.id,
+                # Lets the sending connection drop its own echo before doing any work
+                'sender_channel': self.channel_name,
+            }
+        )
+    
+    async def get_user_role(self):
+        """
+        Get the user's role in this room, or None without access.
+        Roles are cached briefly so reconnect storms skip the permission queries;
+        collaboration.signals drops the entry whenever access changes.
+        """
+        key = role_cache_key(self.room_group_name, self.user.id)
+        role = await cache.aget(key)
+        if role is None:
+            role = await self.load_user_role() or ''
+            await cache.aset(key, role, ROLE_CACHE_TIMEOUT)
+        return role or None
+    
+    async def permission_changed(self, event):
+        """Refresh the cached role when this user's access changes"""
+        if event.get('user_id') == self.user.id:
+            self.role = await self.load_user_role()
+            if not self.role:
+                await self.close()
+    
+    async def join_presence(self):
+        """Record this connection in the room roster and keep it fresh"""
+        self._presence = get_presence()
+        await self._presence.add(self.room_group_name, self.channel_name, self.user.username)
+        self._heartbeat = asyncio.create_task(self._presence_heartbeat())
+    
+    async def _presence_heartbeat(self):
+        """Refresh the roster's expiry while this connection is open"""
+        while True:
+            await asyncio.sleep(PRESENCE_HEARTBEAT_SECONDS)
+            await self._presence.refresh(self.room_group_name)
+    
+    async def leave_presence(self):
+        """
+        Drop this connection from the roster.
+        Returns True when the user has no other connection left in the room.
+        """
+        presence = getattr(self, '_presence', None)
+        if presence is None:
+            return False
+        self._heartbeat.cancel()
+        await presence.remove(self.room_group_name, self.channel_name)
+        return self.user.username not in await presence.usernames(self.room_group_name)
+    
+    def queue_frames(self, frames):
+        """Queue pre-encoded broadcast frames; bursts are flushed as one 'batch' frame"""
+        self._out_queue.put_nowait(frames)
+    
+    async def _flush_loop(self):
+        """Send queued frames, coalescing whatever piled up during the last send"""
+        queue = self._out_queue
+        while True:
+            events = [await queue.get()]
+            while len(events) < BATCH_MAX_EVENTS and not queue.empty():
+                events.append(queue.get_nowait())
+            if len(events) == 1:
+                await self.send_frames(events[0])
+            elif self.use_msgpack:
+                await self.send(bytes_data=_batch_frames(events, True))
+            else:
+                await self.send(text_data=_batch_frames(events, False))
+    
+    def decode_frame(self, text_data=None, bytes_data=None):
+        """
+        Decode an incoming frame into one of message_types.
+        Raises ValueError on malformed input or an unknown message type.
+        """
+        if bytes_data is not None:
+            frame = bytes_data
+        elif text_data and len(text_data) <= MAX_FRAME_SIZE:
+            # The limit is in bytes, and non-ASCII characters take several
+            frame = text_data.encode()
+        else:
+            # Every character is at least one byte, so this is already too long
+            frame = text_data
+        if not frame or len(frame) > MAX_FRAME_SIZE:
+            raise ValueError('Empty or oversized frame')
+        
+        # Every message is an object, so anything else is rejected by its first byte
+        if bytes_data is not None:
+            if not (0x80 <= bytes_data[0] <= 0x8f or bytes_data[0] in _MSGPACK_MAP_PREFIX):
+                raise ValueError('Frame is not a MessagePack map')
+            decoder = self._msgpack_decoder
+        elif frame.lstrip()[:1] != b'{':
+            # JSON allows whitespace before the object
+            raise ValueError('Frame is not a JSON object')
+        else:
+            decoder = self._json_decoder
+        try:
+            return decoder.decode(frame)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e))
+    
+    async def send_payload(self, payload):
+        """Send a payload in the wire format negotiated for this connection"""
+        if self.use_msgpack:
+            await self.send(bytes_data=msgpack.packb(payload))
+        else:
+            await self.send(text_data=_dumps(payload))
+    
+    async def send_frames(self, frames):
+        """Send frames from _encode_frames in the negotiated wire format"""
+        if self.use_msgpack:
+            await self.send(bytes_data=frames['msgpack'])
+        else:
+            await self.send(text_data=frames['json'])
+    
+    async def user_joined(self, event):
+        # Send to all users except the one who joined
+        if event.get('user_id') != self.user.id:
+            await self.send_frames(event['frames'])
+    
+    async def user_left(self, event):
+        # Send to all users except the one who left
+        if event.get('user_id') != self.user.id:
+            await self.send_frames(event['frames'])
+
+
+class DocumentConsumer(CollaborationConsumer):
     """
     WebSocket consumer for real-time document collaboration.
     Handles document content updates and cursor positions.
     """
     
+    message_types = (ContentUpdate, ContentPatch, TitleUpdate)
+    
+    # Last content/title this connection broadcast, to drop editor re-emits
+    _last_content = None
+    _last_title = None
+    
+    # The HTML this connection's client has, as far as the server knows;
+    # content_patch splices are checked against and applied to it
+    _content = None
+    
+    # Pending debounced write of _content (see schedule_save)
+    _save_task = None
+    
     async def connect(self):
         self.document_id = self.scope['url_route']['kwargs']['document_id']
         self.room_group_name = f'document_{self.document_id}'
@@ -22,9 +362,10 @@ class DocumentConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        # Check if document exists and user has access
-        document = await self.get_document()
-        if not document:
+        # Resolve the user's role once; later messages authorize against it
+        # instead of querying permissions again
+        self.role = await self.get_user_role()
+        if not self.role:
             await self.close()
             return
         
@@ -35,197 +376,206 @@ class DocumentConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        await self.join_presence()
         
         # Send current document content to the new user
         await self.send_current_content()
         
         # Notify others that user joined
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_joined',
-                'username': self.user.username,
-                'user_id': self.user.id,
-            }
-        )
+        await self.broadcast_presence('user_joined')
         
         # Send list of active users
         await self.send_active_users()
     
     async def disconnect(self, close_code):
+        await self.stop_batching()
+        
+        # Persist the content if an edit is still waiting for the debounce window
+        if self._save_task:
+            self._save_task.cancel()
+            await self.flush_pending_save()
+        
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
         
-        # Notify others that user left
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_left',
-                'username': self.user.username,
-                'user_id': self.user.id,
-            }
-        )
+        # Notify others once the user's last connection to the room is gone
+        if await self.leave_presence():
+            await self.broadcast_presence('user_left')
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
+            message = self.decode_frame(text_data, bytes_data)
             
-            if message_type == 'content_update':
-                # Broadcast IMMEDIATELY to all users - no database save here
-                # Database saves are handled by frontend with debouncing
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'content_update',
-                        'content': data.get('content', ''),
-                        'document_id': self.document_id,
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                    }
+            if isinstance(message, ContentUpdate):
+                self._content = message.content
+                # Editors re-emit unchanged content (focus, no-op edits)
+                if message.content == self._last_content:
+                    return
+                self._last_content = message.content
+                
+                # Full content supersedes any splices still buffered
+                self._pending_broadcasts.pop('content_patch', None)
+                # Broadcast to all users within BROADCAST_DELAY_SECONDS; the
+                # database write is debounced separately
+                self.queue_broadcast('content_update', {
+                    'type': 'content_update',
+                    'content': message.content,
+                })
+                self.schedule_save()
+                
+            elif isinstance(message, ContentPatch):
+                content = _apply_content_patch(
+                    self._content, message.start, message.delete, message.length, message.insert
                 )
-                # No database save here - frontend handles it with debouncing
+                if content is None:
+                    # The client edited a different base than ours; have it send full content
+                    self._content = None
+                    await self.send_payload({'type': 'content_resync'})
+                    return
+                self._content = self._last_content = content
                 
-            elif message_type == 'title_update':
-                # Broadcast IMMEDIATELY to all users - no database save here
+                if 'content_update' in self._pending_broadcasts:
+                    # A full update is still buffered; fold the edit into it
+                    self.queue_broadcast('content_update', {
+                        'type': 'content_update',
+                        'content': content,
+                    })
+                else:
+                    self.queue_broadcast('content_patch', {
+                        'type': 'content_patch',
+                        'ops': [{
+                            'start': message.start,
+                            'delete': message.delete,
+                            'length': message.length,
+                            'insert': message.insert,
+                        }],
+                    })
+                self.schedule_save()
+                
+            elif isinstance(message, TitleUpdate):
+                if message.title == self._last_title:
+                    return
+                self._last_title = message.title
+                
+                # Broadcast to all users within BROADCAST_DELAY_SECONDS - no database save here
                 # Database saves are handled by frontend
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'title_update',
-                        'title': data.get('title', ''),
-                        'document_id': self.document_id,
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                    }
-                )
+                self.queue_broadcast('title_update', {
+                    'type': 'title_update',
+                    'title': message.title,
+                })
                 # No database save here - frontend handles it
                 
-        except json.JSONDecodeError:
+        except ValueError:
             pass
     
     async def content_update(self, event):
-        # Don't send back to the sender
-        if event.get('user_id') != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'content_update',
-                'content': event.get('content', ''),
-            }))
+        # Don't echo back to the connection that sent it
+        if event.get('sender_channel') != self.channel_name:
+            # Someone else changed the content, so our last value may need resending
+            self._last_content = None
+            self._content = event['content']
+            self.queue_frames(event['frames'])
     
-    async def title_update(self, event):
-        # Don't send back to the sender
-        if event.get('user_id') != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'title_update',
-                'title': event.get('title', ''),
-            }))
+    async def content_patch(self, event):
+        if event.get('sender_channel') != self.channel_name:
+            self._last_content = None
+            content = self._content
+            for op in event['ops']:
+                content = _apply_content_patch(content, op['start'], op['delete'], op['length'], op['insert'])
+            # None when our copy had diverged; the client's next splice then gets a content_resync
+            self._content = content
+            self.queue_frames(event['frames'])
     
-    async def user_joined(self, event):
-        # Send to all users except the one who joined
-        if event.get('user_id') != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'user_joined',
-                'username': event.get('username', ''),
-            }))
-    
-    async def user_left(self, event):
-        # Send to all users except the one who left
-        if event.get('user_id') != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'user_left',
-                'username': event.get('username', ''),
-            }))
+    async def title_update(self, event):
+        # Don't echo back to the connection that sent it
+        if event.get('sender_channel') != self.channel_name:
+            self._last_title = None
+            self.queue_frames(event['frames'])
     
     async def send_current_content(self):
         """Send current document content to the newly connected user"""
         document = await self.get_document()
         if document:
-            await self.send(text_data=json.dumps({
+            self._content = document.content or '<p></p>'
+            await self.send_payload({
                 'type': 'content_update',
-                'content': document.content or '<p></p>',
-            }))
-            await self.send(text_data=json.dumps({
+                'content': self._content,
+            })
+            await self.send_payload({
                 'type': 'title_update',
                 'title': document.title or 'Untitled Document',
-            }))
+            })
     
     async def send_active_users(self):
         """Send list of active users in the room"""
-        # Get active users from channel layer (simplified - in production, track this properly)
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'active_users',
-            'users': [self.user.username],
-        }))
+            'users': await self._presence.usernames(self.room_group_name),
+        })
     
     @database_sync_to_async
-    def get_document(self):
-        """Get document and check permissions"""
-        try:
-            document = Document.objects.get(id=self.document_id)
-            # Check if user has access
-            if document.owner == self.user:
-                return document
-            # Check if user has permission
-            from documents.models import DocumentPermission
-            if DocumentPermission.objects.filter(document=document, user=self.user).exists():
-                return document
-            return None
-        except Document.DoesNotExist:
+    def load_user_role(self):
+        """Query the user's role on the document, or None without access"""
+        owner_id = Document.objects.filter(id=self.document_id).values_list('owner_id', flat=True).first()
+        if owner_id is None:
             return None
+        if owner_id == self.user.id:
+            return 'owner'
+        return DocumentPermission.objects.filter(
+            document_id=self.document_id,
+            user_id=self.user.id
+        ).values_list('role', flat=True).first()
     
     @database_sync_to_async
-    def save_document_content(self, content):
-        """Save document content to database"""
-        try:
-            document = Document.objects.get(id=self.document_id)
-            # Only save if user has edit permission
-            if document.owner == self.user:
-                document.content = content
-                document.save()
-            else:
-                from documents.models import DocumentPermission
-                permission = DocumentPermission.objects.filter(
-                    document=document, 
-                    user=self.user
-                ).first()
-                if permission and permission.role in ['owner', 'editor']:
-                    document.content = content
-                    document.save()
-        except Document.DoesNotExist:
-            pass
+    def get_document(self):
+        """Get document (access is checked once in connect)"""
+        return Document.objects.filter(id=self.document_id).first()
+    
+    def schedule_save(self):
+        """Write the content once SAVE_DEBOUNCE_SECONDS after the first unsaved edit"""
+        if self.role in EDIT_ROLES and self._save_task is None:
+            self._save_task = asyncio.create_task(self._debounced_save())
+    
+    async def _debounced_save(self):
+        """Wait for the debounce window, then write the latest content"""
+        await asyncio.sleep(SAVE_DEBOUNCE_SECONDS)
+        await self.flush_pending_save()
+    
+    async def flush_pending_save(self):
+        """Write the content as it stands after the edits since the last flush"""
+        self._save_task = None
+        if self._content is not None:
+            await self.save_document_content(self._content)
     
     @database_sync_to_async
-    def save_document_title(self, title):
-        """Save document title to database"""
-        try:
-            document = Document.objects.get(id=self.document_id)
-            # Only save if user has edit permission
-            if document.owner == self.user:
-                document.title = title
-                document.save()
-            else:
-                from documents.models import DocumentPermission
-                permission = DocumentPermission.objects.filter(
-                    document=document, 
-                    user=self.user
-                ).first()
-                if permission and permission.role in ['owner', 'editor']:
-                    document.title = title
-                    document.save()
-        except Document.DoesNotExist:
-            pass
+    def save_document_content(self, content):
+        """Save document content to database"""
+        # Only save if user has edit permission
+        if self.role in EDIT_ROLES:
+            Document.objects.filter(id=self.document_id).update(
+                content=content,
+                preview=content[:Document.PREVIEW_LENGTH],
+                last_edited_by_id=self.user.id,
+                updated_at=timezone.now(),
+            )
 
 
-class SpreadsheetConsumer(AsyncWebsocketConsumer):
+class SpreadsheetConsumer(CollaborationConsumer):
     """
     WebSocket consumer for real-time spreadsheet collaboration.
     Handles cell updates and formula recalculations.
     """
     
+    message_types = (CellUpdate, SelectionUpdate)
+    
+    _save_task = None
+    
     async def connect(self):
+        self._pending_changes = []
+        self._last_cell_values = {}
         self.spreadsheet_id = self.scope['url_route']['kwargs']['spreadsheet_id']
         self.room_group_name = f'spreadsheet_{self.spreadsheet_id}'
         self.user = self.scope['user']
@@ -235,9 +585,10 @@ class SpreadsheetConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        # Check if spreadsheet exists and user has access
-        spreadsheet = await self.get_spreadsheet()
-        if not spreadsheet:
+        # Resolve the user's role once; later messages authorize against it
+        # instead of querying permissions again
+        self.role = await self.get_user_role()
+        if not self.role:
             await self.close()
             return
         
@@ -248,153 +599,159 @@ class SpreadsheetConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        await self.join_presence()
         
         # Send current spreadsheet data to the new user
         await self.send_current_data()
         
         # Notify others that user joined
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_joined',
-                'username': self.user.username,
-                'user_id': self.user.id,
-            }
-        )
+        await self.broadcast_presence('user_joined')
     
     async def disconnect(self, close_code):
+        await self.stop_batching()
+        
+        # Persist any edits still waiting for the debounce window
+        if self._save_task:
+            self._save_task.cancel()
+            await self.flush_pending_changes()
+        
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
         
-        # Notify others that user left
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_left',
-                'username': self.user.username,
-                'user_id': self.user.id,
-            }
-        )
+        # Notify others once the user's last connection to the room is gone
+        if await self.leave_presence():
+            await self.broadcast_presence('user_left')
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
+            message = self.decode_frame(text_data, bytes_data)
             
-            if message_type == 'cell_update':
+            if isinstance(message, CellUpdate):
+                # Drop cells that can't be stored (and so can't be broadcast
+                # as JSON either), and those whose value didn't change since
+                # we last sent them
+                changes = [
+                    change for change in message.changes
+                    if is_valid_cell_change(change) and self.is_new_cell_value(change)
+                ]
+                if not changes:
+                    return
+                
                 # Broadcast cell update to all users in the room
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'cell_change',
-                        'changes': data.get('changes', []),
-                        'spreadsheet_id': self.spreadsheet_id,
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                    }
-                )
+                self.queue_broadcast('cell_change', {
+                    'type': 'cell_change',
+                    'changes': list(changes),
+                })
                 
-                # Save to database
-                await self.save_spreadsheet_data(data.get('changes', []))
+                # Save to database, coalescing bursts of edits into one write
+                self._pending_changes.extend(changes)
+                if self._save_task is None:
+                    self._save_task = asyncio.create_task(self._debounced_save())
                 
-            elif message_type == 'selection_update':
+            elif isinstance(message, SelectionUpdate):
                 # Broadcast selection update to all users in the room
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'selection_change',
-                        'selection': data.get('selection', {}),
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                    }
-                )
+                self.queue_broadcast('selection_change', {
+                    'type': 'selection_change',
+                    'selection': message.selection,
+                })
                 
-        except json.JSONDecodeError:
+        except ValueError:
             pass
     
     async def cell_change(self, event):
-        # Don't send back to the sender
-        if event.get('user_id') != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'cell_change',
-                'changes': event.get('changes', []),
-            }))
+        # Don't echo back to the connection that sent it
+        if event.get('sender_channel') != self.channel_name:
+            # Another user's edit may have overwritten cells we remember
+            self._last_cell_values.clear()
+            self.queue_frames(event['frames'])
     
-    async def selection_change(self, event):
-        # Don't send back to the sender
-        if event.get('user_id') != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'selection_change',
-                'selection': event.get('selection', {}),
-            }))
-    
-    async def user_joined(self, event):
-        # Send to all users except the one who joined
-        if event.get('user_id') != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'user_joined',
-                'username': event.get('username', ''),
-            }))
+    def is_new_cell_value(self, change):
+        """Record a cell change; False if it repeats the value last sent for that cell"""
+        value = change.get('value')
+        key = (change.get('sheet', 0), change.get('row'), change.get('col'))
+        try:
+            last = self._last_cell_values.get(key, _MISSING)
+        except TypeError:
+            # Unhashable coordinates; let the save path reject them
+            return True
+        if type(last) is type(value) and last == value:
+            return False
+        if len(self._last_cell_values) >= LAST_CELL_VALUES_MAX:
+            self._last_cell_values.clear()
+        self._last_cell_values[key] = value
+        return True
     
-    async def user_left(self, event):
-        # Send to all users except the one who left
-        if event.get('user_id') != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'user_left',
-                'username': event.get('username', ''),
-            }))
+    async def selection_change(self, event):
+        # Don't echo back to the connection that sent it
+        if event.get('sender_channel') != self.channel_name:
+            self.queue_frames(event['frames'])
     
     async def send_current_data(self):
         """Send current spreadsheet data to the newly connected user"""
         spreadsheet = await self.get_spreadsheet()
         if spreadsheet:
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'data_update',
                 'data': spreadsheet.data or {'sheets': [{'name': 'Sheet1', 'data': [[]]}]},
-            }))
+            })
     
     @database_sync_to_async
-    def get_spreadsheet(self):
-        """Get spreadsheet and check permissions"""
-        try:
-            spreadsheet = Spreadsheet.objects.get(id=self.spreadsheet_id)
-            # Check if user has access
-            if spreadsheet.owner == self.user:
-                return spreadsheet
-            # Check if user has permission
-            from spreadsheets.models import SpreadsheetPermission
-            if SpreadsheetPermission.objects.filter(spreadsheet=spreadsheet, user=self.user).exists():
-                return spreadsheet
-            return None
-        except Spreadsheet.DoesNotExist:
+    def load_user_role(self):
+        """Query the user's role on the spreadsheet, or None without access"""
+        owner_id = Spreadsheet.objects.filter(id=self.spreadsheet_id).values_list('owner_id', flat=True).first()
+        if owner_id is None:
             return None
+        if owner_id == self.user.id:
+            return 'owner'
+        return SpreadsheetPermission.objects.filter(
+            spreadsheet_id=self.spreadsheet_id,
+            user_id=self.user.id
+        ).values_list('role', flat=True).first()
+    
+    @database_sync_to_async
+    def get_spreadsheet(self):
+        """Get spreadsheet (access is checked once in connect)"""
+        return Spreadsheet.objects.filter(id=self.spreadsheet_id).first()
+    
+    async def _debounced_save(self):
+        """Wait for the debounce window, then write the accumulated changes"""
+        await asyncio.sleep(SAVE_DEBOUNCE_SECONDS)
+        await self.flush_pending_changes()
+    
+    async def flush_pending_changes(self):
+        """Write the changes received since the last flush"""
+        changes, self._pending_changes = self._pending_changes, []
+        self._save_task = None
+        if changes:
+            await self.save_spreadsheet_data(changes)
     
     @database_sync_to_async
     def save_spreadsheet_data(self, changes):
         """Save spreadsheet data to database"""
-        try:
-            spreadsheet = Spreadsheet.objects.get(id=self.spreadsheet_id)
-            # Only save if user has edit permission
-            if spreadsheet.owner == self.user:
-                # Apply changes to spreadsheet data
-                # For simplicity, we'll update the entire data structure
-                # In production, you'd apply changes more surgically
-                if changes:
-                    # Update the data JSON with changes
-                    # This is a simplified version - in production, handle this more carefully
-                    spreadsheet.last_edited_by = self.user
-                    spreadsheet.save()
-            else:
-                from spreadsheets.models import SpreadsheetPermission
-                permission = SpreadsheetPermission.objects.filter(
-                    spreadsheet=spreadsheet, 
-                    user=self.user
-                ).first()
-                if permission and permission.role in ['owner', 'editor']:
-                    spreadsheet.last_edited_by = self.user
-                    spreadsheet.save()
-        except Spreadsheet.DoesNotExist:
-            pass
+        # Only save if user has edit permission
+        if not changes or self.role not in EDIT_ROLES:
+            return
+        
+        spreadsheets = Spreadsheet.objects.filter(id=self.spreadsheet_id)
+        fields = {'last_edited_by_id': self.user.id, 'updated_at': timezone.now()}
+        
+        # Common case: every edited cell is already in the grid, so the whole
+        # batch is patched by the database in a single UPDATE
+        patch = cell_changes_patch(F('data'), changes)
+        if patch is not None:
+            data, cells_exist = patch
+            try:
+                if spreadsheets.filter(*cells_exist).update(data=data, **fields):
+                    return
+            except NotSupportedError:
+                pass
+        
+        with transaction.atomic():
+            # Lock the row so concurrent editors don't overwrite each other's cells
+            rows = list(spreadsheets.select_for_update().values_list('data', flat=True))
+            if not rows:
+                return
+            spreadsheets.update(data=apply_cell_changes(rows[0] or {}, changes), **fields)
@@ -0,0 +1,77 @@
+"""
+Channel layer used in production (see CHANNEL_LAYERS in docshub/settings.py)
+
+channels_redis's pub/sub layer publishes one message per round trip and holds
+a per-shard lock while it waits, so concurrent group_sends from one worker
+queue up behind each other. This layer lets them pile up instead and sends
+everything waiting for a shard in one pipelined round trip, in order.
+"""
+import asyncio
+
+from channels_redis.pubsub import RedisPubSubChannelLayer, RedisPubSubLoopLayer
+from channels_redis.utils import _wrap_close
+
+
+class BatchedRedisPubSubLoopLayer(RedisPubSubLoopLayer):
+    """Per-event-loop layer that pipelines PUBLISHes per shard"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # shard -> [(channel, payload, future)] waiting for the next pipeline
+        self._pending_publishes = {}
+
+    async def send(self, channel, message):
+        """Send a message onto a (general or specific) channel"""
+        await self._publish(channel, self.channel_layer.serialize(message))
+
+    async def group_send(self, group, message):
+        """Send the message to all subscribers of the group"""
+        group_channel = self._get_group_channel_name(group)
+        await self._publish(group_channel, self.channel_layer.serialize(message))
+
+    async def _publish(self, channel, payload):
+        shard = self._get_shard(channel)
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending_publishes.setdefault(shard, [])
+        pending.append((channel, payload, future))
+        if len(pending) == 1:
+            # First message since the last pipeline started; later ones join it
+            asyncio.ensure_future(self._drain(shard))
+        await future
+
+    async def _drain(self, shard):
+        """Publish everything queued for a shard, one pipeline per round trip"""
+        async with shard._lock:
+            batch = self._pending_publishes.pop(shard, [])
+            try:
+                shard._ensure_redis()
+                async with shard._redis.pipeline(transaction=False) as pipe:
+                    for channel, payload, _ in batch:
+                        pipe.publish(channel, payload)
+                    await pipe.execute()
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+
+class BatchedRedisPubSubChannelLayer(RedisPubSubChannelLayer):
+    """RedisPubSubChannelLayer whose per-loop layers pipeline their PUBLISHes"""
+
+    def _get_layer(self):
+        loop = asyncio.get_running_loop()
+        try:
+            layer = self._layers[loop]
+        except KeyError:
+            layer = BatchedRedisPubSubLoopLayer(
+                *self._args,
+                **self._kwargs,
+                channel_layer=self,
+            )
+            self._layers[loop] = layer
+            _wrap_close(self, loop)
+        return layer
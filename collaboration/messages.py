@@ -0,0 +1,40 @@
+"""
+Typed client -> server WebSocket messages
+
+Each message is tagged by its 'type' field, so decoding a frame against a
+union of these structs validates the fields and picks the message class in
+one pass. Unknown fields (e.g. document_id sent by the frontend) are ignored.
+"""
+import msgspec
+
+
+class ContentUpdate(msgspec.Struct, tag='content_update'):
+    """Full document HTML after a local edit"""
+    content: str = ''
+
+
+class ContentPatch(msgspec.Struct, tag='content_patch'):
+    """
+    Splice of the document HTML after a local edit: replace `delete` characters
+    at `start` with `insert`. Offsets count UTF-16 code units, as JavaScript
+    strings do, and `length` is the HTML's length before the splice.
+    """
+    start: int
+    delete: int
+    length: int
+    insert: str = ''
+
+
+class TitleUpdate(msgspec.Struct, tag='title_update'):
+    """New document title"""
+    title: str = ''
+
+
+class CellUpdate(msgspec.Struct, tag='cell_update'):
+    """Spreadsheet cell edits as {'row', 'col', 'value', 'sheet'?} dicts"""
+    changes: list[dict] = []
+
+
+class SelectionUpdate(msgspec.Struct, tag='selection_update'):
+    """The user's current spreadsheet selection"""
+    selection: dict = {}
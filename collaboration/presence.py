@@ -0,0 +1,81 @@
+"""
+Room presence tracking for the collaboration consumers
+
+Each connection is recorded under its channel name so a user with several
+tabs open stays present until the last one disconnects. Uses a Redis hash
+per room when the channel layer runs on Redis, and a process-local dict
+otherwise (tests and single-process development).
+"""
+from django.conf import settings
+
+# Presence keys expire unless a connection in the room refreshes them
+PRESENCE_TTL_SECONDS = 120
+PRESENCE_HEARTBEAT_SECONDS = 30
+
+_backend = None
+
+
+def _presence_key(room):
+    return f'presence:{room}'
+
+
+class RedisPresence:
+    """Presence stored as a Redis hash of channel name -> username"""
+
+    def __init__(self, url):
+        import redis.asyncio as aioredis
+        self.redis = aioredis.from_url(url, decode_responses=True)
+
+    async def add(self, room, channel_name, username):
+        key = _presence_key(room)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, channel_name, username)
+            pipe.expire(key, PRESENCE_TTL_SECONDS)
+            await pipe.execute()
+
+    async def refresh(self, room):
+        await self.redis.expire(_presence_key(room), PRESENCE_TTL_SECONDS)
+
+    async def remove(self, room, channel_name):
+        await self.redis.hdel(_presence_key(room), channel_name)
+
+    async def usernames(self, room):
+        return sorted(set(await self.redis.hvals(_presence_key(room))))
+
+
+class LocalPresence:
+    """Presence kept in this process; only valid with the in-memory channel layer"""
+
+    def __init__(self):
+        self.rooms = {}
+
+    async def add(self, room, channel_name, username):
+        self.rooms.setdefault(room, {})[channel_name] = username
+
+    async def refresh(self, room):
+        pass
+
+    async def remove(self, room, channel_name):
+        members = self.rooms.get(room, {})
+        members.pop(channel_name, None)
+        if not members:
+            self.rooms.pop(room, None)
+
+    async def usernames(self, room):
+        return sorted(set(self.rooms.get(room, {}).values()))
+
+
+def get_presence():
+    """Return the presence backend matching the configured channel layer"""
+    global _backend
+    layer = settings.CHANNEL_LAYERS.get('default', {})
+    use_redis = 'hosts' in layer.get('CONFIG', {})
+    if _backend is None or isinstance(_backend, RedisPresence) != use_redis:
+        if use_redis:
+            host = layer.get('CONFIG', {}).get('hosts', [('127.0.0.1', 6379)])[0]
+            if isinstance(host, (list, tuple)):
+                host = f'redis://{host[0]}:{host[1]}/0'
+            _backend = RedisPresence(host)
+        else:
+            _backend = LocalPresence()
+    return _backend
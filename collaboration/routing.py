@@ -1,7 +1,7 @@
-from django.urls import re_path
+from django.urls import path
 from . import consumers
 
 websocket_urlpatterns = [
-    re_path(r'ws/document/(?P<document_id>\d+)/$', consumers.DocumentConsumer.as_asgi()),
-    re_path(r'ws/spreadsheet/(?P<spreadsheet_id>\d+)/$', consumers.SpreadsheetConsumer.as_asgi()),
+    path('ws/document/<int:document_id>/', consumers.DocumentConsumer.as_asgi()),
+    path('ws/spreadsheet/<int:spreadsheet_id>/', consumers.SpreadsheetConsumer.as_asgi()),
 ]
@@ -0,0 +1,43 @@
+"""
+Keep the consumers' cached roles in step with permission changes
+
+Permission rows changed through the ORM (API, views, admin forms, cascades from
+a deleted document) go through these receivers, so the cached role for that
+user is dropped and live sockets re-check their access once the change commits.
+Bulk writes and raw deletes send no signals and call notify_permission_changed
+themselves: document_share's bulk upsert, and the admin's "Delete all data
+owned by selected users" action (accounts/admin.py).
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from documents.models import Document, DocumentPermission
+from spreadsheets.models import Spreadsheet, SpreadsheetPermission
+
+from .utils import notify_permission_changed
+
+
+def _notify_on_commit(room_group_name, user_id):
+    transaction.on_commit(lambda: notify_permission_changed(room_group_name, user_id))
+
+
+@receiver([post_save, post_delete], sender=DocumentPermission)
+def document_permission_changed(sender, instance, **kwargs):
+    _notify_on_commit(f'document_{instance.document_id}', instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=SpreadsheetPermission)
+def spreadsheet_permission_changed(sender, instance, **kwargs):
+    _notify_on_commit(f'spreadsheet_{instance.spreadsheet_id}', instance.user_id)
+
+
+@receiver(post_delete, sender=Document)
+def document_deleted(sender, instance, **kwargs):
+    # The owner's cached 'owner' role would otherwise outlive the document
+    _notify_on_commit(f'document_{instance.id}', instance.owner_id)
+
+
+@receiver(post_delete, sender=Spreadsheet)
+def spreadsheet_deleted(sender, instance, **kwargs):
+    _notify_on_commit(f'spreadsheet_{instance.id}', instance.owner_id)
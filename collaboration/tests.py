@@ -7,8 +7,10 @@ If channels.testing is not available, these tests will be skipped.
 Tests use in-memory channel layer to avoid requiring Redis.
 """
 
-from django.test import TestCase, TransactionTestCase, override_settings
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from collaboration import presence
 from channels.db import database_sync_to_async
 from documents.models import Document, DocumentPermission
 from spreadsheets.models import Spreadsheet
@@ -18,51 +20,24 @@ import unittest
 # Try to import channels.testing, skip tests if not available
 try:
     from channels.testing import WebsocketCommunicator
-    from channels.layers import InMemoryChannelLayer
     CHANNELS_TESTING_AVAILABLE = True
 except ImportError:
     CHANNELS_TESTING_AVAILABLE = False
     print("Warning: channels.testing not available. WebSocket tests will be skipped.")
 
-# Create in-memory channel layer for testing
 if CHANNELS_TESTING_AVAILABLE:
-    # Import ASGI application after setting up channel layer
-    import os
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'docshub.settings')
-    import django
-    django.setup()
-    
-    from channels.routing import ProtocolTypeRouter, URLRouter
-    from channels.auth import AuthMiddlewareStack
-    from django.core.asgi import get_asgi_application
-    import collaboration.routing
-    
-    # Use in-memory channel layer for tests
-    test_channel_layer = InMemoryChannelLayer()
-    
-    # Create test ASGI application with in-memory channel layer
-    django_asgi_app = get_asgi_application()
-    test_application = ProtocolTypeRouter({
-        "http": django_asgi_app,
-        "websocket": AuthMiddlewareStack(
-            URLRouter(
-                collaboration.routing.websocket_urlpatterns
-            )
-        ),
-    })
+    # The test runner puts the whole suite on the in-memory channel layer
+    from docshub.asgi import application as test_application
 
 
 @unittest.skipIf(not CHANNELS_TESTING_AVAILABLE, "channels.testing not available")
-@override_settings(CHANNEL_LAYERS={
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-})
-class DocumentConsumerTests(TransactionTestCase):
+class DocumentConsumerTests(TestCase):
     """Test DocumentConsumer WebSocket functionality"""
     
     def setUp(self):
         """Set up test data"""
+        cache.clear()
+        presence._backend = None
         self.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
@@ -152,19 +127,508 @@ class DocumentConsumerTests(TransactionTestCase):
         # Should close connection for users without permission
         self.assertFalse(connected)
     
+    async def test_content_updates_batched_in_order(self):
+        """Test that a burst of updates collapses to the latest content, in order"""
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='editor'
+        )
+        
+        owner_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        owner_comm.scope['user'] = self.owner
+        await owner_comm.connect()
+        user_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        user_comm.scope['user'] = self.user
+        await user_comm.connect()
+        for _ in range(4):
+            await owner_comm.receive_json_from()
+        for _ in range(3):
+            await user_comm.receive_json_from()
+        
+        for i in range(5):
+            await owner_comm.send_json_to({'type': 'content_update', 'content': f'<p>{i}</p>'})
+        
+        # A burst collapses to the latest content; whatever arrives is in order
+        contents = []
+        while contents[-1:] != ['<p>4</p>']:
+            response = await user_comm.receive_json_from()
+            events = response['events'] if response['type'] == 'batch' else [response]
+            contents.extend(event['content'] for event in events)
+        self.assertEqual(contents, sorted(set(contents)))
+        self.assertLess(len(contents), 5)
+        
+        await owner_comm.disconnect()
+        await user_comm.disconnect()
+    
+    async def test_permission_revoked_closes_socket(self):
+        """Test that a permission_changed event re-checks the cached role"""
+        from channels.layers import get_channel_layer
+        permission = await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='editor'
+        )
+        
+        communicator = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        communicator.scope['user'] = self.user
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        for _ in range(3):
+            await communicator.receive_json_from()
+        
+        await database_sync_to_async(permission.delete)()
+        await get_channel_layer().group_send(f'document_{self.document.id}', {
+            'type': 'permission_changed',
+            'user_id': self.user.id,
+        })
+        
+        output = await communicator.receive_output()
+        self.assertEqual(output['type'], 'websocket.close')
+    
+    async def test_connect_msgpack_subprotocol(self):
+        """Test that clients offering the msgpack subprotocol get binary frames"""
+        import msgpack
+        communicator = WebsocketCommunicator(
+            test_application,
+            f'/ws/document/{self.document.id}/',
+            subprotocols=['msgpack']
+        )
+        communicator.scope['user'] = self.owner
+        
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, 'msgpack')
+        
+        response = msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual(response['type'], 'content_update')
+        self.assertEqual(response['content'], '<p>Initial content</p>')
+        
+        await communicator.disconnect()
+    
+    async def test_content_update_broadcast(self):
+        """Test that a content update reaches other users but not the sender"""
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='editor'
+        )
+        
+        owner_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        owner_comm.scope['user'] = self.owner
+        await owner_comm.connect()
+        user_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        user_comm.scope['user'] = self.user
+        await user_comm.connect()
+        
+        # Drain the initial content/title/active users frames and join notifications
+        for _ in range(4):
+            await owner_comm.receive_json_from()
+        for _ in range(3):
+            await user_comm.receive_json_from()
+        
+        await owner_comm.send_json_to({'type': 'content_update', 'content': '<p>Hello</p>'})
+        response = await user_comm.receive_json_from()
+        self.assertEqual(response, {'type': 'content_update', 'content': '<p>Hello</p>'})
+        self.assertTrue(await owner_comm.receive_nothing())
+        
+        await owner_comm.disconnect()
+        await user_comm.disconnect()
+    
+
+    
+    async def test_content_patch_broadcast(self):
+        """Test that splices are applied to the known content and broadcast as ops"""
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='editor'
+        )
+        owner_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        owner_comm.scope['user'] = self.owner
+        await owner_comm.connect()
+        user_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        user_comm.scope['user'] = self.user
+        await user_comm.connect()
+        for _ in range(4):
+            await owner_comm.receive_json_from()
+        for _ in range(3):
+            await user_comm.receive_json_from()
+        
+        # '<p>Initial content</p>' -> '<p>Initial content!</p>' -> '<p>Initial content!?</p>'
+        first = {'start': 18, 'delete': 0, 'length': 22, 'insert': '!'}
+        second = {'start': 19, 'delete': 0, 'length': 23, 'insert': '?'}
+        await owner_comm.send_json_to({'type': 'content_patch', **first})
+        await owner_comm.send_json_to({'type': 'content_patch', **second})
+        response = await user_comm.receive_json_from()
+        self.assertEqual(response, {'type': 'content_patch', 'ops': [first, second]})
+        self.assertTrue(await owner_comm.receive_nothing())
+        
+        # The receiving connection tracks the patched content, so its splices apply too
+        await user_comm.send_json_to({'type': 'content_patch', 'start': 3, 'delete': 7, 'length': 24, 'insert': ''})
+        response = await owner_comm.receive_json_from()
+        self.assertEqual(response['ops'][0]['length'], 24)
+        
+        # A splice against the wrong length asks the sender for its full content
+        await owner_comm.send_json_to({'type': 'content_patch', 'start': 0, 'delete': 0, 'length': 99, 'insert': 'x'})
+        response = await owner_comm.receive_json_from()
+        self.assertEqual(response, {'type': 'content_resync'})
+        self.assertTrue(await user_comm.receive_nothing())
+        
+        await owner_comm.disconnect()
+        await user_comm.disconnect()
+    
+    async def test_content_update_reaches_same_users_other_tab(self):
+        """Test that only the sending connection is skipped, not the sending user"""
+        first_tab = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        first_tab.scope['user'] = self.owner
+        await first_tab.connect()
+        second_tab = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        second_tab.scope['user'] = self.owner
+        await second_tab.connect()
+        for _ in range(3):
+            await first_tab.receive_json_from()
+            await second_tab.receive_json_from()
+        
+        await first_tab.send_json_to({'type': 'content_update', 'content': '<p>Tab</p>'})
+        response = await second_tab.receive_json_from()
+        self.assertEqual(response, {'type': 'content_update', 'content': '<p>Tab</p>'})
+        self.assertTrue(await first_tab.receive_nothing())
+        
+        await first_tab.disconnect()
+        await second_tab.disconnect()
+    
+    async def test_active_users_roster(self):
+        """Test that active_users lists everyone connected to the room"""
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='viewer'
+        )
+        
+        owner_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        owner_comm.scope['user'] = self.owner
+        await owner_comm.connect()
+        for _ in range(3):
+            await owner_comm.receive_json_from()
+        
+        user_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        user_comm.scope['user'] = self.user
+        await user_comm.connect()
+        await user_comm.receive_json_from()
+        await user_comm.receive_json_from()
+        response = await user_comm.receive_json_from()
+        self.assertEqual(response['type'], 'active_users')
+        self.assertEqual(response['users'], ['owner', 'user'])
+        
+        await owner_comm.disconnect()
+        await user_comm.disconnect()
+    
+    async def test_user_left_after_last_tab(self):
+        """Test that user_left is only sent once the user's last connection closes"""
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='viewer'
+        )
+        
+        owner_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        owner_comm.scope['user'] = self.owner
+        await owner_comm.connect()
+        tabs = []
+        for _ in range(2):
+            tab = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+            tab.scope['user'] = self.user
+            await tab.connect()
+            tabs.append(tab)
+        for _ in range(5):
+            await owner_comm.receive_json_from()
+        
+        await tabs[0].disconnect()
+        self.assertTrue(await owner_comm.receive_nothing())
+        await tabs[1].disconnect()
+        response = await owner_comm.receive_json_from()
+        self.assertEqual(response, {'type': 'user_left', 'username': 'user'})
+        
+        await owner_comm.disconnect()
+    
+    async def test_content_saved_once_per_window(self):
+        """Test that a burst of edits is persisted as one write of the final content"""
+        from unittest import mock
+        from collaboration.consumers import DocumentConsumer
+        communicator = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        communicator.scope['user'] = self.owner
+        await communicator.connect()
+        for _ in range(3):
+            await communicator.receive_json_from()
+        
+        with mock.patch.object(DocumentConsumer, 'save_document_content') as save:
+            for n in range(3):
+                await communicator.send_json_to({'type': 'content_update', 'content': f'<p>{n}</p>'})
+            await communicator.send_json_to({'type': 'content_patch', 'start': 4, 'delete': 0, 'length': 8, 'insert': '!'})
+            await communicator.disconnect()
+        
+        save.assert_called_once_with('<p>2!</p>')
+    
+    async def test_content_persisted_for_editors_only(self):
+        """Test that editors' edits are written and viewers' are not"""
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='viewer'
+        )
+        communicator = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        communicator.scope['user'] = self.user
+        await communicator.connect()
+        await communicator.send_json_to({'type': 'content_update', 'content': '<p>Viewer</p>'})
+        await communicator.disconnect()
+        await database_sync_to_async(self.document.refresh_from_db)()
+        self.assertEqual(self.document.content, '<p>Initial content</p>')
+        
+        communicator = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        communicator.scope['user'] = self.owner
+        await communicator.connect()
+        await communicator.send_json_to({'type': 'content_update', 'content': '<p>Owner</p>'})
+        await communicator.disconnect()
+        await database_sync_to_async(self.document.refresh_from_db)()
+        self.assertEqual(self.document.content, '<p>Owner</p>')
+        self.assertEqual(self.document.preview, '<p>Owner</p>')
+        self.assertEqual(self.document.last_edited_by_id, self.owner.id)
+    
+    async def test_repeated_content_update_dropped(self):
+        """Test that re-sending unchanged content is not broadcast again"""
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='editor'
+        )
+        owner_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        owner_comm.scope['user'] = self.owner
+        await owner_comm.connect()
+        user_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        user_comm.scope['user'] = self.user
+        await user_comm.connect()
+        for _ in range(4):
+            await owner_comm.receive_json_from()
+        for _ in range(3):
+            await user_comm.receive_json_from()
+        
+        await owner_comm.send_json_to({'type': 'content_update', 'content': '<p>Same</p>'})
+        await owner_comm.send_json_to({'type': 'content_update', 'content': '<p>Same</p>'})
+        response = await user_comm.receive_json_from()
+        self.assertEqual(response, {'type': 'content_update', 'content': '<p>Same</p>'})
+        self.assertTrue(await user_comm.receive_nothing())
+        
+        # After a remote edit the same content counts as a change again
+        await user_comm.send_json_to({'type': 'content_update', 'content': '<p>Other</p>'})
+        await owner_comm.receive_json_from()
+        await owner_comm.send_json_to({'type': 'content_update', 'content': '<p>Same</p>'})
+        response = await user_comm.receive_json_from()
+        self.assertEqual(response, {'type': 'content_update', 'content': '<p>Same</p>'})
+        
+        await owner_comm.disconnect()
+        await user_comm.disconnect()
+    
+    async def test_content_and_title_burst(self):
+        """Test that different updates sent in one window all reach other users"""
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='editor'
+        )
+        owner_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        owner_comm.scope['user'] = self.owner
+        await owner_comm.connect()
+        user_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        user_comm.scope['user'] = self.user
+        await user_comm.connect()
+        for _ in range(4):
+            await owner_comm.receive_json_from()
+        for _ in range(3):
+            await user_comm.receive_json_from()
+        
+        await owner_comm.send_json_to({'type': 'content_update', 'content': '<p>Body</p>'})
+        await owner_comm.send_json_to({'type': 'title_update', 'title': 'Heading'})
+        events = []
+        while len(events) < 2:
+            response = await user_comm.receive_json_from()
+            events.extend(response['events'] if response['type'] == 'batch' else [response])
+        self.assertEqual(events, [
+            {'type': 'content_update', 'content': '<p>Body</p>'},
+            {'type': 'title_update', 'title': 'Heading'},
+        ])
+        
+        await owner_comm.disconnect()
+        await user_comm.disconnect()
+    
+    async def test_broadcast_encoded_once(self):
+        """Test that a broadcast is serialized once, not once per recipient"""
+        from unittest import mock
+        from collaboration import consumers
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='editor'
+        )
+        
+        owner_comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        owner_comm.scope['user'] = self.owner
+        await owner_comm.connect()
+        user_comms = []
+        for _ in range(2):
+            comm = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+            comm.scope['user'] = self.user
+            await comm.connect()
+            user_comms.append(comm)
+        
+        with mock.patch.object(consumers, '_encode_frames', wraps=consumers._encode_frames) as encode, \
+                mock.patch.object(consumers.msgpack, 'unpackb', wraps=consumers.msgpack.unpackb) as unpack:
+            await owner_comm.send_json_to({'type': 'content_update', 'content': '<p>Once</p>'})
+            for comm in user_comms:
+                while True:
+                    response = await comm.receive_json_from()
+                    if response['type'] == 'content_update' and response['content'] == '<p>Once</p>':
+                        break
+            await owner_comm.send_json_to({'type': 'content_patch', 'start': 3, 'delete': 4, 'length': 11, 'insert': 'Twice'})
+            for comm in user_comms:
+                while True:
+                    response = await comm.receive_json_from()
+                    if response['type'] == 'content_patch':
+                        break
+        encoded = [call.args[0]['type'] for call in encode.call_args_list]
+        self.assertEqual(encoded.count('content_update'), 1)
+        # Recipients read content and ops from the group event, never the frames
+        unpack.assert_not_called()
+        
+        await owner_comm.disconnect()
+        for comm in user_comms:
+            await comm.disconnect()
+
+
+@unittest.skipIf(not CHANNELS_TESTING_AVAILABLE, "channels.testing not available")
+class DocumentRoleCacheTests(TransactionTestCase):
+    """Test role cache invalidation, which runs on commit"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        presence._backend = None
+        self.owner = User.objects.create_user(
+            username='owner',
+            email='owner@example.com',
+            password='pass123'
+        )
+        self.user = User.objects.create_user(
+            username='user',
+            email='user@example.com',
+            password='pass123'
+        )
+        self.document = Document.objects.create(
+            owner=self.owner,
+            title='Test Document',
+            content='<p>Initial content</p>'
+        )
+    
+    async def test_role_cached_until_permission_changes(self):
+        """Test that connects reuse the cached role until the permission row changes"""
+        from collaboration.utils import role_cache_key
+        key = role_cache_key(f'document_{self.document.id}', self.user.id)
+        permission = await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='viewer'
+        )
+        communicator = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+        self.assertEqual(await cache.aget(key), 'viewer')
+        
+        # A queryset update sends no signals, so the cached role stays
+        await database_sync_to_async(
+            DocumentPermission.objects.filter(id=permission.id).update
+        )(role='editor')
+        self.assertEqual(await cache.aget(key), 'viewer')
+        
+        # Deleting the row (as the views and admin do) drops the cached role
+        await database_sync_to_async(permission.delete)()
+        self.assertIsNone(await cache.aget(key))
+        communicator = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+    
+    async def test_document_delete_drops_owner_role(self):
+        """Test that deleting a document clears the owner's cached role"""
+        from collaboration.utils import role_cache_key
+        key = role_cache_key(f'document_{self.document.id}', self.owner.id)
+        communicator = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+        communicator.scope['user'] = self.owner
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+        self.assertEqual(await cache.aget(key), 'owner')
+        
+        await database_sync_to_async(self.document.delete)()
+        self.assertIsNone(await cache.aget(key))
+    
+    def test_role_cache_shared_with_redis_channel_layer(self):
+        """Test that the project cache is shared across processes whenever the channel layer is"""
+        # The runner overrides CACHES, so read the project's own settings
+        from docshub import settings as project_settings
+        layer = project_settings.CHANNEL_LAYERS['default']
+        backend = project_settings.CACHES['default']['BACKEND']
+        if 'hosts' in layer.get('CONFIG', {}):
+            self.assertEqual(backend, 'django.core.cache.backends.redis.RedisCache')
+        else:
+            self.assertEqual(layer['BACKEND'], 'channels.layers.InMemoryChannelLayer')
+    
+    async def test_admin_delete_user_data_closes_sockets(self):
+        """Test that the admin's raw-delete action still closes live sockets"""
+        from django.test import Client
+        admin_user = await database_sync_to_async(User.objects.create_superuser)(
+            username='admin',
+            email='admin@example.com',
+            password='adminpass123'
+        )
+        await database_sync_to_async(DocumentPermission.objects.create)(
+            document=self.document,
+            user=self.user,
+            role='editor'
+        )
+        sockets = []
+        for user in (self.owner, self.user):
+            communicator = WebsocketCommunicator(test_application, f'/ws/document/{self.document.id}/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            sockets.append(communicator)
+        
+        def delete_owner_data():
+            client = Client()
+            client.force_login(admin_user)
+            return client.post('/admin/auth/user/', {
+                'action': 'delete_user_data',
+                '_selected_action': [self.owner.id],
+            })
+        await database_sync_to_async(delete_owner_data)()
+        
+        for communicator in sockets:
+            while True:
+                output = await communicator.receive_output()
+                if output['type'] == 'websocket.close':
+                    break
 
 
 @unittest.skipIf(not CHANNELS_TESTING_AVAILABLE, "channels.testing not available")
-@override_settings(CHANNEL_LAYERS={
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-})
-class SpreadsheetConsumerTests(TransactionTestCase):
+class SpreadsheetConsumerTests(TestCase):
     """Test SpreadsheetConsumer WebSocket functionality"""
     
     def setUp(self):
         """Set up test data"""
+        cache.clear()
+        presence._backend = None
         self.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
@@ -189,3 +653,284 @@ class SpreadsheetConsumerTests(TransactionTestCase):
         
         await communicator.disconnect()
     
+    
+    async def test_cell_updates_saved_once_per_window(self):
+        """Test that a burst of cell updates is persisted in a single write"""
+        from unittest import mock
+        from collaboration.consumers import SpreadsheetConsumer
+        communicator = WebsocketCommunicator(
+            test_application,
+            f'/ws/spreadsheet/{self.spreadsheet.id}/'
+        )
+        communicator.scope['user'] = self.owner
+        await communicator.connect()
+        await communicator.receive_json_from()
+        
+        with mock.patch.object(SpreadsheetConsumer, 'save_spreadsheet_data') as save:
+            for value in range(3):
+                await communicator.send_json_to({
+                    'type': 'cell_update',
+                    'changes': [{'row': 0, 'col': 0, 'value': value}],
+                })
+            await communicator.disconnect()
+        
+        save.assert_called_once()
+        self.assertEqual(len(save.call_args.args[0]), 3)
+    
+    async def test_cell_update_burst_broadcast_once(self):
+        """Test that cell updates within the broadcast window merge into one cell_change"""
+        tabs = []
+        for _ in range(2):
+            tab = WebsocketCommunicator(test_application, f'/ws/spreadsheet/{self.spreadsheet.id}/')
+            tab.scope['user'] = self.owner
+            await tab.connect()
+            await tab.receive_json_from()
+            tabs.append(tab)
+        
+        for col in range(3):
+            await tabs[0].send_json_to({
+                'type': 'cell_update',
+                'changes': [{'row': 0, 'col': col, 'value': col}],
+            })
+        response = await tabs[1].receive_json_from()
+        self.assertEqual(response['type'], 'cell_change')
+        self.assertEqual([change['col'] for change in response['changes']], [0, 1, 2])
+        self.assertTrue(await tabs[1].receive_nothing())
+        
+        for tab in tabs:
+            await tab.disconnect()
+    
+    async def test_cell_updates_persisted(self):
+        """Test that cell updates are written into the spreadsheet data"""
+        communicator = WebsocketCommunicator(
+            test_application,
+            f'/ws/spreadsheet/{self.spreadsheet.id}/'
+        )
+        communicator.scope['user'] = self.owner
+        await communicator.connect()
+        await communicator.receive_json_from()
+        
+        await communicator.send_json_to({
+            'type': 'cell_update',
+            'changes': [{'row': 0, 'col': 1, 'value': 'B1'}],
+        })
+        await communicator.disconnect()
+        
+        await database_sync_to_async(self.spreadsheet.refresh_from_db)()
+        self.assertEqual(self.spreadsheet.data['sheets'][0]['data'], [['', 'B1']])
+    
+    async def test_unstorable_cell_values_dropped(self):
+        """Test that bytes and oversized integers don't take the rest of the batch down"""
+        import msgpack
+        communicator = WebsocketCommunicator(
+            test_application,
+            f'/ws/spreadsheet/{self.spreadsheet.id}/',
+            subprotocols=['msgpack'],
+        )
+        communicator.scope['user'] = self.owner
+        await communicator.connect()
+        await communicator.receive_from()
+        
+        await communicator.send_to(bytes_data=msgpack.packb({
+            'type': 'cell_update',
+            'changes': [
+                {'row': 0, 'col': 0, 'value': b'raw'},
+                {'row': 0, 'col': 1, 'value': 'B1'},
+            ],
+        }))
+        await communicator.send_to(text_data='{"type": "cell_update", "changes": '
+                                             '[{"row": 0, "col": 2, "value": 36893488147419103232}, '
+                                             '{"row": 0, "col": 3, "value": "D1"}]}')
+        await communicator.disconnect()
+        
+        await database_sync_to_async(self.spreadsheet.refresh_from_db)()
+        self.assertEqual(self.spreadsheet.data['sheets'][0]['data'], [['', 'B1', '', 'D1']])
+        self.assertEqual(self.spreadsheet.last_edited_by_id, self.owner.id)
+
+
+class BatchFramesTests(TestCase):
+    """Test splicing pre-encoded frames into batch frames"""
+    
+    def test_batch_frames_decode_like_a_batch_payload(self):
+        """Test that spliced JSON and msgpack batches match encoding the dict directly"""
+        import msgpack
+        from collaboration.consumers import _batch_frames, _encode_frames
+        payloads = [{'type': 'content_update', 'content': f'<p>{i}</p>'} for i in range(20)]
+        frames = [_encode_frames(payload) for payload in payloads]
+        expected = {'type': 'batch', 'events': payloads}
+        
+        self.assertEqual(json.loads(_batch_frames(frames, False)), expected)
+        self.assertEqual(msgpack.unpackb(_batch_frames(frames, True)), expected)
+    
+    def test_presence_frames_cached(self):
+        """Test that join/leave frames are encoded once per user and event"""
+        from collaboration.consumers import _presence_frames
+        frames = _presence_frames('user_joined', 'alice')
+        self.assertIs(_presence_frames('user_joined', 'alice'), frames)
+        self.assertEqual(json.loads(frames['json']), {'type': 'user_joined', 'username': 'alice'})
+
+
+class ContentPatchTests(TestCase):
+    """Test applying content_patch splices"""
+    
+    def test_ascii_splice(self):
+        """Test replacing, inserting and rejecting splices on ASCII content"""
+        from collaboration.consumers import _apply_content_patch
+        self.assertEqual(_apply_content_patch('<p>abc</p>', 3, 3, 10, 'xyz'), '<p>xyz</p>')
+        self.assertEqual(_apply_content_patch('<p>abc</p>', 6, 0, 10, 'd'), '<p>abcd</p>')
+        self.assertIsNone(_apply_content_patch('<p>abc</p>', 3, 3, 9, 'xyz'))
+        self.assertIsNone(_apply_content_patch('<p>abc</p>', 8, 3, 10, ''))
+        self.assertIsNone(_apply_content_patch(None, 0, 0, 0, 'x'))
+    
+    def test_utf16_offsets(self):
+        """Test that offsets count UTF-16 code units like the browser does"""
+        from collaboration.consumers import _apply_content_patch
+        # The emoji is two code units in JavaScript, so 'b' starts at 5
+        content = '<p>\U0001F600b</p>'
+        self.assertEqual(_apply_content_patch(content, 5, 1, 10, 'c'), '<p>\U0001F600c</p>')
+        self.assertEqual(_apply_content_patch(content, 3, 2, 10, '\U0001F601'), '<p>\U0001F601b</p>')
+        # Splitting a surrogate pair would leave invalid text
+        self.assertIsNone(_apply_content_patch(content, 4, 2, 10, ''))
+
+
+class DecodeFrameTests(TestCase):
+    """Test validation of incoming WebSocket frames"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from collaboration.consumers import DocumentConsumer
+        self.consumer = DocumentConsumer()
+    
+    def test_decode_valid_frames(self):
+        """Test that JSON and msgpack frames decode to typed messages"""
+        import msgpack
+        from collaboration.messages import ContentUpdate
+        message = {'type': 'content_update', 'content': '<p>Hi</p>', 'document_id': 1}
+        self.assertEqual(self.consumer.decode_frame(text_data=json.dumps(message)), ContentUpdate(content='<p>Hi</p>'))
+        self.assertEqual(self.consumer.decode_frame(bytes_data=msgpack.packb(message)), ContentUpdate(content='<p>Hi</p>'))
+        # JSON allows whitespace before the object
+        self.assertEqual(self.consumer.decode_frame(text_data='\n  ' + json.dumps(message)), ContentUpdate(content='<p>Hi</p>'))
+    
+    def test_reject_invalid_frames(self):
+        """Test that empty, oversized and non-object frames raise ValueError"""
+        import msgpack
+        from collaboration.consumers import MAX_FRAME_SIZE
+        frames = [
+            {'text_data': ''},
+            {'text_data': '{"a":"' + 'x' * MAX_FRAME_SIZE + '"}'},
+            # Under the limit in characters, over it in UTF-8 bytes
+            {'text_data': '{"a":"' + '\u00e9' * (MAX_FRAME_SIZE // 2) + '"}'},
+            {'text_data': '  [1, 2]'},
+            {'text_data': '[1, 2]'},
+            {'text_data': '{not json'},
+            {'bytes_data': msgpack.packb([1, 2])},
+            {'bytes_data': b'\x81\xa4ty'},
+            {'text_data': '{"type": "cell_update", "changes": []}'},
+            {'text_data': '{"type": "content_update", "content": 5}'},
+        ]
+        for frame in frames:
+            with self.subTest(frame=str(frame)[:40]):
+                with self.assertRaises(ValueError):
+                    self.consumer.decode_frame(**frame)
+
+
+class ThresholdDeflateTests(TestCase):
+    """Test that permessage-deflate skips small messages"""
+    
+    def test_small_messages_sent_uncompressed(self):
+        """Test that only messages at or above COMPRESS_MIN_SIZE are compressed"""
+        from websockets.frames import Frame, Opcode
+        from docshub.websocket import COMPRESS_MIN_SIZE, ThresholdPerMessageDeflate
+        extension = ThresholdPerMessageDeflate(False, False, 15, 15)
+        
+        small = Frame(Opcode.TEXT, b'{"type":"selection_change"}')
+        self.assertIs(extension.encode(small), small)
+        
+        large = Frame(Opcode.TEXT, b'x' * COMPRESS_MIN_SIZE)
+        encoded = extension.encode(large)
+        self.assertTrue(encoded.rsv1)
+        self.assertLess(len(encoded.data), COMPRESS_MIN_SIZE)
+
+
+class BatchedRedisPubSubLayerTests(TestCase):
+    """Test pipelining of concurrent publishes in the Redis channel layer"""
+    
+    def test_concurrent_group_sends_share_one_pipeline(self):
+        """Test that group_sends issued together go out in one pipeline, in order"""
+        import asyncio
+        import msgpack
+        from collaboration.layers import BatchedRedisPubSubChannelLayer
+        
+        executed = []
+        
+        class FakePipeline:
+            def __init__(self):
+                self.published = []
+            async def __aenter__(self):
+                return self
+            async def __aexit__(self, *exc_info):
+                return False
+            def publish(self, channel, payload):
+                self.published.append(msgpack.unpackb(payload)['n'])
+            async def execute(self):
+                executed.append(self.published)
+        
+        class FakeRedis:
+            def pipeline(self, transaction=True):
+                return FakePipeline()
+            async def close(self, close_connection_pool=None):
+                pass
+        
+        async def run():
+            channel_layer = BatchedRedisPubSubChannelLayer(hosts=[('localhost', 6379)])
+            layer = channel_layer._get_layer()
+            layer._shards[0]._redis = FakeRedis()
+            await asyncio.gather(*(
+                channel_layer.group_send('document_1', {'type': 'content_update', 'n': n})
+                for n in range(5)
+            ))
+            await channel_layer.group_send('document_1', {'type': 'content_update', 'n': 5})
+        
+        asyncio.run(run())
+        self.assertEqual(executed, [[0, 1, 2, 3, 4], [5]])
+    
+    def test_room_publishes_stay_on_one_shard(self):
+        """Test that with several hosts each room publishes to a single server"""
+        import asyncio
+        from collaboration.layers import BatchedRedisPubSubChannelLayer
+        
+        published = {}
+        
+        class FakePipeline:
+            def __init__(self, shard):
+                self.shard = shard
+            async def __aenter__(self):
+                return self
+            async def __aexit__(self, *exc_info):
+                return False
+            def publish(self, channel, payload):
+                published.setdefault(channel, set()).add(self.shard)
+            async def execute(self):
+                pass
+        
+        class FakeRedis:
+            def __init__(self, shard):
+                self.shard = shard
+            def pipeline(self, transaction=True):
+                return FakePipeline(self.shard)
+            async def close(self, close_connection_pool=None):
+                pass
+        
+        async def run():
+            channel_layer = BatchedRedisPubSubChannelLayer(hosts=[('redis-a', 6379), ('redis-b', 6379)])
+            layer = channel_layer._get_layer()
+            for index, shard in enumerate(layer._shards):
+                shard._redis = FakeRedis(index)
+            for n in range(3):
+                for room in range(20):
+                    await channel_layer.group_send(f'document_{room}', {'type': 'content_update', 'n': n})
+        
+        asyncio.run(run())
+        self.assertEqual(len(published), 20)
+        self.assertTrue(all(len(shards) == 1 for shards in published.values()))
+        self.assertEqual(set().union(*published.values()), {0, 1})
@@ -0,0 +1,31 @@
+"""
+Helpers for pushing server-side events to connected collaboration consumers
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+
+# How long a user's role in a room is cached for WebSocket connects
+ROLE_CACHE_TIMEOUT = 60
+
+
+def role_cache_key(room_group_name, user_id):
+    """Cache key for a user's role in a collaboration room"""
+    return f'collab_role:{room_group_name}:{user_id}'
+
+
+def notify_permission_changed(room_group_name, user_id):
+    """Tell consumers in a room to re-check a user's cached role"""
+    cache.delete(role_cache_key(room_group_name, user_id))
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(room_group_name, {
+            'type': 'permission_changed',
+            'user_id': user_id,
+        })
+    except Exception:
+        # Best effort: without a reachable channel layer there are no live
+        # sockets to invalidate, and the next connect resolves the role anew
+        pass
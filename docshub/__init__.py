@@ -4,6 +4,9 @@ try:
     from .celery import app as celery_app
     __all__ = ('celery_app',)
 except ImportError:
-    # Celery is optional, only needed for background tasks
+    # Celery is optional, only needed for background tasks. The package is in
+    # requirements.txt because the documents and notifications tasks import
+    # it; a running worker is what's optional. See README.md for what happens
+    # to share notifications without one
     celery_app = None
     __all__ = ()
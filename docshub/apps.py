@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class DocsHubConfig(AppConfig):
+    name = "docshub"
+    verbose_name = "DocsHub"
+
+    def ready(self):
+        from . import db  # noqa: F401
@@ -10,14 +10,19 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "docshub.settings")
+
+# Set up Django before importing consumers (they import models), so the app
+# also loads under standalone ASGI servers such as uvicorn
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import collaboration.routing
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "docshub.settings")
-
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             collaboration.routing.websocket_urlpatterns
@@ -0,0 +1,31 @@
+"""
+SQLite tuning (connected in DocsHubConfig.ready)
+
+In WAL mode readers no longer block on the writer, so list and get requests
+keep working while a share or the consumers' debounced saves are writing.
+journal_mode is stored in the database file, so it is switched once, after
+migrate; synchronous=NORMAL only lasts for a connection, so each new one sets
+it. It is safe under WAL: a power loss can drop the last commits but can't
+corrupt the database. Postgres connections are left alone.
+"""
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA synchronous=NORMAL;')
+
+
+@receiver(post_migrate)
+def enable_sqlite_wal(sender, using, **kwargs):
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL;')
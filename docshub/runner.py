@@ -0,0 +1,58 @@
+"""
+Test runner for docshub (TEST_RUNNER in docshub/settings.py)
+
+Swaps in the in-memory channel layer and a local-memory cache once for the
+whole run, so tests don't need a Redis server and no test pays for a per-class
+settings override.
+Celery tasks run eagerly, in the test process, for the same reason, keeping
+their results in memory so they can be polled, and passwords use a fast
+hasher: Argon2 is slow on purpose.
+"""
+import warnings
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from docshub import celery_app
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+TEST_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+
+class DocsHubTestRunner(DiscoverRunner):
+    """DiscoverRunner with the test-only settings above"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_settings = override_settings(
+            CACHES=TEST_CACHES,
+            CHANNEL_LAYERS=TEST_CHANNEL_LAYERS,
+            PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+        )
+        self._test_settings.enable()
+        if celery_app is not None:
+            celery_app.conf.task_always_eager = True
+            celery_app.conf.task_store_eager_result = True
+            # Settings loaded from CELERY_* keep their prefixed names, and
+            # those win over the lowercase ones
+            self._celery_result_backend = celery_app.conf.CELERY_RESULT_BACKEND
+            celery_app.conf.CELERY_RESULT_BACKEND = 'cache+memory://'
+        # Tests don't run collectstatic, so WhiteNoise finds no STATIC_ROOT
+        warnings.filterwarnings('ignore', message='No directory at', module='django.core.handlers.base')
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        if celery_app is not None:
+            celery_app.conf.task_always_eager = False
+            celery_app.conf.task_store_eager_result = False
+            celery_app.conf.CELERY_RESULT_BACKEND = self._celery_result_backend
+        super().teardown_test_environment(**kwargs)
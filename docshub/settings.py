@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import re
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
     "rest_framework",
     "corsheaders",
     # Local apps
+    "docshub",  # Project-wide signal receivers (docshub/db.py)
     "accounts",
     "documents",
     "spreadsheets",
@@ -87,14 +89,29 @@ ASGI_APPLICATION = "docshub.asgi.application"
 # Try Redis first, fallback to InMemory for development
 try:
     import redis
+    # The pub/sub layer turns each group_send into a single Redis PUBLISH that
+    # Redis fans out to every subscribed consumer, instead of one queue push
+    # per group member; the batched subclass pipelines concurrent PUBLISHes.
+    # To spread rooms over several Redis servers, list them all in "hosts":
+    # each group name is hashed to one server, so a room's PUBLISH and SUBSCRIBE
+    # traffic never crosses nodes (use standalone servers, not a Redis Cluster)
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "BACKEND": "collaboration.layers.BatchedRedisPubSubChannelLayer",
             "CONFIG": {
                 "hosts": [("127.0.0.1", 6379)],
             },
         },
     }
+    # The cache is shared by every worker process too: the collaboration
+    # consumers cache each user's role in a room, and a revoked or downgraded
+    # role has to be dropped for all of them at once
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": "redis://127.0.0.1:6379/1",
+        },
+    }
 except ImportError:
     # Fallback to InMemoryChannelLayer if Redis is not available
     CHANNEL_LAYERS = {
@@ -102,6 +119,16 @@ except ImportError:
             "BACKEND": "channels.layers.InMemoryChannelLayer"
         }
     }
+    # Per-process cache; like the in-memory channel layer, only valid when a
+    # single process serves the site
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
+# Tests always run on the in-memory channel layer (see docshub/runner.py)
+TEST_RUNNER = 'docshub.runner.DocsHubTestRunner'
 
 
 # Database
@@ -111,6 +138,15 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Reuse connections across requests and database_sync_to_async calls
+        "CONN_MAX_AGE": 60,
+        "CONN_HEALTH_CHECKS": True,
+        # Views run in autocommit and open transaction.atomic() only around
+        # multi-statement writes, so row locks aren't held while responses render
+        "ATOMIC_REQUESTS": False,
+        # Writers wait this many seconds for SQLite's write lock before failing
+        # with "database is locked"; WAL mode itself is set in docshub/db.py
+        "OPTIONS": {"timeout": 20},
     }
 }
 
@@ -134,6 +170,17 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Argon2 first: new and re-authenticated passwords are hashed with it, the
+# remaining hashers keep existing PBKDF2 hashes verifiable (and upgraded on login)
+PASSWORD_HASHERS = [
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -153,6 +200,33 @@ STATIC_URL = "/static/"
 STATICFILES_DIRS = [BASE_DIR / "static" / "dist", BASE_DIR / "static"]
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# Serve static files from WhiteNoise when it is installed, so assets never reach
+# the URL resolver; collectstatic writes .gz/.br copies next to each file.
+# Vite already fingerprints its build output, so the manifest storage (which
+# would rename files index.html points at) isn't used
+try:
+    import whitenoise
+    MIDDLEWARE.insert(1, "whitenoise.middleware.WhiteNoiseMiddleware")
+    STORAGES = {
+        "default": {
+            "BACKEND": "django.core.files.storage.FileSystemStorage",
+        },
+        "staticfiles": {
+            "BACKEND": "whitenoise.storage.CompressedStaticFilesStorage",
+        },
+    }
+
+    def WHITENOISE_IMMUTABLE_FILE_TEST(path, url):
+        # Vite emits name-<8 char hash>.ext under assets/; cache those forever
+        return re.match(r"^/static/assets/.+-[0-9A-Za-z_-]{8}\.\w+$", url) is not None
+except ImportError:
+    pass
+
+# Internal nginx location holding the React index.html (e.g. "/_spa/index.html").
+# When set, the SPA catch-all answers with X-Accel-Redirect and nginx sends the
+# file itself; when None, Django serves it from memory
+REACT_INDEX_ACCEL_REDIRECT = None
+
 # Media files
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
@@ -180,8 +254,10 @@ SESSION_SAVE_EVERY_REQUEST = True  # Extend session on each request
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # Keep session after browser close
 SESSION_COOKIE_NAME = 'sessionid'  # Explicit cookie name
 SESSION_COOKIE_PATH = '/'  # Make sure cookie is available for all paths
-# Ensure session is saved even if no changes
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Keep session state in a signed cookie so login/register and the per-request
+# session refresh above don't write to django_session. The cookie is signed
+# with SECRET_KEY but not encrypted, so only store non-sensitive data in it.
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 
 # Celery configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
@@ -189,6 +265,14 @@ CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+# Periodic tasks, run with `celery -A docshub beat`
+CELERY_BEAT_SCHEDULE = {
+    # DOCX exports are only downloadable for DOCX_EXPORT_MAX_AGE seconds
+    'purge-document-exports': {
+        'task': 'documents.tasks.purge_document_exports',
+        'schedule': 60 * 60,
+    },
+}
 
 # REST Framework
 REST_FRAMEWORK = {
@@ -204,3 +288,15 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.MultiPartParser',
     ],
 }
+
+# Parse request bodies and render API responses with orjson when
+# drf-orjson-renderer is installed, fall back to DRF's stdlib-json classes otherwise
+try:
+    import drf_orjson_renderer
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'][0] = 'drf_orjson_renderer.parsers.ORJSONParser'
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'drf_orjson_renderer.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]
+except ImportError:
+    pass
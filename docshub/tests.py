@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from . import urls
+
+
+class ServeReactAppTests(TestCase):
+    def setUp(self):
+        """Set up a throwaway dist/index.html"""
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        os.makedirs(os.path.join(self.base_dir, 'static', 'dist'))
+        self.index_path = os.path.join(self.base_dir, 'static', 'dist', 'index.html')
+        with open(self.index_path, 'w') as f:
+            f.write('<html>v1</html>')
+        urls._INDEX_CACHE = None
+        self.addCleanup(setattr, urls, '_INDEX_CACHE', None)
+    
+    def test_index_read_once(self):
+        """Test that index.html is served from memory after the first request"""
+        with override_settings(BASE_DIR=self.base_dir, DEBUG=False):
+            response = self.client.get('/documents/1')
+            self.assertEqual(response.content, b'<html>v1</html>')
+            self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+            with mock.patch('builtins.open') as mock_open, mock.patch('os.stat') as mock_stat:
+                response = self.client.get('/spreadsheets')
+            mock_open.assert_not_called()
+            mock_stat.assert_not_called()
+            self.assertEqual(response.content, b'<html>v1</html>')
+    
+    def test_index_reloaded_in_debug_when_changed(self):
+        """Test that DEBUG picks up a rebuilt index.html"""
+        with override_settings(BASE_DIR=self.base_dir, DEBUG=True):
+            self.client.get('/')
+            with open(self.index_path, 'w') as f:
+                f.write('<html>v2</html>')
+            stat = os.stat(self.index_path)
+            os.utime(self.index_path, (stat.st_atime, stat.st_mtime + 10))
+            response = self.client.get('/')
+        self.assertEqual(response.content, b'<html>v2</html>')
+    
+    def test_etag_not_modified(self):
+        """Test that a matching If-None-Match gets a 304"""
+        with override_settings(BASE_DIR=self.base_dir):
+            etag = self.client.get('/')['ETag']
+            response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+    
+    def test_accel_redirect(self):
+        """Test that nginx is asked to send index.html when configured"""
+        with override_settings(BASE_DIR=self.base_dir, REACT_INDEX_ACCEL_REDIRECT='/_spa/index.html'):
+            response = self.client.get('/documents/1')
+        self.assertEqual(response['X-Accel-Redirect'], '/_spa/index.html')
+        self.assertEqual(response.content, b'')
+        self.assertIsNone(urls._INDEX_CACHE)
+    
+    def test_missing_build(self):
+        """Test the error when the React app has not been built"""
+        os.remove(self.index_path)
+        with override_settings(BASE_DIR=self.base_dir):
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 500)
+    
+    def test_catch_all_routes(self):
+        """Test that client-side routes get index.html and reserved prefixes don't"""
+        with override_settings(BASE_DIR=self.base_dir):
+            response = self.client.get('/documents/42/edit')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Cache-Control'], 'no-cache, must-revalidate')
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(self.client.get('/api/missing/').status_code, 404)
+            self.assertEqual(self.client.get('/media/missing.png').status_code, 404)
+
+
+class TestRunnerTests(TestCase):
+    def test_in_memory_channel_layer(self):
+        """Test that the suite runs on the in-memory channel layer"""
+        from channels.layers import InMemoryChannelLayer, get_channel_layer
+        self.assertIsInstance(get_channel_layer(), InMemoryChannelLayer)
+
+
+class SQLiteConnectionTests(TestCase):
+    def test_connection_pragmas(self):
+        """Test that new SQLite connections relax synchronous for WAL"""
+        from django.db import connection
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous;')
+            # NORMAL; journal_mode itself reads 'memory' on the in-memory test database
+            self.assertEqual(cursor.fetchone()[0], 1)
+    
+    def test_migrate_enables_wal(self):
+        """Test that the post_migrate receiver switches a database file to WAL once"""
+        import sqlite3
+        from django.db import connection
+        from django.db.utils import ConnectionHandler
+        from .db import enable_sqlite_wal
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'wal.sqlite3')
+        handler = ConnectionHandler({'default': {**connection.settings_dict, 'NAME': path}})
+        with mock.patch('docshub.db.connections', handler):
+            enable_sqlite_wal(sender=None, using='default')
+        handler.close_all()
+        
+        # The mode is stored in the file, so a plain new connection sees it
+        db = sqlite3.connect(path)
+        self.addCleanup(db.close)
+        self.assertEqual(db.execute('PRAGMA journal_mode;').fetchone()[0], 'wal')
+
+
+class StaticFilesTests(TestCase):
+    def setUp(self):
+        """Set up a throwaway STATIC_ROOT with a Vite-style build"""
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+        os.makedirs(os.path.join(self.static_root, 'assets'))
+        for name in ('assets/index-CX0LWkg6.js', 'Docs-Hub.png'):
+            with open(os.path.join(self.static_root, name), 'w') as f:
+                f.write('x')
+    
+    def test_fingerprinted_assets_immutable(self):
+        """Test that hashed Vite assets are cached forever and other files aren't"""
+        try:
+            import whitenoise  # noqa: F401
+        except ImportError:
+            self.skipTest('whitenoise not installed')
+        with override_settings(STATIC_ROOT=self.static_root):
+            response = self.client.get('/static/assets/index-CX0LWkg6.js')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response['Cache-Control'])
+            response = self.client.get('/static/Docs-Hub.png')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('immutable', response['Cache-Control'])
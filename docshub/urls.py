@@ -17,21 +17,51 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import path, include, re_path
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.static import serve
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_headers
 import os
 
+# (mtime, bytes) of the last index.html read, so the catch-all skips the disk
+_INDEX_CACHE = None
+
+
+def _load_index(index_path):
+    """Return the cached index.html, re-reading it in DEBUG when the build changes"""
+    global _INDEX_CACHE
+    if _INDEX_CACHE is None or settings.DEBUG:
+        mtime = os.stat(index_path).st_mtime
+        if _INDEX_CACHE is None or _INDEX_CACHE[0] != mtime:
+            with open(index_path, 'rb') as f:
+                _INDEX_CACHE = (mtime, f.read())
+    return _INDEX_CACHE
+
+
+@cache_control(no_cache=True, must_revalidate=True)
+@vary_on_headers('Accept-Encoding')
 def serve_react_app(request, *args, **kwargs):
     """Serve React index.html"""
+    accel_redirect = getattr(settings, 'REACT_INDEX_ACCEL_REDIRECT', None)
+    if accel_redirect:
+        # nginx replaces the body with the file via sendfile
+        response = HttpResponse(content_type='text/html; charset=utf-8')
+        response['X-Accel-Redirect'] = accel_redirect
+        return response
     try:
         index_path = os.path.join(settings.BASE_DIR, 'static', 'dist', 'index.html')
-        with open(index_path, 'r') as f:
-            content = f.read()
-        return HttpResponse(content, content_type='text/html')
+        mtime, content = _load_index(index_path)
     except FileNotFoundError:
         return HttpResponse("React app not built. Run 'npm run build'", status=500)
+    etag = f'"{mtime:.6f}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='text/html; charset=utf-8')
+    response['ETag'] = etag
+    return response
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -43,7 +73,8 @@ urlpatterns = [
     path("api/notifications/", include("notifications.urls")),
 ]
 
-# Serve static files in development
+# Serve static files in development (WhiteNoise answers /static/ before these
+# patterns when it is installed; they remain the fallback without it)
 if settings.DEBUG:
     # Explicitly serve static files from dist directory
     dist_dir = os.path.join(settings.BASE_DIR, 'static', 'dist')
@@ -59,7 +90,8 @@ if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 # Catch-all for React routes - must be last (excludes static, api, admin, media)
-# This regex matches any path that doesn't start with static/, api/, admin/, or media/
+# This regex only inspects the first path segment: with no trailing .* or $ it
+# matches as a prefix, so long client-side URLs aren't scanned to the end
 urlpatterns += [
-    re_path(r'^(?!static/|api/|admin/|media/).*', serve_react_app),
+    re_path(r'^(?!(?:static|api|admin|media)/)', serve_react_app),
 ]
@@ -0,0 +1,77 @@
+"""
+WebSocket protocol for running docshub under uvicorn.
+
+Same as uvicorn's websockets protocol, except permessage-deflate leaves small
+messages uncompressed: cursor, selection and single-cell frames are a few
+dozen bytes, where zlib costs CPU and saves almost nothing. RFC 7692 allows
+any message to be sent uncompressed, so clients need no changes.
+
+uvicorn's --ws option only takes built-in names, so start the server with
+python -m docshub.websocket, which passes this protocol class in.
+"""
+import argparse
+
+import uvicorn
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol as UvicornWebSocketProtocol
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import Opcode
+
+# Messages smaller than this are sent without compression
+COMPRESS_MIN_SIZE = 1024
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that skips messages below COMPRESS_MIN_SIZE"""
+
+    def encode(self, frame):
+        # Only whole (unfragmented) data messages can skip compression
+        if frame.opcode in (Opcode.TEXT, Opcode.BINARY) and frame.fin and len(frame.data) < COMPRESS_MIN_SIZE:
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    """Negotiates permessage-deflate like the default factory, with the threshold extension"""
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+        )
+
+
+class WebSocketProtocol(UvicornWebSocketProtocol):
+    """uvicorn's websockets protocol with size-thresholded compression"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.available_extensions = [
+            ThresholdPerMessageDeflateFactory() if isinstance(factory, ServerPerMessageDeflateFactory) else factory
+            for factory in self.available_extensions or []
+        ]
+
+
+def main():
+    """Serve docshub.asgi under uvicorn with uvloop, httptools and this protocol"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    uvicorn.run(
+        'docshub.asgi:application',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop='uvloop',
+        http='httptools',
+        ws=WebSocketProtocol,
+    )
+
+
+if __name__ == '__main__':
+    main()
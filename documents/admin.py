@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import Count
+from django.db.models.functions import Substr
 from django.utils.html import format_html
 from django.urls import reverse
 from .models import Document, DocumentPermission, DocumentComment, DocumentVersion
@@ -23,23 +25,35 @@ class DocumentAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """
+        Annotate the counts shown in the changelist instead of querying per row,
+        and leave content to be loaded only by the change form that shows it
+        """
+        return super().get_queryset(request).select_related('owner').defer('content').annotate(
+            _permission_count=Count('permissions', distinct=True),
+            _comment_count=Count('comments', distinct=True),
+        )
+    
     def permission_count(self, obj):
         """Count of users with access"""
-        count = obj.permissions.count()
+        count = obj._permission_count
         return format_html('<a href="{}?document__id__exact={}">{}</a>',
                           reverse('admin:documents_documentpermission_changelist'),
                           obj.id,
                           count)
     permission_count.short_description = 'Shared With'
+    permission_count.admin_order_field = '_permission_count'
     
     def comment_count(self, obj):
         """Count of comments"""
-        count = obj.comments.count()
+        count = obj._comment_count
         return format_html('<a href="{}?document__id__exact={}">{}</a>',
                           reverse('admin:documents_documentcomment_changelist'),
                           obj.id,
                           count)
     comment_count.short_description = 'Comments'
+    comment_count.admin_order_field = '_comment_count'
     
     def view_content(self, obj):
         """Link to view content in a popup"""
@@ -75,9 +89,16 @@ class DocumentCommentAdmin(admin.ModelAdmin):
     search_fields = ('document__title', 'user__username', 'content')
     readonly_fields = ('created_at', 'updated_at')
     
+    def get_queryset(self, request):
+        """Load only the changelist's columns; the comment body is cut down in SQL"""
+        return super().get_queryset(request).select_related('document', 'user').only(
+            'id', 'created_at', 'resolved', 'document__id', 'document__title', 'user__id', 'user__username',
+        ).annotate(_content_preview=Substr('content', 1, 51))
+    
     def content_preview(self, obj):
         """Show preview of comment content"""
-        return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
+        preview = obj._content_preview
+        return preview[:50] + '...' if len(preview) > 50 else preview
     content_preview.short_description = 'Comment'
     
     def view_document(self, obj):
@@ -92,6 +113,10 @@ class DocumentVersionAdmin(admin.ModelAdmin):
     search_fields = ('document__title', 'change_description')
     readonly_fields = ('created_at', 'content')
     
+    def get_queryset(self, request):
+        """Skip the content snapshots and document bodies, which the changelist doesn't show"""
+        return super().get_queryset(request).select_related('document', 'created_by').defer('content', 'document__content')
+    
     fieldsets = (
         ('Version Information', {
             'fields': ('document', 'version_number', 'created_by', 'change_description')
@@ -2,63 +2,144 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework import status
+from rest_framework.pagination import CursorPagination
 from .models import Document, DocumentPermission
 from django.contrib.auth.models import User
-from notifications.models import Notification
-from django.contrib.contenttypes.models import ContentType
+from collaboration.utils import notify_permission_changed
+from notifications.tasks import queue_share_notifications
+from .tasks import DOCX_EXPORT_MAX_AGE, docx_export_signer, export_document_to_docx
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.db import transaction
-import time
+from django.db.models import BooleanField, Case, Count, Exists, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.http import FileResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from functools import partial
+import hashlib
+import logging
 
+logger = logging.getLogger(__name__)
 
+# How long a rendered document_list page is kept for its version stamp
+DOCUMENT_LIST_CACHE_TIMEOUT = 60
+
+
+class DocumentListPagination(CursorPagination):
+    """Newest-first pages of the document list"""
+    page_size = 50
+    ordering = ('-updated_at', '-id')
+
+
+def _user_role(user):
+    """Subquery for the user's shared role on the outer document, if any"""
+    return Subquery(
+        DocumentPermission.objects.filter(document_id=OuterRef('pk'), user=user).values('role')[:1]
+    )
+
+
+def _user_documents(user):
+    """Documents the user owns or has been shared"""
+    # A correlated EXISTS is a semi-join: no join to deduplicate with DISTINCT
+    shared = DocumentPermission.objects.filter(document_id=OuterRef('pk'), user=user)
+    return Document.objects.filter(Q(owner=user) | Exists(shared))
+
+
+def _document_list_version(request):
+    """
+    Version stamp for a document_list page, from one aggregate over the
+    user's documents. Any edit bumps updated_at, and a document added to or
+    dropped from the list changes the count or the id sum. Computed once
+    per request and shared by the ETag and the response cache.
+    """
+    version = getattr(request, '_document_list_version', None)
+    if version is None:
+        stats = _user_documents(request.user).aggregate(
+            count=Count('id'), id_sum=Sum('id'), latest=Max('updated_at'),
+        )
+        latest = stats['latest'].timestamp() if stats['latest'] else 0
+        # The full URI covers the page cursor and the host in the page links
+        key = f"{request.user.id}:{stats['count']}:{stats['id_sum']}:{latest}:{request.build_absolute_uri()}"
+        version = request._document_list_version = hashlib.md5(key.encode()).hexdigest()
+    return version
+
+
+def _document_list_etag(request):
+    """ETag for a document_list page"""
+    # Runs before DRF authenticates; anonymous requests fall through to the 403
+    if not request.user.is_authenticated:
+        return None
+    return 'W/"%s"' % _document_list_version(request)
+
+
+def _document_etag(request, id):
+    """ETag for document_get: the document's last save and the user's role on it"""
+    if not request.user.is_authenticated:
+        return None
+    row = Document.objects.filter(id=id).annotate(
+        user_role=_user_role(request.user),
+    ).values_list('updated_at', 'owner_id', 'user_role').first()
+    if row is None:
+        return None
+    updated_at, owner_id, role = row
+    if owner_id == request.user.id:
+        role = 'owner'
+    elif role is None:
+        return None
+    return f'W/"{id}-{updated_at.timestamp()}-{role}"'
+
+
+def _document_list_items(rows):
+    """Serialize documents for the list endpoint from values() rows"""
+    return [{
+        'id': row['id'],
+        'title': row['title'],
+        'content': row['preview'] or '',
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at'],
+        'is_owner': row['is_owner'],
+        'owner': {
+            'id': row['owner_id'],
+            'username': row['owner__username'],
+        }
+    } for row in rows]
+
+
+# Clients revalidate on every poll and get a bodiless 304 when nothing changed
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_document_list_etag)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def document_list(request):
-    """List user's documents (owned and shared)"""
+    """List user's documents (owned and shared), a page at a time"""
     try:
-        # Get owned documents
-        owned_docs = Document.objects.filter(owner=request.user)
-        
-        # Get shared documents
-        shared_docs = Document.objects.filter(
-            permissions__user=request.user
-        ).exclude(owner=request.user).distinct()
-        
-        # Combine and serialize
-        data = []
-        for doc in owned_docs:
-            data.append({
-                'id': doc.id,
-                'title': doc.title,
-                'content': doc.content[:200] if doc.content else '',
-                'created_at': doc.created_at.isoformat() if doc.created_at else None,
-                'updated_at': doc.updated_at.isoformat() if doc.updated_at else None,
-                'is_owner': True,
-                'owner': {
-                    'id': doc.owner.id,
-                    'username': doc.owner.username,
-                }
-            })
+        # Pages are cached under their version stamp, so any change to the
+        # list moves readers to a fresh key and stale entries just expire
+        cache_key = f'document_list:{_document_list_version(request)}'
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data)
         
-        for doc in shared_docs:
-            data.append({
-                'id': doc.id,
-                'title': doc.title,
-                'content': doc.content[:200] if doc.content else '',
-                'created_at': doc.created_at.isoformat() if doc.created_at else None,
-                'updated_at': doc.updated_at.isoformat() if doc.updated_at else None,
-                'is_owner': False,
-                'owner': {
-                    'id': doc.owner.id,
-                    'username': doc.owner.username,
-                }
-            })
+        # Owned and shared documents in one query, reading only the stored
+        # preview, never content, without building model instances
+        rows = _user_documents(request.user).annotate(
+            is_owner=Case(When(owner=request.user, then=Value(True)), default=Value(False), output_field=BooleanField())
+        ).values(
+            'id', 'title', 'preview', 'created_at', 'updated_at', 'is_owner', 'owner_id', 'owner__username'
+        )
         
-        return Response(data)
+        paginator = DocumentListPagination()
+        page = paginator.paginate_queryset(rows, request)
+        response = paginator.get_paginated_response(_document_list_items(page))
+        cache.set(cache_key, response.data, DOCUMENT_LIST_CACHE_TIMEOUT)
+        return response
     except Exception as e:
-        import traceback
-        error_detail = traceback.format_exc()
-        print(f"Document list error: {error_detail}")
-        return Response({'error': str(e), 'detail': error_detail}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.exception('Document list error')
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 @api_view(['POST'])
@@ -84,32 +165,29 @@ def document_create(request):
             'role': 'owner',  # Include role for frontend
         }, status=status.HTTP_201_CREATED)
     except Exception as e:
-        import traceback
-        error_detail = traceback.format_exc()
-        print(f"Document create error: {error_detail}")
-        return Response({'error': str(e), 'detail': error_detail}, status=status.HTTP_400_BAD_REQUEST)
+        logger.exception('Document create error')
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_document_etag)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def document_get(request, id):
     """Get a specific document"""
     try:
-        doc = Document.objects.get(id=id)
-        # Check if user has permission (owner or has permission)
-        if doc.owner != request.user and not doc.has_permission(request.user, 'viewer'):
-            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        # The user's permission row comes back with the document, so access
+        # and role are decided from a single query
+        doc = Document.objects.only('id', 'owner_id', 'title', 'content', 'created_at', 'updated_at').annotate(
+            user_role=_user_role(request.user),
+        ).get(id=id)
         
-        # Determine user's role
-        role = 'viewer'
-        if doc.owner == request.user:
+        if doc.owner_id == request.user.id:
             role = 'owner'
+        elif doc.user_role is not None:
+            role = doc.user_role
         else:
-            try:
-                permission = DocumentPermission.objects.get(document=doc, user=request.user)
-                role = permission.role
-            except DocumentPermission.DoesNotExist:
-                pass
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         
         return Response({
             'id': doc.id,
@@ -128,26 +206,41 @@ def document_get(request, id):
 def document_update(request, id):
     """Update a document"""
     try:
-        # Use request.data instead of request.body for DRF
-        doc = Document.objects.get(id=id)
+        # Only the submitted columns are written, and the row is never loaded
+        # as a model instance; content is read back only if it wasn't sent
+        fields = {key: request.data[key] for key in ('title', 'content') if key in request.data}
+        if 'content' in fields:
+            fields['preview'] = fields['content'][:Document.PREVIEW_LENGTH]
+        columns = ['owner_id', 'title'] + ([] if 'content' in fields else ['content'])
+        doc = Document.objects.filter(id=id).values(*columns).first()
+        if doc is None:
+            return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
         
         # Check permission - must be owner or have editor permission
-        if doc.owner != request.user and not doc.has_permission(request.user, 'editor'):
-            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        if doc['owner_id'] != request.user.id:
+            role = DocumentPermission.objects.filter(
+                document_id=id,
+                user=request.user
+            ).values_list('role', flat=True).first()
+            if role not in ('owner', 'editor'):
+                return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         
-        doc.title = request.data.get('title', doc.title)
-        doc.content = request.data.get('content', doc.content)
-        doc.last_edited_by = request.user
-        doc.save()
+        updated_at = timezone.now()
+        updated = Document.objects.filter(id=id).update(
+            **fields,
+            last_edited_by=request.user,
+            updated_at=updated_at,
+        )
+        if not updated:
+            return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+        doc.update(fields)
         
         return Response({
-            'id': doc.id,
-            'title': doc.title,
-            'content': doc.content,
-            'updated_at': doc.updated_at.isoformat(),
+            'id': id,
+            'title': doc['title'],
+            'content': doc['content'],
+            'updated_at': updated_at.isoformat(),
         })
-    except Document.DoesNotExist:
-        return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -167,74 +260,193 @@ def document_delete(request, id):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def document_share(request, id):
-    """Share a document with another user"""
-    max_retries = 3
-    retry_delay = 0.1  # 100ms
-    
-    for attempt in range(max_retries):
+    """Share a document with another user ('email') or several ('emails')"""
+    try:
+        emails = request.data.get('emails')
+        single = emails is None
+        if single:
+            email = request.data.get('email')
+            emails = [email] if email else []
+        role = request.data.get('role', 'viewer')
+        
+        if not emails:
+            return Response({'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(emails, list):
+            return Response({'error': 'emails must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        doc = Document.objects.only('id', 'owner_id', 'title').get(id=id, owner=request.user)
+        
+        # One query for all recipients, one for their existing shares and one
+        # upsert, however many emails were sent
+        users = list(User.objects.only('id', 'username', 'email').filter(email__in=emails))
+        if not users:
+            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+        if any(user.id == request.user.id for user in users):
+            return Response({'error': 'Cannot share with yourself'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        already_shared = set(DocumentPermission.objects.filter(
+            document=doc, user__in=users,
+        ).values_list('user_id', flat=True))
+        # The unique (document, user) constraint makes this an upsert, and keeps
+        # concurrent shares from duplicating a permission without locking the document
+        DocumentPermission.objects.bulk_create(
+            [DocumentPermission(document=doc, user=user, role=role) for user in users],
+            update_conflicts=True,
+            unique_fields=['document', 'user'],
+            update_fields=['role'],
+        )
+        
+        # bulk_create sends no post_save, so the collaboration receivers don't
+        # see these rows; drop the recipients' cached roles here instead
+        room_group_name = f'document_{doc.id}'
+        for user in users:
+            transaction.on_commit(partial(notify_permission_changed, room_group_name, user.id))
+        
+        # The notifications are written by the Celery worker once the
+        # permissions have committed, so the response doesn't wait on them
+        # (or inline, if the broker is down)
+        recipient_ids = [user.id for user in users]
+        transaction.on_commit(lambda: queue_share_notifications(
+            recipient_ids, doc.id, role, request.user.username, doc.title,
+        ), robust=True)
+        
+        created = any(user.id not in already_shared for user in users)
+        response_status = status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        if single:
+            user = users[0]
+            return Response({
+                'success': True,
+                'message': f'Document shared with {user.username}',
+                'user': {
+                    'id': user.id,
+                    'username': user.username,
+                    'email': user.email,
+                },
+                'role': role
+            }, status=response_status)
+        
+        found = {user.email for user in users}
+        return Response({
+            'success': True,
+            'message': f'Document shared with {len(users)} users',
+            'users': [{
+                'id': user.id,
+                'username': user.username,
+                'email': user.email,
+                'created': user.id not in already_shared,
+            } for user in users],
+            'not_found': [email for email in emails if email not in found],
+            'role': role
+        }, status=response_status)
+    except Document.DoesNotExist:
+        return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _docx_export_key(task_id):
+    """Cache key recording which document a DOCX export task was issued for"""
+    return f'docx_export:{task_id}'
+
+
+def _can_view_document(user, id):
+    """Whether the user owns the document or has any role on it (None if it doesn't exist)"""
+    doc = Document.objects.only('id', 'owner_id').annotate(user_role=_user_role(user)).filter(id=id).first()
+    if doc is None:
+        return None
+    return doc.owner_id == user.id or doc.user_role is not None
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def document_export_docx(request, id):
+    """Start a DOCX export in the background and return where to poll for it"""
+    try:
+        can_view = _can_view_document(request.user, id)
+        if can_view is None:
+            return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not can_view:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        
+        task = export_document_to_docx.delay(id)
+        cache.set(_docx_export_key(task.id), id, DOCX_EXPORT_MAX_AGE)
+        return Response({
+            'task_id': task.id,
+            'status_url': request.build_absolute_uri(f'{request.path}{task.id}/'),
+        }, status=status.HTTP_202_ACCEPTED)
+    except Exception:
+        logger.exception('Document export error')
+        return Response({'error': 'Failed to start export'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def document_export_docx_status(request, id, task_id):
+    """Poll a DOCX export: 202 while it runs, then 200 with the download URL"""
+    try:
+        can_view = _can_view_document(request.user, id)
+        if can_view is None:
+            return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not can_view:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        
+        # Unknown task ids would otherwise read as PENDING forever
+        if cache.get(_docx_export_key(task_id)) != id:
+            return Response({'error': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        result = export_document_to_docx.AsyncResult(task_id)
+        if result.failed():
+            return Response({'status': 'failed', 'error': 'Export failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if not result.successful():
+            return Response({'status': 'pending'}, status=status.HTTP_202_ACCEPTED)
+        
+        export = result.result
+        # Task ids from another document's export don't unlock its file
+        if export['document_id'] != id:
+            return Response({'error': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)
+        download_path = reverse('documents:export_docx_download', args=[id])
+        return Response({
+            'status': 'done',
+            'url': request.build_absolute_uri(f'{download_path}?{urlencode({"token": export["token"]})}'),
+        })
+    except Exception:
+        logger.exception('Document export status error')
+        return Response({'error': 'Failed to check export'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def document_export_docx_download(request, id):
+    """Download a finished DOCX export with the signed token from its status"""
+    try:
+        signer = docx_export_signer()
         try:
-            with transaction.atomic():
-                # Use select_for_update to lock the document row
-                doc = Document.objects.select_for_update().get(id=id, owner=request.user)
-                
-                email = request.data.get('email')
-                role = request.data.get('role', 'viewer')
-                
-                if not email:
-                    return Response({'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
-                
-                try:
-                    user = User.objects.get(email=email)
-                except User.DoesNotExist:
-                    return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
-                
-                if user == request.user:
-                    return Response({'error': 'Cannot share with yourself'}, status=status.HTTP_400_BAD_REQUEST)
-                
-                # Create or update permission
-                permission, created = DocumentPermission.objects.update_or_create(
-                    document=doc,
-                    user=user,
-                    defaults={'role': role}
-                )
-                
-                # Create notification (use get_or_create to avoid duplicates)
-                Notification.objects.get_or_create(
-                    recipient=user,
-                    notification_type='share',
-                    content_type=ContentType.objects.get_for_model(Document),
-                    object_id=doc.id,
-                    defaults={
-                        'title': 'Document Shared',
-                        'message': f'{request.user.username} shared "{doc.title}" with you as {role}',
-                    }
-                )
-                
-                return Response({
-                    'success': True,
-                    'message': f'Document shared with {user.username}',
-                    'user': {
-                        'id': user.id,
-                        'username': user.username,
-                        'email': user.email,
-                    },
-                    'role': role
-                }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
-        except Document.DoesNotExist:
+            export = signer.unsign_object(request.query_params.get('token', ''))
+        except signing.BadSignature:
+            return Response({'error': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)
+        if export['document_id'] != id:
+            return Response({'error': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        # Access is checked on every download, so revoking a share revokes the link
+        can_view = _can_view_document(request.user, id)
+        if can_view is None:
             return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            error_msg = str(e)
-            # Check if it's a database locked error
-            if 'database is locked' in error_msg.lower() and attempt < max_retries - 1:
-                time.sleep(retry_delay * (attempt + 1))  # Exponential backoff
-                continue
-            # Log the error for debugging
-            import traceback
-            print(f"Document share error (attempt {attempt + 1}): {traceback.format_exc()}")
-            return Response({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
-    
-    # If we get here, all retries failed
-    return Response({'error': 'Database is busy. Please try again.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if not can_view:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            signer.unsign_object(request.query_params['token'], max_age=DOCX_EXPORT_MAX_AGE)
+        except signing.SignatureExpired:
+            # purge_document_exports would remove it too; don't wait for it
+            default_storage.delete(export['name'])
+            return Response({'error': 'Export expired'}, status=status.HTTP_410_GONE)
+        
+        if not default_storage.exists(export['name']):
+            return Response({'error': 'Export expired'}, status=status.HTTP_410_GONE)
+        return FileResponse(default_storage.open(export['name'], 'rb'), as_attachment=True, filename=export['filename'])
+    except Exception:
+        logger.exception('Document export download error')
+        return Response({'error': 'Failed to download export'}, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['POST'])
@@ -242,10 +454,10 @@ def document_share(request, id):
 def document_remove(request, id):
     """Remove a shared document from user's list (unshare for the current user)"""
     try:
-        doc = Document.objects.get(id=id)
+        doc = Document.objects.only('owner_id').get(id=id)
         
         # Check if user has permission (not owner, but has been shared with)
-        if doc.owner == request.user:
+        if doc.owner_id == request.user.id:
             return Response({'error': 'Cannot remove owned document. Use delete instead.'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Remove the permission
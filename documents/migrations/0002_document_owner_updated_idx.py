@@ -0,0 +1,17 @@
+# Generated by Django 4.2.8 on 2026-10-15 23:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', '-updated_at'], name='documents_owner_updated_idx'),
+        ),
+    ]
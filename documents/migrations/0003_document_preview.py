@@ -0,0 +1,25 @@
+# Generated by Django 4.2.8 on 2026-10-15 23:40
+
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+
+def backfill_preview(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    Document.objects.update(preview=Substr('content', 1, 200))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_document_owner_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='preview',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(backfill_preview, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.8 on 2026-10-15 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_document_preview'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='documentpermission',
+            index=models.Index(fields=['user', 'document'], name='documents_perm_user_doc_idx'),
+        ),
+    ]
@@ -7,6 +7,11 @@ import json
 class Document(models.Model):
     """Main document model for rich text documents"""
     
+    PREVIEW_LENGTH = 200
+    
+    # Role ranks for has_permission; a role satisfies any requirement ranked at or below it
+    ROLE_LEVELS = {'owner': 4, 'editor': 3, 'commenter': 2, 'viewer': 1}
+    
     DOCUMENT_TYPES = [
         ('docx', 'Word Document'),
         ('txt', 'Plain Text'),
@@ -16,6 +21,8 @@ class Document(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_documents')
     title = models.CharField(max_length=255)
     content = models.TextField(blank=True, default='')  # Stores HTML content
+    # First PREVIEW_LENGTH characters of content, kept so lists never read content
+    preview = models.CharField(max_length=200, blank=True, default='', editable=False)
     document_type = models.CharField(max_length=10, choices=DOCUMENT_TYPES, default='docx')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -23,34 +30,49 @@ class Document(models.Model):
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Serves the owner's document list, which is ordered by -updated_at
+            models.Index(fields=['owner', '-updated_at'], name='documents_owner_updated_idx'),
+        ]
     
     def __str__(self):
         return self.title
     
+    def save(self, *args, **kwargs):
+        self.preview = self.content[:self.PREVIEW_LENGTH]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'preview'}
+        super().save(*args, **kwargs)
+    
     def has_permission(self, user, required_role='viewer'):
         """Check if user has required permission level"""
-        role_hierarchy = {'owner': 4, 'editor': 3, 'commenter': 2, 'viewer': 1}
-        
-        if self.owner == user:
-            return True
-        
-        try:
-            permission = self.permissions.get(user=user)
-            user_level = role_hierarchy.get(permission.role, 0)
-            required_level = role_hierarchy.get(required_role, 0)
-            return user_level >= required_level
-        except DocumentPermission.DoesNotExist:
+        role = self.get_user_role(user)
+        if role is None:
             return False
+        return self.ROLE_LEVELS.get(role, 0) >= self.ROLE_LEVELS.get(required_role, 0)
     
     def get_user_role(self, user):
         """Get the role of a user for this document"""
-        if self.owner == user:
+        # Compares ids so the owner row is never loaded for the check
+        if self.owner_id == user.id:
             return 'owner'
-        try:
-            permission = self.permissions.get(user=user)
-            return permission.role
-        except DocumentPermission.DoesNotExist:
+        # Views check several roles per request; each user's is looked up once
+        # per instance, like prefetched relations are
+        role_cache = self.__dict__.setdefault('_role_cache', {})
+        if user.id not in role_cache:
+            role_cache[user.id] = self._lookup_shared_role(user)
+        return role_cache[user.id]
+    
+    def _lookup_shared_role(self, user):
+        # Reuse permissions prefetched by the caller; a filter() on the related
+        # manager would bypass that cache and query again
+        if 'permissions' in getattr(self, '_prefetched_objects_cache', {}):
+            for permission in self.permissions.all():
+                if permission.user_id == user.id:
+                    return permission.role
             return None
+        return self.permissions.filter(user_id=user.id).values_list('role', flat=True).first()
 
 
 class DocumentPermission(models.Model):
@@ -70,6 +92,11 @@ class DocumentPermission(models.Model):
     
     class Meta:
         unique_together = ['document', 'user']
+        indexes = [
+            # The unique index leads with document; the list's shared-documents
+            # lookup filters by user and reads only document_id
+            models.Index(fields=['user', 'document'], name='documents_perm_user_doc_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.role} on {self.document.title}"
@@ -0,0 +1,56 @@
+"""
+Background tasks for documents, run by the Celery worker
+"""
+import io
+import uuid
+from datetime import timedelta
+
+from celery import shared_task
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import Document
+from .utils import HTMLToDocxConverter
+
+# Storage directory for finished exports
+DOCX_EXPORT_DIR = 'exports'
+# How long an export's download token is valid; the file is purged after that
+DOCX_EXPORT_MAX_AGE = 60 * 60
+DOCX_EXPORT_SALT = 'documents.docx_export'
+
+
+def docx_export_signer():
+    """Signer for export download tokens (checked with max_age=DOCX_EXPORT_MAX_AGE)"""
+    return signing.TimestampSigner(salt=DOCX_EXPORT_SALT)
+
+
+@shared_task
+def export_document_to_docx(document_id):
+    """Write a document to DOCX in storage and return a signed token for downloading it"""
+    document = Document.objects.only('title', 'content').get(pk=document_id)
+    buffer = io.BytesIO()
+    HTMLToDocxConverter.convert(document.content).save(buffer)
+    name = default_storage.save(f'{DOCX_EXPORT_DIR}/{uuid.uuid4().hex}.docx', ContentFile(buffer.getvalue()))
+    token = docx_export_signer().sign_object({
+        'document_id': document_id,
+        'name': name,
+        # What the browser saves the download as
+        'filename': f'{get_valid_filename(document.title) or "document"}.docx',
+    })
+    return {'document_id': document_id, 'token': token}
+
+
+@shared_task(ignore_result=True)
+def purge_document_exports():
+    """Delete exports whose download token has expired (run by celery beat)"""
+    if not default_storage.exists(DOCX_EXPORT_DIR):
+        return
+    cutoff = timezone.now() - timedelta(seconds=DOCX_EXPORT_MAX_AGE)
+    _, files = default_storage.listdir(DOCX_EXPORT_DIR)
+    for filename in files:
+        name = f'{DOCX_EXPORT_DIR}/{filename}'
+        if default_storage.get_modified_time(name) < cutoff:
+            default_storage.delete(name)
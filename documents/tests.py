@@ -3,26 +3,35 @@ Comprehensive tests for the documents app
 Tests models, API endpoints, permissions, and business logic
 """
 
+from django.db import IntegrityError, connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status
 from .models import Document, DocumentPermission, DocumentComment, DocumentVersion
+from notifications.models import Notification
 import json
+import os
+import tempfile
 
 
 class DocumentModelTests(TestCase):
     """Test Document model functionality"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.document = Document.objects.create(
-            owner=self.owner,
+        cls.document = Document.objects.create(
+            owner=cls.owner,
             title='Test Document',
             content='<p>Test content</p>'
         )
@@ -37,6 +46,14 @@ class DocumentModelTests(TestCase):
         """Test document string representation"""
         self.assertEqual(str(self.document), 'Test Document')
     
+    def test_document_preview(self):
+        """Test that saving keeps the preview in step with content"""
+        self.assertEqual(self.document.preview, '<p>Test content</p>')
+        self.document.content = 'y' * 300
+        self.document.save(update_fields=['content'])
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.preview, 'y' * 200)
+    
     def test_document_has_permission_owner(self):
         """Test that owner has all permissions"""
         self.assertTrue(self.document.has_permission(self.owner, 'owner'))
@@ -62,20 +79,21 @@ class DocumentModelTests(TestCase):
 class DocumentPermissionModelTests(TestCase):
     """Test DocumentPermission model"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='user',
             email='user@example.com',
             password='pass123'
         )
-        self.document = Document.objects.create(
-            owner=self.owner,
+        cls.document = Document.objects.create(
+            owner=cls.owner,
             title='Test Document',
             content='<p>Test</p>'
         )
@@ -100,7 +118,7 @@ class DocumentPermissionModelTests(TestCase):
         )
         
         # Try to create duplicate
-        with self.assertRaises(Exception):
+        with self.assertRaises(IntegrityError):
             DocumentPermission.objects.create(
                 document=self.document,
                 user=self.user,
@@ -118,39 +136,156 @@ class DocumentPermissionModelTests(TestCase):
         self.assertTrue(self.document.has_permission(self.user, 'editor'))
         self.assertTrue(self.document.has_permission(self.user, 'viewer'))
         self.assertFalse(self.document.has_permission(self.user, 'owner'))
+    
+    def test_document_has_permission_uses_prefetch(self):
+        """Test that permission checks reuse prefetched permissions instead of querying"""
+        DocumentPermission.objects.create(document=self.document, user=self.user, role='commenter')
+        other_user = User.objects.create_user(username='other', password='pass123')
+        document = Document.objects.prefetch_related('permissions').get(id=self.document.id)
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(document.get_user_role(self.owner), 'owner')
+            self.assertTrue(document.has_permission(self.user, 'commenter'))
+            self.assertFalse(document.has_permission(self.user, 'editor'))
+            self.assertIsNone(document.get_user_role(other_user))
+        
+        # Without a prefetch it is one query for the user's role
+        with self.assertNumQueries(1):
+            self.assertTrue(self.document.has_permission(self.user, 'viewer'))
+    
+    def test_has_permission_is_cached(self):
+        """Test that repeated checks for one user on one instance query once"""
+        DocumentPermission.objects.create(document=self.document, user=self.user, role='editor')
+        document = Document.objects.get(id=self.document.id)
+        
+        with self.assertNumQueries(1):
+            self.assertTrue(document.has_permission(self.user, 'viewer'))
+            self.assertTrue(document.has_permission(self.user, 'editor'))
+            self.assertEqual(document.get_user_role(self.user), 'editor')
+        
+        # A fresh instance sees later changes
+        DocumentPermission.objects.filter(document=document, user=self.user).delete()
+        self.assertFalse(Document.objects.get(id=document.id).has_permission(self.user, 'viewer'))
 
 
 class DocumentAPITests(TestCase):
     """Test Document API endpoints"""
     
-    def setUp(self):
+    client_class = APIClient
+    
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.client = APIClient()
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='user',
             email='user@example.com',
             password='pass123'
         )
-        self.document = Document.objects.create(
-            owner=self.owner,
+        cls.document = Document.objects.create(
+            owner=cls.owner,
             title='Test Document',
             content='<p>Test content</p>'
         )
     
+    def setUp(self):
+        """Drop cached list pages, whose keys can repeat once ids are reused"""
+        cache.clear()
+    
     def test_document_list_authenticated(self):
         """Test listing documents when authenticated"""
         self.client.force_authenticate(user=self.owner)
-        response = self.client.get('/api/documents/', format='json')
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/documents/', format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(response.data['results'], list)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['title'], 'Test Document')
+        self.assertIsNone(response.data['next'])
+    
+    def test_document_list_queries_constant(self):
+        """Test that the list's query count doesn't grow with owners or shares"""
+        permissions = []
+        for i in range(5):
+            other = User.objects.create_user(username=f'sharer{i}', password='pass123')
+            shared = Document.objects.create(owner=other, title=f'Shared {i}')
+            permissions += [
+                DocumentPermission(document=shared, user=self.owner, role='viewer'),
+                DocumentPermission(document=shared, user=self.user, role='editor'),
+            ]
+            Document.objects.create(owner=self.owner, title=f'Owned {i}')
+        DocumentPermission.objects.bulk_create(permissions)
+        self.client.force_authenticate(user=self.owner)
+        
+        # The version stamp aggregate and the page, owners included
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/documents/', format='json')
+        
+        self.assertEqual(len(response.data['results']), 11)
+        usernames = {doc['owner']['username'] for doc in response.data['results']}
+        self.assertEqual(usernames, {'owner'} | {f'sharer{i}' for i in range(5)})
+    
+    def test_document_list_owned_and_shared(self):
+        """Test that the list previews content and includes shared documents"""
+        self.document.content = 'x' * 500
+        self.document.save()
+        shared = Document.objects.create(owner=self.user, title='Shared Document')
+        DocumentPermission.objects.create(document=shared, user=self.owner, role='viewer')
+        # A stray permission on an owned document must not list it twice
+        DocumentPermission.objects.create(document=self.document, user=self.owner, role='editor')
+        self.client.force_authenticate(user=self.owner)
+        
+        # The version stamp aggregate, then the page itself
+        with self.assertNumQueries(2) as queries:
+            response = self.client.get('/api/documents/', format='json')
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIsInstance(response.data, list)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['title'], 'Test Document')
+        for query in queries.captured_queries:
+            self.assertNotIn('"content"', query['sql'])
+            self.assertIn('EXISTS', query['sql'])
+            self.assertNotIn('DISTINCT', query['sql'])
+        # Newest first, whether owned or shared
+        other, owned = response.data['results']
+        self.assertEqual(owned['content'], 'x' * 200)
+        self.assertTrue(owned['is_owner'])
+        self.assertEqual(other['title'], 'Shared Document')
+        self.assertFalse(other['is_owner'])
+        self.assertEqual(other['owner'], {'id': self.user.id, 'username': 'user'})
+    
+    def test_document_list_pages(self):
+        """Test that the list is served in cursor pages without repeats"""
+        for i in range(54):
+            Document.objects.create(owner=self.owner, title=f'Doc {i}')
+        self.client.force_authenticate(user=self.owner)
+        
+        response = self.client.get('/api/documents/', format='json')
+        self.assertEqual(len(response.data['results']), 50)
+        self.assertEqual(response.data['results'][0]['title'], 'Doc 53')
+        self.assertIsNotNone(response.data['next'])
+        
+        next_page = self.client.get(response.data['next'], format='json')
+        self.assertEqual(len(next_page.data['results']), 5)
+        self.assertIsNone(next_page.data['next'])
+        ids = [doc['id'] for doc in response.data['results'] + next_page.data['results']]
+        self.assertEqual(len(set(ids)), Document.objects.count())
+    
+    def test_document_list_cached(self):
+        """Test that an unchanged list is served from the cache until a document changes"""
+        self.client.force_authenticate(user=self.owner)
+        self.client.get('/api/documents/', format='json')
+        
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/documents/', format='json')
+        self.assertEqual(response.data['results'][0]['title'], 'Test Document')
+        
+        Document.objects.filter(id=self.document.id).update(title='Renamed', updated_at=timezone.now())
+        response = self.client.get('/api/documents/', format='json')
+        self.assertEqual(response.data['results'][0]['title'], 'Renamed')
     
     def test_document_list_unauthenticated(self):
         """Test listing documents without authentication"""
@@ -172,10 +307,19 @@ class DocumentAPITests(TestCase):
         # Verify document was created
         self.assertTrue(Document.objects.filter(title='New Document').exists())
     
+    def test_document_create_malformed_json(self):
+        """Test that a malformed JSON body is rejected"""
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post('/api/documents/create/', '{"title": ', content_type='application/json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Document.objects.filter(owner=self.owner).exclude(id=self.document.id).exists())
+    
     def test_document_get_owner(self):
         """Test getting document as owner"""
         self.client.force_authenticate(user=self.owner)
-        response = self.client.get(f'/api/documents/{self.document.id}/', format='json')
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/documents/{self.document.id}/', format='json')
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['title'], 'Test Document')
@@ -194,6 +338,61 @@ class DocumentAPITests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['role'], 'viewer')
     
+    def test_document_get_single_query(self):
+        """Test that access and role for a shared user come from one query"""
+        DocumentPermission.objects.create(document=self.document, user=self.user, role='commenter')
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/documents/{self.document.id}/', format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['role'], 'commenter')
+        self.assertEqual(response.data['content'], self.document.content)
+    
+    def test_document_get_conditional(self):
+        """Test that an unchanged document revalidates with a bodiless 304"""
+        DocumentPermission.objects.create(document=self.document, user=self.user, role='viewer')
+        self.client.force_login(self.user)
+        response = self.client.get(f'/api/documents/{self.document.id}/')
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        
+        # The session's user, then the ETag lookup; the document body is never read
+        with self.assertNumQueries(2) as queries:
+            response = self.client.get(f'/api/documents/{self.document.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertNotIn('"content"', queries.captured_queries[1]['sql'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        
+        # A role change alters the response, so it changes the ETag too
+        DocumentPermission.objects.filter(document=self.document, user=self.user).update(role='editor')
+        response = self.client.get(f'/api/documents/{self.document.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['role'], 'editor')
+        
+        # So does an edit
+        etag = response['ETag']
+        self.document.title = 'Renamed'
+        self.document.save()
+        response = self.client.get(f'/api/documents/{self.document.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data['title'], 'Renamed')
+    
+    def test_document_list_conditional(self):
+        """Test that the list revalidates until a document is edited, shared or unshared"""
+        self.client.force_login(self.user)
+        etag = self.client.get('/api/documents/')['ETag']
+        self.assertEqual(self.client.get('/api/documents/', HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        
+        permission = DocumentPermission.objects.create(document=self.document, user=self.user, role='viewer')
+        response = self.client.get('/api/documents/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(response.data['results']), 1)
+        
+        etag = response['ETag']
+        permission.delete()
+        response = self.client.get('/api/documents/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data['results'], [])
+    
     def test_document_get_no_permission(self):
         """Test getting document without permission"""
         self.client.force_authenticate(user=self.user)
@@ -242,6 +441,28 @@ class DocumentAPITests(TestCase):
         
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
     
+    def test_document_update_title_only(self):
+        """Test that a title-only update leaves content alone in two queries"""
+        self.client.force_authenticate(user=self.owner)
+        content = self.document.content
+        with self.assertNumQueries(2):
+            response = self.client.post(f'/api/documents/{self.document.id}/update/', {'title': 'Renamed'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], 'Renamed')
+        self.assertEqual(response.data['content'], content)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.title, 'Renamed')
+        self.assertEqual(self.document.content, content)
+        self.assertEqual(self.document.last_edited_by, self.owner)
+    
+    def test_document_update_not_found(self):
+        """Test updating a document that does not exist"""
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post('/api/documents/99999/update/', {'title': 'X'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
     def test_document_delete_owner(self):
         """Test deleting document as owner"""
         self.client.force_authenticate(user=self.owner)
@@ -261,21 +482,23 @@ class DocumentAPITests(TestCase):
 class DocumentShareAPITests(TestCase):
     """Test document sharing functionality"""
     
-    def setUp(self):
+    client_class = APIClient
+    
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.client = APIClient()
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='user',
             email='user@example.com',
             password='pass123'
         )
-        self.document = Document.objects.create(
-            owner=self.owner,
+        cls.document = Document.objects.create(
+            owner=cls.owner,
             title='Test Document',
             content='<p>Test</p>'
         )
@@ -300,6 +523,83 @@ class DocumentShareAPITests(TestCase):
             role='editor'
         ).exists())
     
+    def test_document_share_notifies_after_commit(self):
+        """Test that the share notification is queued once the permission commits"""
+        self.client.force_authenticate(user=self.owner)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(f'/api/documents/{self.document.id}/permission/add/',
+                                            {'email': 'user@example.com'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse(any('notifications_notification' in q for q in sql))
+        user_query = next(q for q in sql if 'FROM "auth_user"' in q)
+        self.assertNotIn('"password"', user_query)
+        
+        self.assertFalse(Notification.objects.exists())
+        for callback in callbacks:
+            callback()
+        notification = Notification.objects.get(recipient=self.user)
+        self.assertEqual(notification.content_type, ContentType.objects.get_for_model(Document))
+        self.assertEqual(notification.message, 'owner shared "Test Document" with you as viewer')
+    
+    def test_document_share_notifies_inline_without_broker(self):
+        """Test that notifications are written in-process when the broker can't be reached"""
+        from unittest import mock
+        from kombu.exceptions import OperationalError
+        from notifications.tasks import send_share_notifications
+        self.client.force_authenticate(user=self.owner)
+        with mock.patch.object(send_share_notifications, 'delay', side_effect=OperationalError('broker down')), \
+                self.assertLogs('notifications.tasks', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/documents/{self.document.id}/permission/add/',
+                                        {'email': 'user@example.com'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Notification.objects.filter(recipient=self.user, notification_type='share').exists())
+    
+    def test_document_share_update_role(self):
+        """Test that sharing again updates the role without a second notification"""
+        DocumentPermission.objects.create(document=self.document, user=self.user, role='viewer')
+        self.client.force_authenticate(user=self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/documents/{self.document.id}/permission/add/',
+                                        {'email': 'user@example.com', 'role': 'editor'}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/documents/{self.document.id}/permission/add/',
+                             {'email': 'user@example.com', 'role': 'editor'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(DocumentPermission.objects.get(document=self.document, user=self.user).role, 'editor')
+        self.assertEqual(Notification.objects.filter(recipient=self.user).count(), 1)
+    
+    def test_document_share_many(self):
+        """Test sharing with a list of emails in a fixed number of queries"""
+        for i in range(4):
+            User.objects.create_user(username=f'reader{i}', email=f'reader{i}@example.com', password='pass123')
+        DocumentPermission.objects.create(document=self.document, user=self.user, role='viewer')
+        self.client.force_authenticate(user=self.owner)
+        url = f'/api/documents/{self.document.id}/permission/add/'
+        
+        # Document, recipients, existing shares and one upsert, however many emails
+        with self.assertNumQueries(4):
+            self.client.post(url, {'emails': ['reader0@example.com', 'reader1@example.com']}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(4):
+                response = self.client.post(url, {
+                    'emails': ['user@example.com', 'reader2@example.com', 'reader3@example.com', 'nobody@example.com'],
+                    'role': 'editor',
+                }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['not_found'], ['nobody@example.com'])
+        created = {user['username']: user['created'] for user in response.data['users']}
+        self.assertEqual(created, {'user': False, 'reader2': True, 'reader3': True})
+        self.assertEqual(DocumentPermission.objects.get(document=self.document, user=self.user).role, 'editor')
+        self.assertEqual(DocumentPermission.objects.filter(document=self.document).count(), 5)
+        self.assertEqual(Notification.objects.filter(object_id=self.document.id).count(), 3)
+    
     def test_document_share_not_owner(self):
         """Test sharing document as non-owner (should fail)"""
         self.client.force_authenticate(user=self.user)
@@ -353,18 +653,158 @@ class DocumentShareAPITests(TestCase):
         ).exists())
 
 
+class DocumentExportAPITests(TestCase):
+    """Test background DOCX export"""
+    
+    client_class = APIClient
+    
+    @classmethod
+    def setUpTestData(cls):
+        """Set up test data"""
+        cls.owner = User.objects.create_user(username='owner', password='pass123')
+        cls.viewer = User.objects.create_user(username='viewer', password='pass123')
+        cls.other = User.objects.create_user(username='other', password='pass123')
+        cls.document = Document.objects.create(owner=cls.owner, title='Report', content='<h1>Report</h1><p>Body</p>')
+        DocumentPermission.objects.create(document=cls.document, user=cls.viewer, role='viewer')
+    
+    def setUp(self):
+        """Write exports to a temporary media directory"""
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.media_root = media_root.name
+    
+    def _export_url(self, user):
+        """Start an export as user and return the download URL from its status"""
+        self.client.force_authenticate(user=user)
+        response = self.client.post(f'/api/documents/{self.document.id}/export/docx/')
+        return self.client.get(response.data['status_url']).data['url']
+    
+    def _exported_files(self):
+        return os.listdir(os.path.join(self.media_root, 'exports'))
+    
+    def test_export_then_poll(self):
+        """Test that the export is accepted and polling returns a signed download URL"""
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.post(f'/api/documents/{self.document.id}/export/docx/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(response.data['status_url'].endswith(f'/export/docx/{response.data["task_id"]}/'))
+        
+        response = self.client.get(response.data['status_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'done')
+        self.assertIn(f'/api/documents/{self.document.id}/export/docx/download/?token=', response.data['url'])
+        
+        response = self.client.get(response.data['url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('filename="Report.docx"', response['Content-Disposition'])
+        import io
+        from docx import Document as DocxDocument
+        docx_doc = DocxDocument(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(docx_doc.paragraphs[0].text, 'Report')
+    
+    def test_download_after_share_revoked(self):
+        """Test that the download link stops working once the user loses access"""
+        url = self._export_url(self.viewer)
+        DocumentPermission.objects.filter(document=self.document, user=self.viewer).delete()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_download_bad_token(self):
+        """Test that tampered tokens and tokens for another document are rejected"""
+        url = self._export_url(self.owner)
+        response = self.client.get(url + 'x')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        other_doc = Document.objects.create(owner=self.owner, title='Other', content='<p>Other</p>')
+        response = self.client.get(url.replace(f'/documents/{self.document.id}/', f'/documents/{other_doc.id}/'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_download_expired(self):
+        """Test that an expired link answers 410 and deletes the file"""
+        import time
+        from unittest import mock
+        from .tasks import DOCX_EXPORT_MAX_AGE
+        url = self._export_url(self.owner)
+        self.assertEqual(len(self._exported_files()), 1)
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + DOCX_EXPORT_MAX_AGE + 1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(self._exported_files(), [])
+    
+    def test_purge_expired_exports(self):
+        """Test that the periodic purge deletes only exports older than the token lifetime"""
+        import time
+        from .tasks import DOCX_EXPORT_MAX_AGE, purge_document_exports
+        self._export_url(self.owner)
+        self._export_url(self.owner)
+        old_name, new_name = self._exported_files()
+        expired = time.time() - DOCX_EXPORT_MAX_AGE - 60
+        os.utime(os.path.join(self.media_root, 'exports', old_name), (expired, expired))
+        
+        purge_document_exports()
+        self.assertEqual(self._exported_files(), [new_name])
+    
+    def test_poll_pending(self):
+        """Test that an export no worker has finished yet reports 202"""
+        from unittest import mock
+        from .tasks import export_document_to_docx
+        self.client.force_authenticate(user=self.owner)
+        with mock.patch.object(export_document_to_docx, 'delay', return_value=mock.Mock(id='queued-task')):
+            status_url = self.client.post(f'/api/documents/{self.document.id}/export/docx/').data['status_url']
+        response = self.client.get(status_url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'pending')
+    
+    def test_poll_unknown_task(self):
+        """Test that task ids the export endpoint never issued are not found"""
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.get(f'/api/documents/{self.document.id}/export/docx/unknown-task/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_export_permission_denied(self):
+        """Test that users without access can't start or poll exports"""
+        self.client.force_authenticate(user=self.owner)
+        task_id = self.client.post(f'/api/documents/{self.document.id}/export/docx/').data['task_id']
+        
+        self.client.force_authenticate(user=self.other)
+        response = self.client.post(f'/api/documents/{self.document.id}/export/docx/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(f'/api/documents/{self.document.id}/export/docx/{task_id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_task_id_from_another_document(self):
+        """Test that an export can't be fetched through a different document"""
+        other_doc = Document.objects.create(owner=self.other, title='Other', content='<p>Other</p>')
+        DocumentPermission.objects.create(document=other_doc, user=self.viewer, role='viewer')
+        self.client.force_authenticate(user=self.owner)
+        task_id = self.client.post(f'/api/documents/{self.document.id}/export/docx/').data['task_id']
+        
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.get(f'/api/documents/{other_doc.id}/export/docx/{task_id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_export_missing_document(self):
+        """Test exporting a document that doesn't exist"""
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post('/api/documents/99999/export/docx/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class DocumentCommentModelTests(TestCase):
     """Test DocumentComment model"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.document = Document.objects.create(
-            owner=self.owner,
+        cls.document = Document.objects.create(
+            owner=cls.owner,
             title='Test Document',
             content='<p>Test</p>'
         )
@@ -383,15 +823,16 @@ class DocumentCommentModelTests(TestCase):
 class DocumentVersionModelTests(TestCase):
     """Test DocumentVersion model"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.document = Document.objects.create(
-            owner=self.owner,
+        cls.document = Document.objects.create(
+            owner=cls.owner,
             title='Test Document',
             content='<p>Version 1</p>'
         )
@@ -418,10 +859,166 @@ class DocumentVersionModelTests(TestCase):
         )
         
         # Try to create duplicate version number
-        with self.assertRaises(Exception):
+        with self.assertRaises(IntegrityError):
             DocumentVersion.objects.create(
                 document=self.document,
                 content='<p>V2</p>',
                 created_by=self.owner,
                 version_number=1
             )
+
+
+class DocumentAdminTests(TestCase):
+    """Test the Document admin changelist"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        """Set up test data"""
+        cls.admin_user = User.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            password='adminpass123'
+        )
+        cls.user = User.objects.create_user(username='user', password='pass123')
+        for i in range(3):
+            document = Document.objects.create(owner=cls.admin_user, title=f'Doc {i}')
+            DocumentPermission.objects.create(document=document, user=cls.user, role='viewer')
+            DocumentComment.objects.create(document=document, user=cls.user, content='Note')
+    
+    def test_changelist_counts_annotated(self):
+        """Test that the count columns don't query per row"""
+        self.client.force_login(self.admin_user)
+        with self.assertNumQueries(6):
+            response = self.client.get('/admin/documents/document/')
+        
+        self.assertEqual(response.status_code, 200)
+        document = response.context['cl'].result_list[0]
+        self.assertEqual(document._permission_count, 1)
+        self.assertEqual(document._comment_count, 1)
+    
+    def test_changelist_defers_content(self):
+        """Test that the changelists don't load document or snapshot bodies"""
+        document = Document.objects.first()
+        DocumentVersion.objects.create(document=document, content='<p>Old</p>', created_by=self.admin_user, version_number=1)
+        self.client.force_login(self.admin_user)
+        for url in ('/admin/documents/document/', '/admin/documents/documentversion/'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('"content"' in query['sql'] for query in queries.captured_queries))
+    
+    def test_comment_changelist_preview(self):
+        """Test that the comment changelist previews without loading bodies per row"""
+        DocumentComment.objects.create(document=Document.objects.first(), user=self.user, content='x' * 80)
+        self.client.force_login(self.admin_user)
+        with self.assertNumQueries(5) as queries:
+            response = self.client.get('/admin/documents/documentcomment/')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'x' * 50 + '...')
+        sql = queries.captured_queries[3]['sql']
+        self.assertNotIn('"documents_documentcomment"."content", "', sql)
+        self.assertNotIn('"documents_document"."content"', sql)
+
+
+class HTMLToDocxTests(TestCase):
+    """Test the HTML parsing behind DOCX export"""
+    
+    def test_parse_elements(self):
+        """Test that headings, formatted runs and lists come out of one pass"""
+        from .utils import _parse_html_simple
+        html = (
+            '<html><head><title>Skip</title><style>p {}</style></head><body>'
+            '<h1>Title &amp; <b>more</b></h1>'
+            '<p>Hello <b>bold <i>both</i></b> and\n   plain</p>'
+            '<ul><li>One</li><li><em>Two</em></li></ul><ol><li>A</li></ol>'
+            '<script>if (a < b) {}</script></body></html>'
+        )
+        elements = _parse_html_simple(html)
+        
+        self.assertEqual(elements[0], {'type': 'h1', 'text': 'Title & more'})
+        runs = [(run['text'], run['bold'], run['italic']) for run in elements[1]['runs']]
+        self.assertEqual(runs, [('Hello ', False, False), ('bold ', True, False), ('both', True, True), (' and plain', False, False)])
+        self.assertEqual(elements[2:], [{'type': 'ul', 'items': ['One', 'Two']}, {'type': 'ol', 'items': ['A']}])
+    
+    def test_convert(self):
+        """Test that the converter writes the parsed elements"""
+        from .utils import HTMLToDocxConverter
+        docx_doc = HTMLToDocxConverter.convert('<h2>Heading</h2><p>Some <u>text</u></p>')
+        paragraphs = docx_doc.paragraphs
+        self.assertEqual(paragraphs[0].style.name, 'Heading 2')
+        self.assertEqual(paragraphs[1].text, 'Some text')
+        self.assertTrue(paragraphs[1].runs[1].underline)
+    
+    def test_convert_round_trip(self):
+        """Test that the written XML reads back with styles, formatting and spacing intact"""
+        import io
+        from docx import Document as DocxDocument
+        from .utils import HTMLToDocxConverter
+        html = '<h1>Top</h1><p>Plain <b>bold</b> and <i>italic</i></p><ul><li>One</li></ul><ol><li>First</li></ol>'
+        buffer = io.BytesIO()
+        HTMLToDocxConverter.convert(html).save(buffer)
+        buffer.seek(0)
+        paragraphs = DocxDocument(buffer).paragraphs
+        
+        self.assertEqual([p.style.name for p in paragraphs], ['Heading 1', 'Normal', 'List Bullet', 'List Number'])
+        self.assertEqual(paragraphs[1].text, 'Plain bold and italic')
+        runs = [(run.text, run.bold, run.italic) for run in paragraphs[1].runs]
+        self.assertEqual(runs, [('Plain ', None, None), ('bold', True, None), (' and ', None, None), ('italic', None, True)])
+        self.assertEqual(paragraphs[3].text, 'First')
+
+
+class TextToHTMLTests(TestCase):
+    """Test plain text import"""
+    
+    def test_paragraphs_and_line_breaks(self):
+        """Test that blank lines split paragraphs and single newlines become breaks"""
+        from .utils import text_to_html
+        self.assertEqual(text_to_html('a<b\nc\n\n\n\nd'), '<p>a&lt;b<br>c</p>\n<p>d</p>')
+
+
+class HTMLToMarkdownTests(TestCase):
+    """Test Markdown export"""
+    
+    def test_markdown(self):
+        """Test that headings and bold text convert to Markdown"""
+        from .utils import html_to_markdown
+        self.assertEqual(html_to_markdown('<h1>T</h1><p>a <b>b</b></p>').strip(), '# T\n\na **b**')
+    
+    def test_without_html2text(self):
+        """Test the plain text fallback when html2text isn't installed"""
+        from unittest import mock
+        from . import utils
+        with mock.patch.object(utils, 'html2text', None):
+            self.assertEqual(utils.html_to_markdown('<p>a <b>b</b></p>'), 'a b')
+
+
+class MarkdownToHTMLTests(TestCase):
+    """Test Markdown import conversion"""
+    
+    def test_repeated_conversion_is_cached(self):
+        """Test that converting the same Markdown twice parses it once"""
+        from unittest import mock
+        from . import utils
+        utils._cached_markdown_to_html.cache_clear()
+        with mock.patch.object(utils, '_convert_markdown', wraps=utils._convert_markdown) as convert:
+            first = utils.markdown_to_html('# Title\n\nSome *text*')
+            second = utils.markdown_to_html('# Title\n\nSome *text*')
+        self.assertEqual(first, second)
+        self.assertIn('<h1>Title</h1>', first)
+        self.assertEqual(convert.call_count, 1)
+    
+    def test_large_markdown_bypasses_cache(self):
+        """Test that very large Markdown isn't kept in the cache"""
+        from . import utils
+        utils._cached_markdown_to_html.cache_clear()
+        utils.markdown_to_html('x' * utils.MARKDOWN_CACHE_MAX_LENGTH)
+        self.assertEqual(utils._cached_markdown_to_html.cache_info().currsize, 0)
+    
+    def test_converter_state_is_reset(self):
+        """Test that footnotes from one conversion don't leak into the next"""
+        from . import utils
+        utils._cached_markdown_to_html.cache_clear()
+        with_footnote = utils.markdown_to_html('Text[^1]\n\n[^1]: Note')
+        self.assertIn('Note', with_footnote)
+        self.assertEqual(utils.markdown_to_html('Plain'), '<p>Plain</p>')
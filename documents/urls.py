@@ -11,4 +11,7 @@ urlpatterns = [
     path('<int:id>/delete/', api.document_delete, name='delete'),
     path('<int:id>/permission/add/', api.document_share, name='share'),
     path('<int:id>/remove/', api.document_remove, name='remove'),
+    path('<int:id>/export/docx/', api.document_export_docx, name='export_docx'),
+    path('<int:id>/export/docx/download/', api.document_export_docx_download, name='export_docx_download'),
+    path('<int:id>/export/docx/<str:task_id>/', api.document_export_docx_status, name='export_docx_status'),
 ]
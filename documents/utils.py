@@ -1,13 +1,22 @@
 """
 Utilities for document import/export and conversion
 """
-import re
+from functools import lru_cache
 from html.parser import HTMLParser
-from django.utils.html import strip_tags
+import threading
+from django.utils.html import escape, strip_tags
 import markdown
 from docx import Document as DocxDocument
 from docx.shared import Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+try:
+    from html2text import html2text
+except ImportError:
+    # Markdown export falls back to plain text without html2text
+    html2text = None
 
 
 class HTMLToDocxConverter:
@@ -18,147 +27,186 @@ class HTMLToDocxConverter:
         """Convert HTML content to DOCX document"""
         doc = DocxDocument()
         
-        # Simple HTML parsing - extract paragraphs and basic formatting
-        # In production, use a proper HTML parser
+        # Paragraphs are written as raw w:p elements; python-docx's
+        # add_paragraph/add_run wrappers cost more than the XML itself
+        style_ids = {
+            name: doc.styles[name].style_id
+            for name in ('Heading 1', 'Heading 2', 'Heading 3', 'List Bullet', 'List Number')
+        }
+        # New paragraphs go before the body's trailing section properties
+        sect_pr = doc.element.body.sectPr
+        
+        # Extract paragraphs, headings, lists and basic run formatting
         soup = _parse_html_simple(html_content)
         
         for element in soup:
             if element['type'] == 'p':
-                para = doc.add_paragraph()
-                for run_data in element.get('runs', []):
-                    run = para.add_run(run_data['text'])
-                    if run_data.get('bold'):
-                        run.bold = True
-                    if run_data.get('italic'):
-                        run.italic = True
-                    if run_data.get('underline'):
-                        run.underline = True
+                sect_pr.addprevious(_paragraph_xml(None, element.get('runs', [])))
             
-            elif element['type'] == 'h1':
-                para = doc.add_paragraph(element['text'], style='Heading 1')
-            elif element['type'] == 'h2':
-                para = doc.add_paragraph(element['text'], style='Heading 2')
-            elif element['type'] == 'h3':
-                para = doc.add_paragraph(element['text'], style='Heading 3')
+            elif element['type'] in ('h1', 'h2', 'h3'):
+                style_id = style_ids['Heading ' + element['type'][1]]
+                sect_pr.addprevious(_paragraph_xml(style_id, [{'text': element['text']}]))
             
-            elif element['type'] == 'ul':
+            elif element['type'] in ('ul', 'ol'):
+                style_id = style_ids['List Bullet' if element['type'] == 'ul' else 'List Number']
                 for item in element.get('items', []):
-                    para = doc.add_paragraph(item, style='List Bullet')
-            
-            elif element['type'] == 'ol':
-                for i, item in enumerate(element.get('items', []), 1):
-                    para = doc.add_paragraph(item, style='List Number')
+                    sect_pr.addprevious(_paragraph_xml(style_id, [{'text': item}]))
         
         return doc
 
 
-def _parse_html_simple(html_content):
-    """Simple HTML parser - returns list of elements"""
-    elements = []
-    
-    # Remove script and style tags
-    html_content = re.sub(r'<script.*?</script>', '', html_content, flags=re.DOTALL)
-    html_content = re.sub(r'<style.*?</style>', '', html_content, flags=re.DOTALL)
+# Run attributes and the w:rPr child each one adds
+_RUN_PROPERTIES = (('bold', 'w:b'), ('italic', 'w:i'), ('underline', 'w:u'))
+
+
+def _paragraph_xml(style_id, runs):
+    """Build a w:p element with an optional paragraph style and formatted runs"""
+    para = OxmlElement('w:p')
+    if style_id:
+        p_pr = OxmlElement('w:pPr')
+        p_style = OxmlElement('w:pStyle')
+        p_style.set(qn('w:val'), style_id)
+        p_pr.append(p_style)
+        para.append(p_pr)
+    for run_data in runs:
+        text = run_data['text']
+        if not text:
+            continue
+        run = OxmlElement('w:r')
+        properties = [tag for key, tag in _RUN_PROPERTIES if run_data.get(key)]
+        if properties:
+            r_pr = OxmlElement('w:rPr')
+            for tag in properties:
+                prop = OxmlElement(tag)
+                if tag == 'w:u':
+                    prop.set(qn('w:val'), 'single')
+                r_pr.append(prop)
+            run.append(r_pr)
+        t = OxmlElement('w:t')
+        t.text = text
+        if text[0].isspace() or text[-1].isspace():
+            t.set(qn('xml:space'), 'preserve')
+        run.append(t)
+        para.append(run)
+    return para
+
+
+# Inline tags and the run attribute each one turns on
+_RUN_FORMATS = {'b': 'bold', 'strong': 'bold', 'i': 'italic', 'em': 'italic', 'u': 'underline'}
+# Tags whose content never reaches the document
+_SKIPPED_TAGS = {'head', 'script', 'style'}
+
+
+def _collapse_whitespace(text):
+    """Collapse runs of whitespace to one space, as HTML rendering does"""
+    collapsed = ' '.join(text.split())
+    if text[:1].isspace():
+        collapsed = ' ' + collapsed
+    if text[-1:].isspace():
+        collapsed += ' '
+    return collapsed
+
+
+class _HTMLElementParser(HTMLParser):
+    """
+    Single pass over the HTML that collects the elements HTMLToDocxConverter
+    writes: paragraphs of formatted runs, h1-h3 headings and ul/ol lists
+    """
     
-    # Extract body content if available
-    body_match = re.search(r'<body[^>]*>(.*?)</body>', html_content, re.DOTALL | re.IGNORECASE)
-    if body_match:
-        html_content = body_match.group(1)
+    def __init__(self):
+        super().__init__()
+        self.elements = []
+        self.current_para = {'type': 'p', 'runs': []}
+        self.current_list = None
+        self.list_type = None
+        self.heading = None  # (level, text parts) while inside h1-h3
+        self.list_item = None  # text parts while inside li
+        self.formats = {'bold': 0, 'italic': 0, 'underline': 0}
+        self.skip_depth = 0
     
-    # Split by tags and process
-    lines = re.split(r'(<[^>]+>)', html_content)
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in _RUN_FORMATS:
+            self.formats[_RUN_FORMATS[tag]] += 1
+        elif self.heading is not None or self.list_item is not None:
+            # Headings and list items are flattened to their text
+            return
+        elif tag in ('h1', 'h2', 'h3'):
+            self.heading = (int(tag[1]), [])
+        elif tag == 'p':
+            self.flush_paragraph()
+        elif tag in ('ul', 'ol'):
+            self.current_list = []
+            self.list_type = tag
+        elif tag == 'li':
+            self.list_item = []
     
-    current_para = {'type': 'p', 'runs': []}
-    current_list = []
-    in_list = False
-    list_type = None
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in _RUN_FORMATS:
+            name = _RUN_FORMATS[tag]
+            self.formats[name] = max(self.formats[name] - 1, 0)
+        elif tag in ('h1', 'h2', 'h3') and self.heading is not None:
+            level, parts = self.heading
+            self.elements.append({'type': f'h{level}', 'text': ' '.join(''.join(parts).split())})
+            self.heading = None
+        elif tag == 'li' and self.list_item is not None:
+            if self.current_list is not None:
+                self.current_list.append(' '.join(''.join(self.list_item).split()))
+            self.list_item = None
+        elif tag == 'p':
+            self.flush_paragraph()
+        elif tag in ('ul', 'ol') and self.current_list is not None:
+            self.elements.append({'type': self.list_type, 'items': self.current_list})
+            self.current_list = None
     
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        if not line:
-            i += 1
-            continue
-        
-        # Heading tags
-        if re.match(r'<h[123]', line, re.IGNORECASE):
-            level = int(line[2])
-            i += 1
-            text = ''
-            while i < len(lines) and not re.match(r'</h', lines[i], re.IGNORECASE):
-                text += lines[i]
-                i += 1
-            elements.append({'type': f'h{level}', 'text': strip_tags(text).strip()})
-            continue
-        
-        # Paragraph tag
-        elif re.match(r'<p', line, re.IGNORECASE):
-            if current_para['runs']:
-                elements.append(current_para)
-            current_para = {'type': 'p', 'runs': []}
-            i += 1
-            continue
-        
-        elif re.match(r'</p>', line, re.IGNORECASE):
-            if current_para['runs']:
-                elements.append(current_para)
-                current_para = {'type': 'p', 'runs': []}
-            i += 1
-            continue
-        
-        # List tags
-        elif re.match(r'<ul', line, re.IGNORECASE):
-            in_list = True
-            list_type = 'ul'
-            i += 1
-            continue
-        
-        elif re.match(r'<ol', line, re.IGNORECASE):
-            in_list = True
-            list_type = 'ol'
-            i += 1
-            continue
-        
-        elif re.match(r'</[ou]l>', line, re.IGNORECASE):
-            if in_list:
-                elements.append({'type': list_type, 'items': current_list})
-                current_list = []
-                in_list = False
-            i += 1
-            continue
-        
-        elif re.match(r'<li', line, re.IGNORECASE):
-            i += 1
-            text = ''
-            while i < len(lines) and not re.match(r'</li>', lines[i], re.IGNORECASE):
-                text += lines[i]
-                i += 1
-            current_list.append(strip_tags(text).strip())
-            continue
-        
-        # Text content
-        else:
-            if not re.match(r'<', line):
-                # Plain text
-                current_para['runs'].append({'text': line, 'bold': False, 'italic': False, 'underline': False})
-        
-        i += 1
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.heading is not None:
+            self.heading[1].append(data)
+        elif self.list_item is not None:
+            self.list_item.append(data)
+        elif data.strip():
+            self.current_para['runs'].append({
+                'text': _collapse_whitespace(data),
+                'bold': self.formats['bold'] > 0,
+                'italic': self.formats['italic'] > 0,
+                'underline': self.formats['underline'] > 0,
+            })
     
-    if current_para['runs']:
-        elements.append(current_para)
+    def flush_paragraph(self):
+        runs = self.current_para['runs']
+        if runs:
+            runs[0]['text'] = runs[0]['text'].lstrip()
+            runs[-1]['text'] = runs[-1]['text'].rstrip()
+            self.elements.append(self.current_para)
+            self.current_para = {'type': 'p', 'runs': []}
     
-    return elements
+    def close(self):
+        super().close()
+        self.flush_paragraph()
+
+
+def _parse_html_simple(html_content):
+    """Simple HTML parser - returns list of elements"""
+    parser = _HTMLElementParser()
+    parser.feed(html_content)
+    parser.close()
+    return parser.elements
 
 
 def html_to_markdown(html_content):
     """Convert HTML to Markdown"""
-    from html2text import html2text
+    if html2text is None:
+        return strip_tags(html_content)
     try:
         markdown_content = html2text(html_content)
         return markdown_content
     except:
-        # Fallback: simple regex-based conversion
+        # Fallback: plain text without the markup
         text = strip_tags(html_content)
         return text
 
@@ -168,17 +216,34 @@ def html_to_text(html_content):
     return strip_tags(html_content)
 
 
+# Markdown longer than this is converted without caching the result
+MARKDOWN_CACHE_MAX_LENGTH = 100_000
+
+# Markdown instances keep per-conversion state, so each thread gets its own
+_markdown_local = threading.local()
+
+
+def _convert_markdown(markdown_content):
+    converter = getattr(_markdown_local, 'converter', None)
+    if converter is None:
+        converter = _markdown_local.converter = markdown.Markdown(extensions=['extra', 'tables'])
+    return converter.reset().convert(markdown_content)
+
+
+@lru_cache(maxsize=1024)
+def _cached_markdown_to_html(markdown_content):
+    return _convert_markdown(markdown_content)
+
+
 def markdown_to_html(markdown_content):
     """Convert Markdown to HTML"""
-    return markdown.markdown(markdown_content, extensions=['extra', 'tables'])
+    if len(markdown_content) < MARKDOWN_CACHE_MAX_LENGTH:
+        return _cached_markdown_to_html(markdown_content)
+    return _convert_markdown(markdown_content)
 
 
 def text_to_html(text_content):
     """Convert plain text to HTML"""
-    # Escape HTML and wrap in paragraphs
-    from django.utils.html import escape
-    text_content = escape(text_content)
-    # Split by double newlines for paragraphs
-    paragraphs = text_content.split('\n\n')
-    html = '\n'.join(f'<p>{p.replace(chr(10), "<br>")}</p>' for p in paragraphs if p.strip())
-    return html
+    # Escape HTML, then split by double newlines for paragraphs
+    paragraphs = escape(text_content).split('\n\n')
+    return '\n'.join('<p>' + p.replace('\n', '<br>') + '</p>' for p in paragraphs if p.strip())
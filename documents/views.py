@@ -69,7 +69,8 @@ def create_document(request):
 @require_http_methods(["GET"])
 def document_editor(request, pk):
     """Main document editor view"""
-    document = get_object_or_404(Document, pk=pk)
+    # The four role checks below all read the prefetched permissions
+    document = get_object_or_404(Document.objects.select_related('owner').prefetch_related('permissions'), pk=pk)
     
     # Check permission
     if not document.has_permission(request.user, 'viewer'):
@@ -79,7 +80,7 @@ def document_editor(request, pk):
     user_role = document.get_user_role(request.user)
     can_edit = document.has_permission(request.user, 'editor')
     can_comment = document.has_permission(request.user, 'commenter')
-    is_owner = document.owner == request.user
+    is_owner = document.owner_id == request.user.id
     
     # Get collaborators
     collaborators = DocumentPermission.objects.filter(document=document).select_related('user')
@@ -129,7 +130,7 @@ def delete_document(request, pk):
     document = get_object_or_404(Document, pk=pk)
     
     # Check permission - only owner can delete
-    if document.owner != request.user:
+    if document.owner_id != request.user.id:
         return JsonResponse({'error': 'Only owner can delete'}, status=403)
     
     title = document.title
@@ -146,7 +147,7 @@ def share_document(request, pk):
     document = get_object_or_404(Document, pk=pk)
     
     # Check permission - only owner can share
-    if document.owner != request.user:
+    if document.owner_id != request.user.id:
         messages.error(request, 'Only owner can share.')
         return redirect('documents:editor', pk=pk)
     
@@ -167,7 +168,7 @@ def add_permission(request, pk):
     document = get_object_or_404(Document, pk=pk)
     
     # Check permission - only owner can share
-    if document.owner != request.user:
+    if document.owner_id != request.user.id:
         return JsonResponse({'error': 'Only owner can share'}, status=403)
     
     email = request.POST.get('email')
@@ -179,7 +180,7 @@ def add_permission(request, pk):
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)
     
-    if user == document.owner:
+    if user.id == document.owner_id:
         return JsonResponse({'error': 'Cannot share with yourself'}, status=400)
     
     # Create or update permission
@@ -217,7 +218,7 @@ def remove_permission(request, pk, user_id):
     document = get_object_or_404(Document, pk=pk)
     
     # Check permission - only owner can modify
-    if document.owner != request.user:
+    if document.owner_id != request.user.id:
         return JsonResponse({'error': 'Only owner can modify permissions'}, status=403)
     
     try:
@@ -252,7 +253,7 @@ def add_comment(request, pk):
     )
     
     # Notify owner if commenter is not owner
-    if document.owner != request.user:
+    if document.owner_id != request.user.id:
         Notification.objects.create(
             recipient=document.owner,
             notification_type='comment',
@@ -404,7 +405,7 @@ def import_document(request, pk):
     document = get_object_or_404(Document, pk=pk)
     
     # Check permission - only owner can import
-    if document.owner != request.user:
+    if document.owner_id != request.user.id:
         return JsonResponse({'error': 'Only owner can import'}, status=403)
     
     if 'file' not in request.FILES:
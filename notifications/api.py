@@ -8,16 +8,12 @@ from .models import Notification
 @permission_classes([IsAuthenticated])
 def notification_list(request):
     """List user's notifications"""
-    notifications = Notification.objects.filter(recipient=request.user).order_by('-created_at')[:50]
-    data = []
-    for notif in notifications:
-        data.append({
-            'id': notif.id,
-            'title': notif.title,
-            'message': notif.message,
-            'read': notif.read,
-            'created_at': notif.created_at.isoformat(),
-        })
+    # Rows come straight from a values() projection: only the five columns
+    # the client shows are read, and no model instances are built
+    rows = Notification.objects.filter(recipient=request.user).order_by('-created_at').values(
+        'id', 'title', 'message', 'read', 'created_at'
+    )[:50]
+    data = [{**row, 'created_at': row['created_at'].isoformat()} for row in rows]
     return Response(data)
 
 
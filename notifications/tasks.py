@@ -0,0 +1,45 @@
+"""
+Background tasks for notifications, run by the Celery worker
+"""
+import logging
+
+from celery import shared_task
+from django.contrib.contenttypes.models import ContentType
+
+from documents.models import Document
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def send_share_notifications(recipient_ids, document_id, role, sharer_username, document_title):
+    """Notify users that a document was shared with them"""
+    content_type = ContentType.objects.get_for_model(Document)
+    shares = Notification.objects.filter(notification_type='share', content_type=content_type, object_id=document_id)
+    # Sharing again (e.g. to change the role) doesn't notify twice
+    already_notified = set(shares.filter(recipient_id__in=recipient_ids).values_list('recipient_id', flat=True))
+    Notification.objects.bulk_create([
+        Notification(
+            recipient_id=recipient_id,
+            notification_type='share',
+            title='Document Shared',
+            message=f'{sharer_username} shared "{document_title}" with you as {role}',
+            content_type=content_type,
+            object_id=document_id,
+        )
+        for recipient_id in dict.fromkeys(recipient_ids) if recipient_id not in already_notified
+    ])
+
+
+def queue_share_notifications(recipient_ids, document_id, role, sharer_username, document_title):
+    """
+    Queue send_share_notifications for the worker, or write the notifications
+    in this process when the broker can't be reached
+    """
+    args = (recipient_ids, document_id, role, sharer_username, document_title)
+    try:
+        send_share_notifications.delay(*args)
+    except Exception:
+        logger.warning('Could not queue share notifications; writing them inline', exc_info=True)
+        send_share_notifications(*args)
@@ -15,15 +15,16 @@ from django.contrib.contenttypes.models import ContentType
 class NotificationModelTests(TestCase):
     """Test Notification model functionality"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='user',
             email='user@example.com',
             password='pass123'
         )
-        self.notification = Notification.objects.create(
-            recipient=self.user,
+        cls.notification = Notification.objects.create(
+            recipient=cls.user,
             notification_type='share',
             title='Document Shared',
             message='A document was shared with you'
@@ -71,24 +72,26 @@ class NotificationModelTests(TestCase):
 class NotificationAPITests(TestCase):
     """Test Notification API endpoints"""
     
-    def setUp(self):
+    client_class = APIClient
+    
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.client = APIClient()
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='user',
             email='user@example.com',
             password='pass123'
         )
         # Create some notifications
         Notification.objects.create(
-            recipient=self.user,
+            recipient=cls.user,
             notification_type='share',
             title='Document Shared 1',
             message='Message 1',
             read=False
         )
         Notification.objects.create(
-            recipient=self.user,
+            recipient=cls.user,
             notification_type='comment',
             title='New Comment',
             message='Message 2',
@@ -119,6 +122,9 @@ class NotificationAPITests(TestCase):
         self.assertEqual(len(response.data), 2)
         # Should be ordered by created_at descending
         self.assertEqual(response.data[0]['title'], 'New Comment')
+        self.assertEqual(set(response.data[0]), {'id', 'title', 'message', 'read', 'created_at'})
+        self.assertTrue(response.data[0]['read'])
+        self.assertIsInstance(response.data[0]['created_at'], str)
     
     def test_notification_list_unauthenticated(self):
         """Test listing notifications without authentication"""
@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import Count
+from django.db.models.functions import Substr
 from django.utils.html import format_html
 from django.urls import reverse
 from .models import Spreadsheet, SpreadsheetPermission, SpreadsheetComment, SpreadsheetVersion
@@ -23,23 +25,35 @@ class SpreadsheetAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """
+        Annotate the counts shown in the changelist instead of querying per row,
+        and leave data to be loaded only by the change form that shows it
+        """
+        return super().get_queryset(request).select_related('owner').defer('data').annotate(
+            _permission_count=Count('permissions', distinct=True),
+            _comment_count=Count('comments', distinct=True),
+        )
+    
     def permission_count(self, obj):
         """Count of users with access"""
-        count = obj.permissions.count()
+        count = obj._permission_count
         return format_html('<a href="{}?spreadsheet__id__exact={}">{}</a>',
                           reverse('admin:spreadsheets_spreadsheetpermission_changelist'),
                           obj.id,
                           count)
     permission_count.short_description = 'Shared With'
+    permission_count.admin_order_field = '_permission_count'
     
     def comment_count(self, obj):
         """Count of comments"""
-        count = obj.comments.count()
+        count = obj._comment_count
         return format_html('<a href="{}?spreadsheet__id__exact={}">{}</a>',
                           reverse('admin:spreadsheets_spreadsheetcomment_changelist'),
                           obj.id,
                           count)
     comment_count.short_description = 'Comments'
+    comment_count.admin_order_field = '_comment_count'
     
     def view_spreadsheet(self, obj):
         """Link to view spreadsheet"""
@@ -78,9 +92,17 @@ class SpreadsheetCommentAdmin(admin.ModelAdmin):
         return f"{col_letter}{obj.row + 1}"
     cell_location.short_description = 'Cell'
     
+    def get_queryset(self, request):
+        """Load only the changelist's columns; the comment body is cut down in SQL"""
+        return super().get_queryset(request).select_related('spreadsheet', 'user').only(
+            'id', 'sheet_name', 'row', 'column', 'created_at', 'resolved',
+            'spreadsheet__id', 'spreadsheet__title', 'user__id', 'user__username',
+        ).annotate(_content_preview=Substr('content', 1, 51))
+    
     def content_preview(self, obj):
         """Show preview of comment content"""
-        return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
+        preview = obj._content_preview
+        return preview[:50] + '...' if len(preview) > 50 else preview
     content_preview.short_description = 'Comment'
     
     def view_spreadsheet(self, obj):
@@ -95,6 +117,10 @@ class SpreadsheetVersionAdmin(admin.ModelAdmin):
     search_fields = ('spreadsheet__title', 'change_description')
     readonly_fields = ('created_at', 'data')
     
+    def get_queryset(self, request):
+        """Skip the data snapshots and spreadsheet data, which the changelist doesn't show"""
+        return super().get_queryset(request).select_related('spreadsheet', 'created_by').defer('data', 'spreadsheet__data')
+    
     fieldsets = (
         ('Version Information', {
             'fields': ('spreadsheet', 'version_number', 'created_by', 'change_description')
@@ -10,19 +10,21 @@ from .models import Spreadsheet
 def spreadsheet_list(request):
     """List user's spreadsheets"""
     try:
-        spreadsheets = Spreadsheet.objects.filter(owner=request.user)
-        data = []
-        for sheet in spreadsheets:
-            data.append({
-                'id': sheet.id,
-                'title': sheet.title,
-                    'created_at': sheet.created_at.isoformat() if sheet.created_at else None,
-                    'updated_at': sheet.updated_at.isoformat() if sheet.updated_at else None,
-                    'owner': {
-                        'id': sheet.owner.id,
-                        'username': sheet.owner.username,
-                    }
-            })
+        # A values() projection: the sheet data JSON is never read, and the
+        # owner's username comes from the same query instead of one per row
+        rows = Spreadsheet.objects.filter(owner=request.user).values(
+            'id', 'title', 'created_at', 'updated_at', 'owner_id', 'owner__username'
+        )
+        data = [{
+            'id': row['id'],
+            'title': row['title'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'owner': {
+                'id': row['owner_id'],
+                'username': row['owner__username'],
+            }
+        } for row in rows]
         return Response(data)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.8 on 2026-10-15 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spreadsheets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='spreadsheet',
+            index=models.Index(fields=['owner', '-updated_at'], name='spreadsheets_owner_updated_idx'),
+        ),
+    ]
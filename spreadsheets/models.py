@@ -7,6 +7,9 @@ import json
 class Spreadsheet(models.Model):
     """Main spreadsheet model"""
     
+    # Role ranks for has_permission; a role satisfies any requirement ranked at or below it
+    ROLE_LEVELS = {'owner': 4, 'editor': 3, 'commenter': 2, 'viewer': 1}
+    
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_spreadsheets')
     title = models.CharField(max_length=255)
     # Stores JSON structure: {"sheets": [{"name": "Sheet1", "data": [[...]]}]}
@@ -17,34 +20,42 @@ class Spreadsheet(models.Model):
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Serves the owner's spreadsheet list, which is ordered by -updated_at
+            models.Index(fields=['owner', '-updated_at'], name='spreadsheets_owner_updated_idx'),
+        ]
     
     def __str__(self):
         return self.title
     
     def has_permission(self, user, required_role='viewer'):
         """Check if user has required permission level"""
-        role_hierarchy = {'owner': 4, 'editor': 3, 'commenter': 2, 'viewer': 1}
-        
-        if self.owner == user:
-            return True
-        
-        try:
-            permission = self.permissions.get(user=user)
-            user_level = role_hierarchy.get(permission.role, 0)
-            required_level = role_hierarchy.get(required_role, 0)
-            return user_level >= required_level
-        except SpreadsheetPermission.DoesNotExist:
+        role = self.get_user_role(user)
+        if role is None:
             return False
+        return self.ROLE_LEVELS.get(role, 0) >= self.ROLE_LEVELS.get(required_role, 0)
     
     def get_user_role(self, user):
         """Get the role of a user for this spreadsheet"""
-        if self.owner == user:
+        # Compares ids so the owner row is never loaded for the check
+        if self.owner_id == user.id:
             return 'owner'
-        try:
-            permission = self.permissions.get(user=user)
-            return permission.role
-        except SpreadsheetPermission.DoesNotExist:
+        # Views check several roles per request; each user's is looked up once
+        # per instance, like prefetched relations are
+        role_cache = self.__dict__.setdefault('_role_cache', {})
+        if user.id not in role_cache:
+            role_cache[user.id] = self._lookup_shared_role(user)
+        return role_cache[user.id]
+    
+    def _lookup_shared_role(self, user):
+        # Reuse permissions prefetched by the caller; a filter() on the related
+        # manager would bypass that cache and query again
+        if 'permissions' in getattr(self, '_prefetched_objects_cache', {}):
+            for permission in self.permissions.all():
+                if permission.user_id == user.id:
+                    return permission.role
             return None
+        return self.permissions.filter(user_id=user.id).values_list('role', flat=True).first()
 
 
 class SpreadsheetPermission(models.Model):
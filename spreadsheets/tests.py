@@ -3,6 +3,7 @@ Comprehensive tests for the spreadsheets app
 Tests models, API endpoints, and business logic
 """
 
+from django.db import IntegrityError
 from django.test import TestCase
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
@@ -14,15 +15,16 @@ import json
 class SpreadsheetModelTests(TestCase):
     """Test Spreadsheet model functionality"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.spreadsheet = Spreadsheet.objects.create(
-            owner=self.owner,
+        cls.spreadsheet = Spreadsheet.objects.create(
+            owner=cls.owner,
             title='Test Spreadsheet',
             data={'sheets': [{'name': 'Sheet1', 'data': [['A1', 'B1'], ['A2', 'B2']]}]}
         )
@@ -63,20 +65,21 @@ class SpreadsheetModelTests(TestCase):
 class SpreadsheetPermissionModelTests(TestCase):
     """Test SpreadsheetPermission model"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.user = User.objects.create_user(
+        cls.user = User.objects.create_user(
             username='user',
             email='user@example.com',
             password='pass123'
         )
-        self.spreadsheet = Spreadsheet.objects.create(
-            owner=self.owner,
+        cls.spreadsheet = Spreadsheet.objects.create(
+            owner=cls.owner,
             title='Test Spreadsheet',
             data={'sheets': [{'name': 'Sheet1', 'data': [[]]}]}
         )
@@ -101,7 +104,7 @@ class SpreadsheetPermissionModelTests(TestCase):
         )
         
         # Try to create duplicate
-        with self.assertRaises(Exception):
+        with self.assertRaises(IntegrityError):
             SpreadsheetPermission.objects.create(
                 spreadsheet=self.spreadsheet,
                 user=self.user,
@@ -124,29 +127,35 @@ class SpreadsheetPermissionModelTests(TestCase):
 class SpreadsheetAPITests(TestCase):
     """Test Spreadsheet API endpoints"""
     
-    def setUp(self):
+    client_class = APIClient
+    
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.client = APIClient()
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.spreadsheet = Spreadsheet.objects.create(
-            owner=self.owner,
+        cls.spreadsheet = Spreadsheet.objects.create(
+            owner=cls.owner,
             title='Test Spreadsheet',
             data={'sheets': [{'name': 'Sheet1', 'data': [[]]}]}
         )
     
     def test_spreadsheet_list_authenticated(self):
         """Test listing spreadsheets when authenticated"""
+        Spreadsheet.objects.create(owner=self.owner, title='Second Spreadsheet')
         self.client.force_authenticate(user=self.owner)
-        response = self.client.get('/api/spreadsheets/', format='json')
+        with self.assertNumQueries(1) as queries:
+            response = self.client.get('/api/spreadsheets/', format='json')
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIsInstance(response.data, list)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['title'], 'Test Spreadsheet')
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.data[1]['title'], 'Test Spreadsheet')
+        self.assertEqual(response.data[1]['owner'], {'id': self.owner.id, 'username': 'owner'})
+        self.assertNotIn('"data"', queries.captured_queries[0]['sql'])
     
     def test_spreadsheet_list_unauthenticated(self):
         """Test listing spreadsheets without authentication"""
@@ -228,15 +237,16 @@ class SpreadsheetAPITests(TestCase):
 class SpreadsheetCommentModelTests(TestCase):
     """Test SpreadsheetComment model"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.spreadsheet = Spreadsheet.objects.create(
-            owner=self.owner,
+        cls.spreadsheet = Spreadsheet.objects.create(
+            owner=cls.owner,
             title='Test Spreadsheet',
             data={'sheets': [{'name': 'Sheet1', 'data': [[]]}]}
         )
@@ -261,15 +271,16 @@ class SpreadsheetCommentModelTests(TestCase):
 class SpreadsheetVersionModelTests(TestCase):
     """Test SpreadsheetVersion model"""
     
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """Set up test data"""
-        self.owner = User.objects.create_user(
+        cls.owner = User.objects.create_user(
             username='owner',
             email='owner@example.com',
             password='pass123'
         )
-        self.spreadsheet = Spreadsheet.objects.create(
-            owner=self.owner,
+        cls.spreadsheet = Spreadsheet.objects.create(
+            owner=cls.owner,
             title='Test Spreadsheet',
             data={'sheets': [{'name': 'Sheet1', 'data': [[]]}]}
         )
@@ -296,10 +307,99 @@ class SpreadsheetVersionModelTests(TestCase):
         )
         
         # Try to create duplicate version number
-        with self.assertRaises(Exception):
+        with self.assertRaises(IntegrityError):
             SpreadsheetVersion.objects.create(
                 spreadsheet=self.spreadsheet,
                 data={'sheets': [{'name': 'Sheet1', 'data': [[]]}]},
                 created_by=self.owner,
                 version_number=1
             )
+
+
+class ApplyCellChangesTests(TestCase):
+    """Test applying client cell changes to spreadsheet data"""
+    
+    def test_apply_changes_grows_grid(self):
+        """Test that changes outside the current grid extend it"""
+        from .utils import apply_cell_changes
+        data = {'sheets': [{'name': 'Sheet1', 'data': [['a']]}]}
+        apply_cell_changes(data, [
+            {'row': 0, 'col': 0, 'value': 'x'},
+            {'row': 2, 'col': 1, 'value': 5},
+        ])
+        self.assertEqual(data['sheets'][0]['data'], [['x'], [], ['', 5]])
+    
+    def test_apply_changes_skips_invalid(self):
+        """Test that malformed or out-of-range changes are ignored"""
+        from .utils import apply_cell_changes, MAX_ROWS
+        data = {'sheets': [{'name': 'Sheet1', 'data': [['a']]}]}
+        apply_cell_changes(data, [
+            {'row': 'x', 'col': 0, 'value': 1},
+            {'row': -1, 'col': 0, 'value': 1},
+            {'row': MAX_ROWS, 'col': 0, 'value': 1},
+            'not a change',
+        ])
+        self.assertEqual(data['sheets'][0]['data'], [['a']])
+    
+    def test_unserializable_values_skipped(self):
+        """Test that values JSON can't hold are dropped instead of failing the batch"""
+        from django.db.models import F
+        from .utils import apply_cell_changes, cell_changes_patch
+        changes = [
+            {'row': 0, 'col': 0, 'value': b'raw'},
+            {'row': 0, 'col': 0, 'value': 2 ** 64},
+            {'row': 0, 'col': 0, 'value': float('nan')},
+            {'row': 0, 'col': 0, 'value': 'ok'},
+        ]
+        data = {'sheets': [{'name': 'Sheet1', 'data': [['a']]}]}
+        apply_cell_changes(data, changes)
+        self.assertEqual(data['sheets'][0]['data'], [['ok']])
+        
+        owner = User.objects.create_user(username='patcher', password='pass123')
+        sheet = Spreadsheet.objects.create(owner=owner, title='Patch', data={'sheets': [{'name': 'Sheet1', 'data': [['a']]}]})
+        data, cells_exist = cell_changes_patch(F('data'), changes)
+        Spreadsheet.objects.filter(id=sheet.id).filter(*cells_exist).update(data=data)
+        sheet.refresh_from_db()
+        self.assertEqual(sheet.data['sheets'][0]['data'], [['ok']])
+    
+    def test_cell_changes_patch_updates_in_database(self):
+        """Test that in-grid changes are patched by a single UPDATE"""
+        from django.db.models import F
+        from .utils import cell_changes_patch
+        owner = User.objects.create_user(username='patcher', password='pass123')
+        sheet = Spreadsheet.objects.create(
+            owner=owner,
+            title='Patch',
+            data={'sheets': [{'name': 'Sheet1', 'data': [['a', 'b'], ['c', 'd']]}]}
+        )
+        data, cells_exist = cell_changes_patch(F('data'), [
+            {'row': 0, 'col': 1, 'value': 'B'},
+            {'row': 1, 'col': 0, 'value': 3},
+            {'row': 1, 'col': 0, 'value': None},
+        ])
+        
+        with self.assertNumQueries(1):
+            updated = Spreadsheet.objects.filter(id=sheet.id).filter(*cells_exist).update(data=data)
+        self.assertEqual(updated, 1)
+        sheet.refresh_from_db()
+        self.assertEqual(sheet.data['sheets'][0]['data'], [['a', 'B'], [None, 'd']])
+    
+    def test_cell_changes_patch_skips_cells_outside_grid(self):
+        """Test that the patch matches no rows when a cell would need the grid to grow"""
+        from django.db.models import F
+        from .utils import cell_changes_patch
+        owner = User.objects.create_user(username='patcher', password='pass123')
+        sheet = Spreadsheet.objects.create(
+            owner=owner,
+            title='Patch',
+            data={'sheets': [{'name': 'Sheet1', 'data': [['a']]}]}
+        )
+        data, cells_exist = cell_changes_patch(F('data'), [
+            {'row': 0, 'col': 0, 'value': 'x'},
+            {'row': 0, 'col': 1, 'value': 'y'},
+        ])
+        
+        self.assertEqual(Spreadsheet.objects.filter(id=sheet.id).filter(*cells_exist).update(data=data), 0)
+        sheet.refresh_from_db()
+        self.assertEqual(sheet.data['sheets'][0]['data'], [['a']])
+        self.assertIsNone(cell_changes_patch(F('data'), [{'row': 'bad'}]))
@@ -2,11 +2,34 @@
 Utilities for spreadsheet import/export and operations
 """
 import json
+import math
+import re
+import orjson
+from django.db import NotSupportedError
+from django.db.models import BooleanField, Func, JSONField, Value
 from openpyxl import Workbook, load_workbook
 from openpyxl.utils import get_column_letter
 import csv
 from io import StringIO, BytesIO
 
+# Bounds for cell edits arriving from clients, so a bad index can't
+# make the grid grow without limit
+MAX_SHEETS = 100
+MAX_ROWS = 10000
+MAX_COLUMNS = 1000
+# Integer cell values must fit orjson's 64-bit range (signed or unsigned)
+MIN_CELL_INT = -2 ** 63
+MAX_CELL_INT = 2 ** 64 - 1
+
+# Longest chain of cell updates patched in one SQL expression (SQLite caps
+# expression depth at 1000); larger batches use apply_cell_changes
+MAX_SQL_PATCH_CHANGES = 100
+
+# Formula patterns, compiled once rather than looked up on every evaluation
+_CELL_REF_RE = re.compile(r'([A-Z]+)(\d+)')
+_SUM_RE = re.compile(r'SUM\(([^)]+)\)')
+_AVERAGE_RE = re.compile(r'AVERAGE\(([^)]+)\)')
+
 
 def evaluate_formula(formula, data):
     """
@@ -20,9 +43,6 @@ def evaluate_formula(formula, data):
     
     try:
         # Replace cell references with values
-        import re
-        cell_pattern = r'[A-Z]+\d+'
-        
         def get_cell_value(match):
             cell_ref = match.group(0)
             row, col = _parse_cell_ref(cell_ref)
@@ -34,11 +54,11 @@ def evaluate_formula(formula, data):
                     return '0'
             return '0'
         
-        formula = re.sub(cell_pattern, get_cell_value, formula)
+        formula = _CELL_REF_RE.sub(get_cell_value, formula)
         
         # Handle SUM and AVERAGE functions
-        formula = re.sub(r'SUM\(([^)]+)\)', lambda m: str(_sum_range(m.group(1), data)), formula)
-        formula = re.sub(r'AVERAGE\(([^)]+)\)', lambda m: str(_average_range(m.group(1), data)), formula)
+        formula = _SUM_RE.sub(lambda m: str(_sum_range(m.group(1), data)), formula)
+        formula = _AVERAGE_RE.sub(lambda m: str(_average_range(m.group(1), data)), formula)
         
         # Evaluate the expression
         result = eval(formula)
@@ -49,8 +69,7 @@ def evaluate_formula(formula, data):
 
 def _parse_cell_ref(cell_ref):
     """Parse cell reference like 'A1' to (row, col)"""
-    import re
-    match = re.match(r'([A-Z]+)(\d+)', cell_ref)
+    match = _CELL_REF_RE.match(cell_ref)
     if match:
         col_letters = match.group(1)
         row = int(match.group(2)) - 1
@@ -163,3 +182,126 @@ def initialize_spreadsheet():
             'data': [[''] * 10 for _ in range(20)]  # 20 rows x 10 columns
         }]
     }
+
+
+def _is_valid_cell_value(value):
+    """Whether a cell value can be stored as JSON: a string, finite number, boolean or null"""
+    if value is None or isinstance(value, (str, bool)):
+        return True
+    if isinstance(value, int):
+        return MIN_CELL_INT <= value <= MAX_CELL_INT
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return False
+
+
+def _parse_cell_change(change):
+    """Return (sheet, row, col, value) for a valid change, else None"""
+    try:
+        sheet_index = int(change.get('sheet', 0))
+        row = int(change['row'])
+        col = int(change['col'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    if not (0 <= sheet_index < MAX_SHEETS and 0 <= row < MAX_ROWS and 0 <= col < MAX_COLUMNS):
+        return None
+    value = change.get('value')
+    # e.g. bytes from a msgpack frame, or an integer beyond 64 bits
+    if not _is_valid_cell_value(value):
+        return None
+    return sheet_index, row, col, value
+
+
+def is_valid_cell_change(change):
+    """Whether apply_cell_changes and cell_changes_patch would accept the change"""
+    return _parse_cell_change(change) is not None
+
+
+def apply_cell_changes(data, changes):
+    """
+    Apply cell changes in place and return the data.
+    Each change is {'row': int, 'col': int, 'value': ..., 'sheet': int (optional)};
+    the grid grows as needed and out-of-range or malformed changes are skipped.
+    """
+    sheets = data.setdefault('sheets', [])
+    for change in changes:
+        parsed = _parse_cell_change(change)
+        if parsed is None:
+            continue
+        sheet_index, row, col, value = parsed
+        
+        while len(sheets) <= sheet_index:
+            sheets.append({'name': f'Sheet{len(sheets) + 1}', 'data': [[]]})
+        grid = sheets[sheet_index].setdefault('data', [])
+        while len(grid) <= row:
+            grid.append([])
+        cells = grid[row]
+        if len(cells) <= col:
+            cells.extend([''] * (col + 1 - len(cells)))
+        cells[col] = value
+    return data
+
+
+class JSONSetCell(Func):
+    """Set one cell of a spreadsheet's data column inside the database"""
+    
+    output_field = JSONField()
+    
+    def __init__(self, expression, sheet, row, col, value):
+        self.cell = (sheet, row, col)
+        super().__init__(expression, Value(orjson.dumps(value).decode()))
+    
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError('JSONSetCell is only implemented for SQLite and PostgreSQL')
+    
+    def as_sqlite(self, compiler, connection, **extra_context):
+        data_sql, data_params = compiler.compile(self.source_expressions[0])
+        value_sql, value_params = compiler.compile(self.source_expressions[1])
+        path = '$.sheets[%d].data[%d][%d]' % self.cell
+        return f'JSON_SET({data_sql}, %s, JSON({value_sql}))', (*data_params, path, *value_params)
+    
+    def as_postgresql(self, compiler, connection, **extra_context):
+        data_sql, data_params = compiler.compile(self.source_expressions[0])
+        value_sql, value_params = compiler.compile(self.source_expressions[1])
+        path = '{sheets,%d,data,%d,%d}' % self.cell
+        return f'JSONB_SET({data_sql}, %s::text[], ({value_sql})::jsonb)', (*data_params, path, *value_params)
+
+
+class JSONCellExists(Func):
+    """True when the cell is already present in a spreadsheet's data column"""
+    
+    output_field = BooleanField()
+    
+    def __init__(self, expression, sheet, row, col):
+        self.cell = (sheet, row, col)
+        super().__init__(expression)
+    
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError('JSONCellExists is only implemented for SQLite and PostgreSQL')
+    
+    def as_sqlite(self, compiler, connection, **extra_context):
+        data_sql, data_params = compiler.compile(self.source_expressions[0])
+        path = '$.sheets[%d].data[%d][%d]' % self.cell
+        return f'JSON_TYPE({data_sql}, %s) IS NOT NULL', (*data_params, path)
+    
+    def as_postgresql(self, compiler, connection, **extra_context):
+        data_sql, data_params = compiler.compile(self.source_expressions[0])
+        path = '{sheets,%d,data,%d,%d}' % self.cell
+        return f'({data_sql} #> %s::text[]) IS NOT NULL', (*data_params, path)
+
+
+def cell_changes_patch(expression, changes):
+    """
+    Build a database-side patch for cell changes.
+    Returns (data_expression, conditions), where the conditions check that
+    every target cell already exists, since JSON_SET/jsonb_set can't pad the
+    grid the way apply_cell_changes does. Returns None when there is nothing
+    valid to patch or too many changes for one expression.
+    """
+    parsed = [p for p in map(_parse_cell_change, changes) if p is not None]
+    if not parsed or len(parsed) > MAX_SQL_PATCH_CHANGES:
+        return None
+    conditions = [JSONCellExists(expression, *cell) for cell in {p[:3] for p in parsed}]
+    for sheet_index, row, col, value in parsed:
+        expression = JSONSetCell(expression, sheet_index, row, col, value)
+    return expression, conditions
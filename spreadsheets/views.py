@@ -60,7 +60,8 @@ def create_spreadsheet(request):
 @require_http_methods(["GET"])
 def spreadsheet_editor(request, pk):
     """Main spreadsheet editor view"""
-    spreadsheet = get_object_or_404(Spreadsheet, pk=pk)
+    # The four role checks below all read the prefetched permissions
+    spreadsheet = get_object_or_404(Spreadsheet.objects.select_related('owner').prefetch_related('permissions'), pk=pk)
     
     # Check permission
     if not spreadsheet.has_permission(request.user, 'viewer'):
@@ -70,7 +71,7 @@ def spreadsheet_editor(request, pk):
     user_role = spreadsheet.get_user_role(request.user)
     can_edit = spreadsheet.has_permission(request.user, 'editor')
     can_comment = spreadsheet.has_permission(request.user, 'commenter')
-    is_owner = spreadsheet.owner == request.user
+    is_owner = spreadsheet.owner_id == request.user.id
     
     # Get collaborators
     collaborators = SpreadsheetPermission.objects.filter(spreadsheet=spreadsheet).select_related('user')
@@ -123,7 +124,7 @@ def delete_spreadsheet(request, pk):
     spreadsheet = get_object_or_404(Spreadsheet, pk=pk)
     
     # Check permission - only owner can delete
-    if spreadsheet.owner != request.user:
+    if spreadsheet.owner_id != request.user.id:
         return JsonResponse({'error': 'Only owner can delete'}, status=403)
     
     title = spreadsheet.title
@@ -140,7 +141,7 @@ def share_spreadsheet(request, pk):
     spreadsheet = get_object_or_404(Spreadsheet, pk=pk)
     
     # Check permission - only owner can share
-    if spreadsheet.owner != request.user:
+    if spreadsheet.owner_id != request.user.id:
         messages.error(request, 'Only owner can share.')
         return redirect('spreadsheets:editor', pk=pk)
     
@@ -161,7 +162,7 @@ def add_permission(request, pk):
     spreadsheet = get_object_or_404(Spreadsheet, pk=pk)
     
     # Check permission - only owner can share
-    if spreadsheet.owner != request.user:
+    if spreadsheet.owner_id != request.user.id:
         return JsonResponse({'error': 'Only owner can share'}, status=403)
     
     email = request.POST.get('email')
@@ -173,7 +174,7 @@ def add_permission(request, pk):
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)
     
-    if user == spreadsheet.owner:
+    if user.id == spreadsheet.owner_id:
         return JsonResponse({'error': 'Cannot share with yourself'}, status=400)
     
     # Create or update permission
@@ -211,7 +212,7 @@ def remove_permission(request, pk, user_id):
     spreadsheet = get_object_or_404(Spreadsheet, pk=pk)
     
     # Check permission - only owner can modify
-    if spreadsheet.owner != request.user:
+    if spreadsheet.owner_id != request.user.id:
         return JsonResponse({'error': 'Only owner can modify permissions'}, status=403)
     
     try:
@@ -252,7 +253,7 @@ def add_comment(request, pk):
     )
     
     # Notify owner if commenter is not owner
-    if spreadsheet.owner != request.user:
+    if spreadsheet.owner_id != request.user.id:
         Notification.objects.create(
             recipient=spreadsheet.owner,
             notification_type='comment',
@@ -407,7 +408,7 @@ def import_spreadsheet(request, pk):
     spreadsheet = get_object_or_404(Spreadsheet, pk=pk)
     
     # Check permission - only owner can import
-    if spreadsheet.owner != request.user:
+    if spreadsheet.owner_id != request.user.id:
         return JsonResponse({'error': 'Only owner can import'}, status=403)
     
     if 'file' not in request.FILES:
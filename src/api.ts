@@ -44,6 +44,8 @@ export const auth = {
 
 export const documents = {
   list: () => API.get('/documents/'),
+  // `next` links from a list page are absolute, so they bypass baseURL
+  listPage: (url: string) => API.get(url),
   create: (title: string) => API.post('/documents/create/', { title }),
   get: (id: number) => API.get(`/documents/${id}/`),
   update: (id: number, data: any) => API.post(`/documents/${id}/update/`, data),
@@ -54,6 +56,10 @@ export const documents = {
   share: (id: number, email: string, role: string = 'viewer') =>
     API.post(`/documents/${id}/permission/add/`, { email, role }),
   export: (id: number, format: string) => API.get(`/documents/${id}/export/${format}/`),
+  // DOCX is built by the Celery worker: start it, then poll `status_url`
+  // until it answers 200 with a signed, expiring download `url`
+  exportDocx: (id: number) => API.post(`/documents/${id}/export/docx/`),
+  exportStatus: (statusUrl: string) => API.get(statusUrl),
   import: (id: number, file: File) => {
     const form = new FormData()
     form.append('file', file)
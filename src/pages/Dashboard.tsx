@@ -1,4 +1,4 @@
-import { useState, useEffect, useCallback } from 'react'
+import { useState, useEffect, useCallback, useRef } from 'react'
 import { useNavigate } from 'react-router-dom'
 import { Plus, Trash2, Share2, FileText, Table, X, Crown, RefreshCw } from 'lucide-react'
 import { documents, spreadsheets } from '@/api'
@@ -8,6 +8,7 @@ interface Doc {
   id: number
   title: string
   created_at: string
+  updated_at?: string
   is_owner?: boolean
   owner: { id: number; username: string }
 }
@@ -16,6 +17,9 @@ export default function Dashboard() {
   const navigate = useNavigate()
   const { user } = useAuthStore()
   const [docs, setDocs] = useState<Doc[]>([])
+  // Cursor for the next page of documents, and whether the user has loaded past the first
+  const [docsNext, setDocsNext] = useState<string | null>(null)
+  const extraDocPagesRef = useRef(false)
   const [sheets, setSheets] = useState<Doc[]>([])
   const [loading, setLoading] = useState(true)
   const [refreshing, setRefreshing] = useState(false)
@@ -27,7 +31,15 @@ export default function Dashboard() {
           documents.list(),
           spreadsheets.list(),
         ])
-        setDocs(docsRes.data)
+        const firstPage: Doc[] = docsRes.data.results
+        if (extraDocPagesRef.current) {
+          // Refresh the first page but keep the older documents loaded below it
+          const ids = new Set(firstPage.map((d) => d.id))
+          setDocs((prev) => [...firstPage, ...prev.slice(firstPage.length).filter((d) => !ids.has(d.id))])
+        } else {
+          setDocs(firstPage)
+          setDocsNext(docsRes.data.next)
+        }
         setSheets(sheetsRes.data)
       } catch (error) {
         console.error('Failed to load files:', error)
@@ -51,6 +63,21 @@ export default function Dashboard() {
     return () => clearInterval(interval)
   }, [loadData, refreshing])
 
+  const handleLoadMoreDocs = async () => {
+    if (!docsNext) return
+    try {
+      const res = await documents.listPage(docsNext)
+      extraDocPagesRef.current = true
+      setDocs((prev) => {
+        const ids = new Set(prev.map((d) => d.id))
+        return [...prev, ...res.data.results.filter((d: Doc) => !ids.has(d.id))]
+      })
+      setDocsNext(res.data.next)
+    } catch (error) {
+      console.error('Failed to load more documents:', error)
+    }
+  }
+
   const handleCreateDoc = async () => {
     try {
       const res = await documents.create('Untitled Document')
@@ -216,6 +243,13 @@ export default function Dashboard() {
             })}
           </div>
         )}
+        {docsNext && (
+          <div className="text-center mt-4">
+            <button onClick={handleLoadMoreDocs} className="btn bg-gray-700 text-white hover:bg-gray-600">
+              Load more
+            </button>
+          </div>
+        )}
       </section>
 
       {/* Spreadsheets */}
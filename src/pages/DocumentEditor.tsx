@@ -7,6 +7,59 @@ import { Save, Share2, MoreVertical, Download } from 'lucide-react'
 import 'react-quill/dist/quill.snow.css'
 import WebSocketManager from '@/services/websocket'
 
+// DOCX exports are polled once a second, up to this many times
+const DOCX_EXPORT_MAX_POLLS = 60
+
+interface ContentPatch {
+  start: number
+  delete: number
+  length: number
+  insert: string
+}
+
+const isHighSurrogate = (code: number) => code >= 0xd800 && code <= 0xdbff
+const isLowSurrogate = (code: number) => code >= 0xdc00 && code <= 0xdfff
+
+// Describe the edit from oldHtml to newHtml as one splice (common prefix/suffix diff)
+function computePatch(oldHtml: string, newHtml: string): ContentPatch {
+  const maxShared = Math.min(oldHtml.length, newHtml.length)
+  let start = 0
+  while (start < maxShared && oldHtml[start] === newHtml[start]) {
+    start++
+  }
+  let suffix = 0
+  while (
+    suffix < maxShared - start &&
+    oldHtml[oldHtml.length - 1 - suffix] === newHtml[newHtml.length - 1 - suffix]
+  ) {
+    suffix++
+  }
+  // Keep surrogate pairs whole so the splice stays valid UTF-16 on the wire
+  if (start > 0 && isHighSurrogate(oldHtml.charCodeAt(start - 1))) {
+    start--
+  }
+  if (suffix > 0 && isLowSurrogate(oldHtml.charCodeAt(oldHtml.length - suffix))) {
+    suffix--
+  }
+  return {
+    start,
+    delete: oldHtml.length - start - suffix,
+    length: oldHtml.length,
+    insert: newHtml.slice(start, newHtml.length - suffix),
+  }
+}
+
+// Apply splices to html, or return null if they were made against different content
+function applyPatches(html: string, ops: ContentPatch[]): string | null {
+  for (const op of ops) {
+    if (html.length !== op.length) {
+      return null
+    }
+    html = html.slice(0, op.start) + op.insert + html.slice(op.start + op.delete)
+  }
+  return html
+}
+
 export default function DocumentEditor() {
   const { id } = useParams()
   const { user } = useAuthStore()
@@ -21,6 +74,7 @@ export default function DocumentEditor() {
   const wsRef = useRef<WebSocketManager | null>(null)
   const quillRef = useRef<ReactQuill | null>(null)
   const saveTimeoutRef = useRef<ReturnType<typeof setTimeout> | null>(null)
+  const titleSaveTimeoutRef = useRef<ReturnType<typeof setTimeout> | null>(null)
   const lastContentRef = useRef<string>('')
   const lastTitleRef = useRef<string>('')
   const isUpdatingFromRemote = useRef(false)
@@ -65,16 +119,17 @@ export default function DocumentEditor() {
       wsRef.current.connect()
 
       // Handle content updates from other users - IMMEDIATE sync
-      wsRef.current.on('content_update', (data: any) => {
-        if (quillRef.current && data.content && data.content !== lastContentRef.current) {
+      const applyRemoteContent = (remoteContent: string) => {
+        if (quillRef.current && remoteContent && remoteContent !== lastContentRef.current) {
           const quill = quillRef.current.getEditor()
           const currentContent = quill.root.innerHTML
+          // Splices are computed against the room's copy, so track it even if Quill already shows it
+          lastContentRef.current = remoteContent
           
           // Only update if content is different to avoid loops
-          if (data.content !== currentContent) {
+          if (remoteContent !== currentContent) {
             // Set flag BEFORE making any changes
             isUpdatingFromRemote.current = true
-            lastContentRef.current = data.content
             
             // Preserve cursor position
             const selection = quill.getSelection()
@@ -84,7 +139,7 @@ export default function DocumentEditor() {
             quill.disable()
             
             // REPLACE content entirely using setContents with clipboard conversion
-            const delta = quill.clipboard.convert(data.content)
+            const delta = quill.clipboard.convert(remoteContent)
             quill.setContents(delta, 'silent')
             
             // Re-enable if it wasn't read-only
@@ -109,6 +164,38 @@ export default function DocumentEditor() {
             }, 50)
           }
         }
+      }
+
+      // Send the whole HTML when splices can't be applied on one side or the other
+      const sendFullContent = () => {
+        if (quillRef.current && wsRef.current && (userRole === 'owner' || userRole === 'editor')) {
+          const html = quillRef.current.getEditor().root.innerHTML
+          lastContentRef.current = html
+          wsRef.current.send({
+            type: 'content_update',
+            content: html,
+            document_id: Number(id)
+          })
+        }
+      }
+
+      wsRef.current.on('content_update', (data: any) => {
+        applyRemoteContent(data.content)
+      })
+
+      // Other users' edits usually arrive as splices of the previous HTML
+      wsRef.current.on('content_patch', (data: any) => {
+        const patched = applyPatches(lastContentRef.current, data.ops || [])
+        if (patched === null) {
+          sendFullContent()
+        } else {
+          applyRemoteContent(patched)
+        }
+      })
+
+      // The server couldn't apply our last splice
+      wsRef.current.on('content_resync', () => {
+        sendFullContent()
       })
 
       // Handle title updates from other users
@@ -163,32 +250,42 @@ export default function DocumentEditor() {
             
             // Only send if content actually changed
             if (html !== lastContentRef.current) {
+              const patch = computePatch(lastContentRef.current, html)
               lastContentRef.current = html
               
               // Send IMMEDIATELY via WebSocket - no delays, no flags
+              // A keystroke is a small splice; fall back to the whole HTML when it isn't
               if (wsRef.current && (userRole === 'owner' || userRole === 'editor')) {
-                wsRef.current.send({
-                  type: 'content_update',
-                  content: html,
-                  document_id: Number(id)
-                })
-              }
-              
-              // Debounce database save (separate from real-time sync)
-              if (saveTimeoutRef.current) {
-                clearTimeout(saveTimeoutRef.current)
-              }
-              saveTimeoutRef.current = setTimeout(async () => {
-                try {
-                  await documents.update(Number(id), {
+                if (patch.insert.length < html.length / 2) {
+                  wsRef.current.send({ type: 'content_patch', ...patch })
+                } else {
+                  wsRef.current.send({
+                    type: 'content_update',
                     content: html,
-                    title: title
+                    document_id: Number(id)
                   })
-                  console.log('Auto-saved to database')
-                } catch (error) {
-                  console.error('Auto-save failed:', error)
                 }
-              }, 2000)
+              }
+              
+              // The server saves edits it receives over the socket; only
+              // fall back to a debounced REST save while disconnected
+              if (wsRef.current?.ws?.readyState !== WebSocket.OPEN) {
+                if (saveTimeoutRef.current) {
+                  clearTimeout(saveTimeoutRef.current)
+                }
+                saveTimeoutRef.current = setTimeout(async () => {
+                  try {
+                    // Title saves go separately (handleTitleChange), so an
+                    // older title captured here can't overwrite a newer one
+                    await documents.update(Number(id), {
+                      content: html
+                    })
+                    console.log('Auto-saved to database')
+                  } catch (error) {
+                    console.error('Auto-save failed:', error)
+                  }
+                }, 2000)
+              }
             }
           }
         }
@@ -207,6 +304,9 @@ export default function DocumentEditor() {
       wsRef.current?.disconnect()
     if (saveTimeoutRef.current) {
       clearTimeout(saveTimeoutRef.current)
+    }
+    if (titleSaveTimeoutRef.current) {
+      clearTimeout(titleSaveTimeoutRef.current)
     }
       // Remove Quill listeners
       if (quillRef.current && textChangeHandler) {
@@ -267,14 +367,16 @@ export default function DocumentEditor() {
           })
         }
         
-        // Debounce database save (separate from real-time sync)
-        if (saveTimeoutRef.current) {
-          clearTimeout(saveTimeoutRef.current)
+        // Debounce database save (separate from real-time sync). Only the
+        // title is sent: content is saved by the socket (or the content
+        // autosave while disconnected), and the content captured here may
+        // already be stale by the time this fires
+        if (titleSaveTimeoutRef.current) {
+          clearTimeout(titleSaveTimeoutRef.current)
         }
-        saveTimeoutRef.current = setTimeout(async () => {
+        titleSaveTimeoutRef.current = setTimeout(async () => {
           try {
             await documents.update(Number(id), {
-              content: content,
               title: newTitle
             })
             console.log('Title auto-saved to database')
@@ -343,6 +445,27 @@ export default function DocumentEditor() {
     }
   }
 
+  const handleDownloadDocx = async () => {
+    try {
+      // The server builds the file in the background; poll until it's ready
+      const started = await documents.exportDocx(Number(id))
+      let res = await documents.exportStatus(started.data.status_url)
+      // Give up after about a minute, e.g. when no worker is running
+      for (let attempt = 1; res.status === 202; attempt++) {
+        if (attempt > DOCX_EXPORT_MAX_POLLS) {
+          alert('The export is taking too long. Please try again later.')
+          return
+        }
+        await new Promise((resolve) => setTimeout(resolve, 1000))
+        res = await documents.exportStatus(started.data.status_url)
+      }
+      // Signed, short-lived link; the browser downloads it as an attachment
+      window.location.href = res.data.url
+    } catch (error: any) {
+      alert(error.response?.data?.error || 'Failed to export document')
+    }
+  }
+
   const canEdit = userRole === 'owner' || userRole === 'editor'
 
   if (loading) {
@@ -422,6 +545,19 @@ export default function DocumentEditor() {
                   <Download size={16} />
                   Download as .txt
                 </button>
+                <button
+                  type="button"
+                  onClick={(e) => {
+                    e.preventDefault()
+                    e.stopPropagation()
+                    handleDownloadDocx()
+                    setShowMenu(false)
+                  }}
+                  className="w-full text-left px-4 py-2 text-black hover:bg-gray-100 flex items-center gap-2 transition-colors cursor-pointer"
+                >
+                  <Download size={16} />
+                  Download as .docx
+                </button>
               </div>
             )}
           </div>
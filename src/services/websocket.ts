@@ -24,7 +24,12 @@ class WebSocketManager {
 
       this.ws.onmessage = (event) => {
         const data = JSON.parse(event.data)
-        this.emit(data.type, data)
+        // Broadcast bursts arrive coalesced into a single batch frame
+        if (data.type === 'batch') {
+          data.events.forEach((item: any) => this.emit(item.type, item))
+        } else {
+          this.emit(data.type, data)
+        }
       }
 
       this.ws.onerror = (error) => {